@@ -1,46 +1,55 @@
+import time
+_T0 = time.perf_counter()
+
+import functools
 import logging
 import os
 from threading import Thread
-import time
 
-import yaml
-from flask import Flask, abort, jsonify, redirect, render_template, request, url_for
+from flask import Flask, Response, abort, g, jsonify, redirect, render_template, request, url_for
+from markupsafe import Markup
 
 import app_runtime
+import config
+import control
+import diagnostics
+import log_pipeline
+import static_assets
 from classes.Scheduler import Scheduler
 
+startup = config.StartupTimer(_T0)
+startup.mark("imports")
+
 # ----------------------------
 # Config
 # ----------------------------
 CONF_PATH = os.environ.get("ZONES_CONF", "zones.yaml")
-with open(CONF_PATH, "r", encoding="utf-8") as f:
-    CONF = yaml.safe_load(f)
-
-_prefix = CONF["mqtt"].get("mqtt_topic_prefix", "sprinkler")
-CONF["mqtt"]["topics"] = {
-    "set":   f"{_prefix}/{{channel}}/set",
-    "get":   f"{_prefix}/{{channel}}/get",
-    "state": f"{_prefix}/+/get",
-}
-
-
-ZONES = CONF["zones"]  # [{'id': 1, 'name': 'Előkert', 'channel': 31}, {'id': 2, 'name': 'Oldalkert', 'channel': 32}, {'id': 3, 'name': 'Hátsókert', 'channel': 33}]
-ZONES_BY_ID = {z["id"]: z for z in ZONES}  # {1: {'id': 1, 'name': 'Előkert', 'channel': 31}, 2: {'id': 2, 'name': 'Oldalkert', 'channel': 32}, 3: {'id': 3, 'name': 'Hátsókert', 'channel': 33}}
-FAILSAFE_MAX = int(CONF.get("failsafe", {}).get("max_seconds", 1800)) # 600
-POLL_SEC = int(CONF.get("failsafe", {}).get("poll_seconds", 3))
-SET_TMPL = CONF["mqtt"]["topics"]["set"]  # "sprinkler/{channel}/set"
-STATE_SUB = CONF["mqtt"]["topics"]["state"] # "sprinkler/+/get"
-TIMEZONE = CONF ["timezone"]  #"Europe/Budapest"
-
-app_runtime.init_runtime(CONF)  #mqtttc indítás, és SPRINKLER_BY_ID inicializálás
-logging.basicConfig(level=logging.DEBUG)
+CONF, COMPILED = config.load_conf(CONF_PATH)  # validated + compiled once, cached on disk
+startup.mark("config")
+
+
+POLL_SEC = COMPILED.poll_sec
+SCHEDULER_HEARTBEAT_SEC = 10
+TIMEZONE = COMPILED.timezone  #"Europe/Budapest"
+
+# Queue-based logging: callers never block on stderr/SD-card I/O
+LOGS = log_pipeline.setup_logging(CONF.get("logging"))
 app_runtime.logger = logging.getLogger(__name__)
-                
+
+# Default site from zones.yaml, then every extra garden listed under `sites:`
+app_runtime.init_runtime(CONF, COMPILED, name=CONF.get("site_name"), conf_path=CONF_PATH)
+for _s in CONF.get("sites", []):
+    _sconf, _scompiled = config.load_conf(_s["conf"])
+    app_runtime.init_runtime(_sconf, _scompiled, site_id=_s["id"],
+                             name=_s.get("name"), conf_path=_s["conf"])
+startup.mark("runtime")
+
 
 sched = Scheduler(timezone=TIMEZONE, logger=app_runtime.logger)
+startup.mark("scheduler")
 
 # ----------------------------
-# Program helpers
+# Program helpers (every helper works on one classes.Site.Site)
 # ----------------------------
 _DAY_HU = {"mon": "H", "tue": "K", "wed": "Sze", "thu": "Cs", "fri": "P", "sat": "Szo", "sun": "V"}
 
@@ -59,19 +68,47 @@ def _schedule_summary(prog: dict) -> str:
     return "–"
 
 
-def _steps_summary(prog: dict) -> str:
+def _steps_summary(prog: dict, site) -> str:
     parts = []
+    zones_by_id = site.compiled.zones_by_id
     for step in prog.get("steps", []):
-        zone = ZONES_BY_ID.get(step["zone_id"])
-        name = zone["name"] if zone else f"Zóna {step['zone_id']}"
+        zone = zones_by_id.get(step["zone_id"])
+        name = zone.name if zone else f"Zóna {step['zone_id']}"
         parts.append(f"{name} {step['minutes']}p")
     return " → ".join(parts)
 
 
-def _register_job(prog: dict) -> None:
+def _transition_summary(prog: dict) -> str:
+    """Shown under the steps when the program does not use the default 2 s pause."""
+    if not prog.get("transition"):
+        return ""
+    mode, ms = config.program_transition(prog["transition"])
+    if mode == "overlap":
+        return f"Zónaváltás: {ms} ms átfedés"
+    if mode == "zero_gap":
+        return "Zónaváltás: szünet nélkül"
+    return f"Zónaváltás: {ms} ms szünet"
+
+
+def _site_arg(site):
+    """Value for the jobs' `site_id` kwarg (None keeps default-site jobs unchanged)."""
+    return None if site.is_default else site.id
+
+
+@functools.lru_cache(maxsize=None)
+def _cron_trigger(tz: str, hour: int, minute: int, day_of_week: str | None = None):
+    """
+    One trigger per distinct schedule, shared by every job using it: a
+    CronTrigger is immutable and ~2 KB, the job around it a few hundred bytes.
+    """
+    from apscheduler.triggers.cron import CronTrigger
+    return CronTrigger(hour=hour, minute=minute, day_of_week=day_of_week, timezone=tz)
+
+
+def _register_job(prog: dict, site) -> None:
     from jobs import start_scheduled_program
     pid = prog["id"]
-    job_id = f"program:{pid}"
+    job_id = site.job_id(pid)
     try:
         sched.scheduler.remove_job(job_id)
     except Exception:
@@ -84,20 +121,21 @@ def _register_job(prog: dict) -> None:
     hour, minute = (int(x) for x in time_str.split(":"))
     rain_skip = prog.get("rain_skip", False)
     kw = {"program_id": pid, "rain_skip": rain_skip}
+    if not site.is_default:
+        kw["site_id"] = site.id
+    tz = site.compiled.timezone
     if stype == "daily":
         sched.scheduler.add_job(
-            start_scheduled_program, "cron",
-            id=job_id, name=prog["name"], replace_existing=True,
-            kwargs=kw, hour=hour, minute=minute,
+            start_scheduled_program, _cron_trigger(tz, hour, minute),
+            id=job_id, name=prog["name"], replace_existing=True, kwargs=kw,
         )
     elif stype == "weekly":
         days = s.get("days", [])
         if not days:
             return
         sched.scheduler.add_job(
-            start_scheduled_program, "cron",
-            id=job_id, name=prog["name"], replace_existing=True,
-            kwargs=kw, day_of_week=",".join(days), hour=hour, minute=minute,
+            start_scheduled_program, _cron_trigger(tz, hour, minute, ",".join(days)),
+            id=job_id, name=prog["name"], replace_existing=True, kwargs=kw,
         )
     elif stype == "once":
         from datetime import datetime
@@ -106,7 +144,7 @@ def _register_job(prog: dict) -> None:
         if not date_str:
             return
         run_date = datetime.fromisoformat(f"{date_str}T{time_str}:00").replace(
-            tzinfo=ZoneInfo(TIMEZONE)
+            tzinfo=ZoneInfo(tz)
         )
         sched.scheduler.add_job(
             start_scheduled_program, "date",
@@ -115,110 +153,334 @@ def _register_job(prog: dict) -> None:
         )
 
 
-def _save_conf() -> None:
-    """Write config back to zones.yaml, stripping runtime-only keys."""
-    mqtt_clean = {k: v for k, v in CONF["mqtt"].items() if k != "topics"}
-    conf_to_save = {**CONF, "mqtt": mqtt_clean, "programs": list(app_runtime.programs.values())}
-    with open(CONF_PATH, "w", encoding="utf-8") as f:
-        yaml.dump(conf_to_save, f, allow_unicode=True, sort_keys=False, default_flow_style=False)
+def _unregister_job(pid: int, site) -> None:
+    try:
+        sched.scheduler.remove_job(site.job_id(pid))
+    except Exception:
+        pass
 
 
-def _programs_view() -> list:
+def _job_key(prog: dict) -> tuple:
+    """Everything a program's APScheduler job is built from, except its name."""
+    s = prog.get("schedule") or {}
+    return (bool(prog.get("active", False)), s.get("type", "daily"), s.get("time", "06:00"),
+            tuple(s.get("days") or ()), s.get("date", ""), bool(prog.get("rain_skip", False)))
+
+
+def _reschedule(old: dict | None, prog: dict, site) -> bool:
+    """
+    Bring `prog`'s job up to date after an edit: re-register it only when the
+    schedule changed (True), otherwise at most rename the existing job.
+    """
+    if old is None or _job_key(old) != _job_key(prog):
+        _register_job(prog, site)
+        return True
+    if old.get("name") != prog.get("name"):
+        try:
+            sched.scheduler.modify_job(site.job_id(prog["id"]), name=prog["name"])
+        except Exception:
+            pass  # inactive / weekly without days: there is no job
+    return False
+
+
+def _sync_programs(site, programs: list, prune: bool = True, dry_run: bool = False) -> dict:
+    """
+    Make `programs` (validated dicts with ids) the site's program set: diff
+    against the current one, persist once, and touch only the jobs whose
+    schedule changed. With prune=False programs missing from the list are
+    kept. Returns the counts of the diff.
+    """
+    started = time.perf_counter()
+    old = site.programs
+    new = {p["id"]: config.compact(p) for p in programs}
+    if not prune:
+        new = {**old, **new}
+    added = [pid for pid in new if pid not in old]
+    updated = [pid for pid in new if pid in old and old[pid] != new[pid]]
+    removed = [pid for pid in old if pid not in new]
+    result = {"added": len(added), "updated": len(updated), "removed": len(removed),
+              "unchanged": len(new) - len(added) - len(updated), "rescheduled": 0,
+              "saved": False, "dry_run": dry_run}
+    if not dry_run and (added or updated or removed or list(old) != list(new)):
+        site.programs = new
+        _save_conf(site)
+        result["saved"] = True
+        for pid in removed:
+            _unregister_job(pid, site)
+        for pid in added + updated:
+            result["rescheduled"] += _reschedule(old.get(pid), new[pid], site)
+    result["seconds"] = round(time.perf_counter() - started, 4)
+    return result
+
+
+def _save_conf(site) -> None:
+    """Write the site's config back to its YAML (and cache), stripping runtime-only keys."""
+    config.save_conf(site.conf_path, {**site.conf, "programs": list(site.programs.values())})
+    if HA is not None:
+        HA.publish_programs(site)
+
+
+def _programs_view(site) -> list:
     jobs_by_id = {j.id: j for j in sched.scheduler.get_jobs()}
     result = []
-    for prog in app_runtime.programs.values():
-        job = jobs_by_id.get(f"program:{prog['id']}")
+    for prog in site.programs.values():
+        job = jobs_by_id.get(site.job_id(prog["id"]))
         next_run = job.next_run_time.strftime("%Y-%m-%d %H:%M") if job and job.next_run_time else "–"
         result.append({
             **prog,
             "next_run": next_run,
             "schedule_summary": _schedule_summary(prog),
-            "steps_summary": _steps_summary(prog),
+            "steps_summary": _steps_summary(prog, site),
+            "transition_summary": _transition_summary(prog),
         })
     return result
 
 
-def _render_programs_partial():
+def _render_programs_partial(form_prog: dict | None = None, form_errors: list[str] | None = None):
+    """`form_prog` / `form_errors`: a rejected form submission, shown again open with its errors."""
+    site = g.site
     return render_template("_programs_partial.html",
-                           programs=_programs_view(),
-                           zones=ZONES,
-                           failsafe_max=FAILSAFE_MAX)
+                           programs=_programs_view(site),
+                           zones=site.compiled.zones,
+                           failsafe_max=site.failsafe_max,
+                           form_prog=form_prog,
+                           form_errors=form_errors or [])
+
+
+def _program_steps(site, prog: dict) -> list[tuple[int, int]]:
+    return config.program_steps(prog, site.failsafe_max)
 
 
 # Load programs from config
-for _p in CONF.get("programs", []):
-    app_runtime.programs[_p["id"]] = _p
-    _register_job(_p)
+for _site in app_runtime.SITES.values():
+    for _p in _site.conf.get("programs", []):
+        _site.programs[_p["id"]] = _p
+        _register_job(_p, _site)
+startup.mark("programs")
+
+
+def _ha_resume_program(site, steps, name) -> None:
+    sched.adhoc_program_run(steps=steps, program_id="takeover", name=name, site_id=_site_arg(site))
+
+
+def _ha_apply_programs(site, programs: list) -> None:
+    """Store the leader's program list on a standby: persist once, reschedule changed jobs."""
+    _sync_programs(site, programs)
+
+
+# Hot standby (ha.py) — only with `ha:` in zones.yaml
+HA = None
+if CONF.get("ha") is not None:
+    import ha
+    HA = ha.HotStandby(CONF["ha"], app_runtime.SITES, app_runtime.mqttc,
+                       resume_program=_ha_resume_program, apply_programs=_ha_apply_programs,
+                       logger=app_runtime.logger)
+    HA.start()
+
+# Stall watchdog + systemd notify (diagnostics.py); started in __main__ once all threads run
+WATCHDOG = diagnostics.Watchdog(CONF.get("watchdog"), app_runtime.heartbeats, logger=app_runtime.logger)
+WATCHDOG.watch_heartbeat("failsafe", WATCHDOG.failsafe_late,
+                         thread=lambda: app_runtime._failsafe_thread, critical=True)
+WATCHDOG.watch_heartbeat("scheduler", 3 * SCHEDULER_HEARTBEAT_SEC)
+for _client in app_runtime._mqtt_pool.values():
+    WATCHDOG.watch_thread(f"mqtt:{_client.host}", lambda c=_client: c._thread)
+WATCHDOG.watch_bus(app_runtime.bus)
+sched.add_heartbeat(SCHEDULER_HEARTBEAT_SEC)
+
+
+def _control_run_program(site, pid: int) -> bool:
+    prog = site.programs.get(pid)
+    if prog is None:
+        return False
+    steps = _program_steps(site, prog)
+    if steps:
+        sched.adhoc_program_run(steps=steps, program_id=pid, name=prog["name"], site_id=_site_arg(site))
+    return True
+
+
+# Local control socket for sprinklerctl.py (control.py); started in __main__
+CONTROL = control.ControlServer(CONF.get("control"), app_runtime.SITES,
+                                run_program=_control_run_program, logger=app_runtime.logger)
 
 # ----------------------------
 # Flask API
 # ----------------------------
 app = Flask(__name__)
 
+# Fingerprinted + gzip/brotli copies of static/, served from memory at /assets/
+ASSETS = static_assets.StaticAssets(app.static_folder, logger=app_runtime.logger).build()
+startup.mark("assets")
+
+
+def site_route(rule: str, methods: list[str]):
+    """Register a view for the default site at `rule` and for any site at /sites/<site_id>`rule`."""
+    def deco(f):
+        app.route(rule, methods=methods)(f)
+        app.route(f"/sites/<site_id>{rule}", methods=methods)(f)
+        return f
+    return deco
+
+
+@app.url_value_preprocessor
+def _pull_site(endpoint, values):
+    site_id = values.pop("site_id", None) if values else None
+    g.site = app_runtime.get_site(site_id)
+    if g.site is None:
+        abort(404)
+
+
+@app.url_defaults
+def _add_site(endpoint, values):
+    # url_for() inside a site-scoped request stays within that site
+    site = g.get("site")
+    if (site is not None and not site.is_default and "site_id" not in values
+            and app.url_map.is_endpoint_expecting(endpoint, "site_id")):
+        values["site_id"] = site.id
+
+
+@app.before_request
+def _standby_read_only():
+    # A standby mirrors the leader; changes go to the leader's dashboard
+    site = g.get("site")
+    if site is not None and site.standby and request.method != "GET":
+        return jsonify({"errors": [f"standby node — the leader is {HA.leader if HA else '?'}"]}), 409
+
+
+@app.context_processor
+def _site_context():
+    return {"site": g.get("site"), "sites": app_runtime.SITES, "ha": HA}
+
 
+def asset_url(filename: str) -> str:
+    url_name = ASSETS.url_name(filename)
+    if url_name is None:
+        return url_for("static", filename=filename)
+    return url_for("asset", name=url_name)
 
-@app.get("/")
+
+app.jinja_env.globals["asset_url"] = asset_url
+
+
+@app.route("/assets/<path:name>", methods=["GET"])
+def asset(name):
+    a = ASSETS.lookup(name)
+    if a is None:
+        abort(404)
+    enc = ASSETS.negotiate(a, request.accept_encodings)
+    resp = Response(a.variants[enc], mimetype=a.mimetype)
+    if enc != "identity":
+        resp.headers["Content-Encoding"] = enc
+    resp.headers["Cache-Control"] = static_assets.CACHE_CONTROL
+    resp.headers["Vary"] = "Accept-Encoding"
+    resp.set_etag(f"{a.digest}-{enc}")
+    return resp.make_conditional(request)
+
+
+@site_route("/", methods=["GET"])
 def dashboard():
-    any_zone_on = any(sp.state == 1 for sp in app_runtime.SPRINKLER_BY_ID.values())
+    site = g.site
+    any_zone_on = any(sp.state == 1 for sp in site.sprinkler_by_id.values())
     return render_template(
         "dashboard.html",
-        zones=ZONES,
-        poll_sec=POLL_SEC,
-        dry_run=app_runtime.DRY_RUN,
+        zones=site.compiled.zones,
+        poll_sec=site.compiled.poll_sec,
+        dry_run=site.dry_run,
         any_zone_on=any_zone_on,
-        last_adhoc_steps=app_runtime.last_adhoc_steps,
-        programs=_programs_view(),
-        failsafe_max=FAILSAFE_MAX,
+        last_adhoc_steps=site.last_adhoc_steps,
+        programs=_programs_view(site),
+        failsafe_max=site.failsafe_max,
+        water=_water_summary(site),
     )
 
 
-@app.get("/partial/zones")
-def partial_zones():
-    remaining_by_id = {
-        zid: app_runtime.remaining(zid)
-        for zid in app_runtime.SPRINKLER_BY_ID
-    }
-    app_runtime.logger.debug("partial_zones remaining_by_id=%r", remaining_by_id)
-
-    any_zone_on = any(sp.state == 1 for sp in app_runtime.SPRINKLER_BY_ID.values())
+# (site id, zone id, oob) → (state key, rendered card); one entry per zone and variant
+_card_cache: dict[tuple[str, int, bool], tuple[str, Markup]] = {}
 
-    cp = app_runtime.current_program
-    program_zone_id = None
-    if cp and cp["current_step"] > 0:
-        idx = cp["current_step"] - 1
-        if 0 <= idx < len(cp["steps"]):
-            program_zone_id = cp["steps"][idx][0]
 
-    return render_template(
-        "_zones_partial.html",
-        zones=ZONES,
-        sprinklers=app_runtime.SPRINKLER_BY_ID,
-        remaining_by_id=remaining_by_id,
-        poll_sec=POLL_SEC,
-        failsafe_max=FAILSAFE_MAX,
-        any_zone_on=any_zone_on,
-        current_program=cp,
-        program_zone_id=program_zone_id,
-    )
+def _zone_cards(site, oob: bool = False, known: dict | None = None) -> list[tuple[int, str, Markup]]:
+    """
+    (zone id, key, html) for every zone card. A card depends only on on/off,
+    program membership and when its run ends (the countdown itself runs in
+    the browser from data-ends-at), so it is re-rendered only when that key
+    changes. `oob` renders the hx-swap-oob variant (cached separately);
+    cards whose key matches `known` (zone id → key the page shows) are left out.
+    """
+    program_zone_id = site.current_program_zone_id()
+    out = []
+    for z in site.compiled.zones:
+        is_on = site.sprinkler_by_id[z.id].state == 1
+        run = site.active_runs.get(z.id)
+        ends_at = int(run.started_at + run.duration) if is_on and run and site.remaining(z.id) else 0
+        source = ("program" if z.id == program_zone_id else "manual") if is_on else ""
+        key = f"{int(is_on)}{source[:1]}{ends_at}"
+        if known is not None and known.get(str(z.id)) == key:
+            continue
+        cached = _card_cache.get((site.id, z.id, oob))
+        if cached is None or cached[0] != key:
+            html = Markup(render_template(
+                "_zone_card.html", z=z, key=key, is_on=is_on, source=source,
+                ends_at=ends_at, failsafe_max=site.failsafe_max, oob=oob,
+            ))
+            cached = _card_cache[(site.id, z.id, oob)] = (key, html)
+        out.append((z.id, key, cached[1]))
+    return out
+
+
+def _program_key(cp) -> str:
+    return f"{cp['name']}|{cp['current_step']}/{cp['total_steps']}" if cp else ""
+
+
+@site_route("/partial/zones", methods=["GET"])
+def partial_zones():
+    """
+    Zone section from cached cards. With ?oob=1&known=<id>:<key>,… only the
+    cards whose key differs are sent, as hx-swap-oob elements.
+    """
+    site = g.site
+    cp = site.current_program
+    program_key = _program_key(cp)
+    any_zone_on = any(sp.state == 1 for sp in site.sprinkler_by_id.values())
+
+    if request.args.get("oob") == "1":
+        known = dict(item.split(":", 1) for item in request.args.get("known", "").split(",") if ":" in item)
+        body = render_template(
+            "_zones_oob.html",
+            cards=[html for _, _, html in _zone_cards(site, oob=True, known=known)],
+            program_changed=request.args.get("prog", "") != program_key,
+            current_program=cp,
+            program_key=program_key,
+            any_zone_on=any_zone_on,
+        )
+    else:
+        body = render_template(
+            "_zones_partial.html",
+            cards=[html for _, _, html in _zone_cards(site)],
+            poll_sec=site.compiled.poll_sec,
+            any_zone_on=any_zone_on,
+            current_program=cp,
+            program_key=program_key,
+        )
+    return body, 200, {"X-Server-Time": f"{time.time():.3f}"}
 
 
-@app.post("/zones/<int:zid>/on")
+@site_route("/zones/<int:zid>/on", methods=["POST"])
 def zone_on(zid: int):
+    site = g.site
     minutes = request.form.get("minutes")
     if minutes:
         seconds = int(minutes) * 60
     else:
         seconds = int(request.form.get("seconds") or request.args.get("seconds") or 60)
-    if seconds > FAILSAFE_MAX:
-        seconds = FAILSAFE_MAX
+    if seconds > site.failsafe_max:
+        seconds = site.failsafe_max
 
-    sprinkler = app_runtime.SPRINKLER_BY_ID.get(zid)
+    sprinkler = site.sprinkler_by_id.get(zid)
     if sprinkler is None:
         abort(404)
 
     # If a program is running and this zone is not its current step, abort the program
-    if app_runtime.current_program and zid != app_runtime._current_program_zone_id():
-        app_runtime.abort_current_program()
+    if site.current_program and zid != site.current_program_zone_id():
+        site.abort_current_program()
 
     sprinkler.turn_on(seconds)
 
@@ -227,23 +489,24 @@ def zone_on(zid: int):
     return redirect(url_for("dashboard"))
 
 
-@app.post("/adhoc")
+@site_route("/adhoc", methods=["POST"])
 def adhoc_run():
+    site = g.site
     steps = []
-    for z in ZONES:
-        key = f"zone_{z['id']}_minutes"
+    for z in site.compiled.zones:
+        key = f"zone_{z.id}_minutes"
         minutes = int(request.form.get(key) or 0)
-        app_runtime.last_adhoc_steps[z["id"]] = minutes
+        site.last_adhoc_steps[z.id] = minutes
         if minutes > 0:
-            steps.append((z["id"], min(minutes * 60, FAILSAFE_MAX)))
+            steps.append((z.id, min(minutes * 60, site.failsafe_max)))
     if steps:
-        sched.adhoc_program_run(steps=steps, name="Azonnali program")
+        sched.adhoc_program_run(steps=steps, name="Azonnali program", site_id=_site_arg(site))
     return redirect(url_for("dashboard"))
 
 
-@app.post("/zones/<int:zid>/off")
+@site_route("/zones/<int:zid>/off", methods=["POST"])
 def zone_off(zid: int):
-    sprinkler = app_runtime.SPRINKLER_BY_ID.get(zid)
+    sprinkler = g.site.sprinkler_by_id.get(zid)
     if sprinkler is None:
         abort(404)
     sprinkler.turn_off()
@@ -252,120 +515,322 @@ def zone_off(zid: int):
     return redirect(url_for("dashboard"))
 
 
+@site_route("/api/zones/bulk", methods=["POST"])
+def api_zones_bulk():
+    """
+    Apply several zone commands at once:
+      {"commands": [{"action": "on", "zone_id": 1, "minutes": 5},
+                    {"action": "off", "zone_id": 2}, {"action": "all_off"}]}
+    All commands are validated first (400 on any problem, nothing applied).
+    Answers {"published": n, "program": name|null, "zones": [[id, on, remaining], ...]}.
+    """
+    site = g.site
+    data = request.get_json(force=True, silent=True)
+    commands = data.get("commands") if isinstance(data, dict) else data
+    errors, published = site.submit_zone_commands(commands)
+    if errors:
+        return jsonify({"errors": errors}), 400
+    cp = site.current_program
+    return jsonify({
+        "published": published,
+        "program": cp["name"] if cp else None,
+        "zones": site.zone_states(),
+    })
+
+
 # Opcionális: egyszerű JSON API
-@app.get("/api/zones")
+@site_route("/api/zones", methods=["GET"])
 def api_zones():
+    site = g.site
     out = []
-    # for z in ZONES:
-    #     st = G.zones[z["id"]]
-    #     out.append({
-    #         "id": z["id"],
-    #         "name": z["name"],
-    #         "channel": z["channel"],
-    #         "on": st.on,
-    #         "remaining": st.remaining
-    #     })
-    for sp in app_runtime.SPRINKLER_BY_ID.values():
+    for sp in site.sprinkler_by_id.values():
         out.append(
             {
                 "id": sp.id,
                 "name": sp.name,
                 "channel": sp.channel,
                 "on": sp.state == 1,
-                "remaining": app_runtime.remaining(sp.id),
+                "remaining": site.remaining(sp.id),
+                "litres": round(site.water.live_litres(sp.id), 1),
             }
         )
     return jsonify(out)
 
 
+@app.get("/api/events")
+def api_events():
+    """Recent relay-state / zone-run events plus per-subscriber queue counters."""
+    return jsonify({
+        "records": app_runtime.history.records(
+            since=request.args.get("since", 0, type=int),
+            limit=min(request.args.get("limit", 200, type=int), 1000),
+        ),
+        **app_runtime.bus.stats(),
+    })
+
+
+@app.get("/api/ha")
+def api_ha():
+    """Hot standby role, current leader and lease / replica ages."""
+    if HA is None:
+        abort(404)
+    return jsonify(HA.status())
+
+
+@site_route("/api/rain", methods=["GET"])
+def api_rain():
+    """Cached rain sensor state + recent events (wet/dry/bounce/skip), newest last."""
+    sensor = g.site.rain_sensor
+    limit = request.args.get("limit", 50, type=int)
+    history = list(sensor.history)[-limit:] if limit > 0 else []
+    return jsonify({**sensor.status(), "history": history})
+
+
+@site_route("/api/moisture", methods=["GET"])
+def api_moisture():
+    """Rolling soil-moisture aggregates per zone + ingestion counters."""
+    pipeline = g.site.moisture
+    if pipeline is None:
+        return jsonify({"configured": False, "zones": {}})
+    return jsonify({
+        "configured": True,
+        "window_seconds": pipeline.conf["window_seconds"],
+        "zones": {zid: pipeline.zone_stats(zid) for zid in sorted(pipeline.windows)},
+        "stats": pipeline.stats(),
+    })
+
+
+def _site_today(site):
+    from datetime import datetime
+    from zoneinfo import ZoneInfo
+    return datetime.now(ZoneInfo(site.compiled.timezone)).date()
+
+
+def _water_summary(site) -> list[dict]:
+    """Per-zone litres today / last 7 days / this season, for the dashboard."""
+    from datetime import timedelta
+    today = _site_today(site)
+    spans = {
+        "today": site.water.zone_totals(today),
+        "week": site.water.zone_totals(today - timedelta(days=6)),
+        "season": site.water.zone_totals(today.replace(month=1, day=1)),
+    }
+    return [{"zone": z, **{k: v.get(z.id, 0.0) for k, v in spans.items()}} for z in site.compiled.zones]
+
+
+@site_route("/api/water", methods=["GET"])
+def api_water():
+    """Water totals per zone / day / program (?from=YYYY-MM-DD&to=YYYY-MM-DD, inclusive)."""
+    from datetime import date
+    try:
+        start = date.fromisoformat(request.args["from"]) if request.args.get("from") else None
+        end = date.fromisoformat(request.args["to"]) if request.args.get("to") else None
+    except ValueError:
+        abort(400)
+    return jsonify(g.site.water.report(start, end))
+
+
+@site_route("/api/weather", methods=["GET"])
+def api_weather():
+    """ET0 and duration factors per zone for today and the next `days` days."""
+    from datetime import timedelta
+    scaler = g.site.weather
+    if scaler is None:
+        return jsonify({"configured": False, "days": []})
+    today = _site_today(g.site)
+    days = max(1, min(request.args.get("days", 7, type=int), 366))
+    return jsonify({
+        "configured": True,
+        "reference_et0_mm": scaler.conf["reference_et0_mm"],
+        "days": [scaler.day(today + timedelta(days=i)) or {"date": (today + timedelta(days=i)).isoformat()}
+                 for i in range(days)],
+    })
+
+
+@app.get("/api/sites")
+def api_sites():
+    return jsonify([
+        {
+            "id": site.id,
+            "name": site.name,
+            "default": site.is_default,
+            "zones": len(site.sprinkler_by_id),
+            "programs": len(site.programs),
+            "url": url_for("dashboard", site_id=site.id),
+        }
+        for site in app_runtime.SITES.values()
+    ])
+
+
 # ----------------------------
 # Programs — JSON API
 # ----------------------------
 
-@app.get("/api/programs")
+@site_route("/api/programs", methods=["GET"])
 def api_programs_list():
-    return jsonify(list(app_runtime.programs.values()))
+    return jsonify(list(g.site.programs.values()))
+
+
+def _program_errors(data) -> list[str]:
+    return config.validate_program(data, g.site.compiled.zones_by_id)
 
 
-@app.post("/api/programs")
+@site_route("/api/programs", methods=["POST"])
 def api_programs_create():
+    site = g.site
     data = request.get_json(force=True)
-    new_id = max(app_runtime.programs.keys(), default=0) + 1
+    errors = _program_errors(data)
+    if errors:
+        return jsonify({"errors": errors}), 400
+    data = config.compact(data)
+    new_id = max(site.programs.keys(), default=0) + 1
     data["id"] = new_id
-    app_runtime.programs[new_id] = data
-    _save_conf()
-    _register_job(data)
+    site.programs[new_id] = data
+    _save_conf(site)
+    _register_job(data, site)
     return jsonify(data), 201
 
 
-@app.put("/api/programs/<int:pid>")
+@site_route("/api/programs/<int:pid>", methods=["PUT"])
 def api_programs_update(pid: int):
-    if pid not in app_runtime.programs:
+    site = g.site
+    if pid not in site.programs:
         abort(404)
     data = request.get_json(force=True)
+    errors = _program_errors(data)
+    if errors:
+        return jsonify({"errors": errors}), 400
+    data = config.compact(data)
     data["id"] = pid
-    app_runtime.programs[pid] = data
-    _save_conf()
-    _register_job(data)
+    old = site.programs[pid]
+    site.programs[pid] = data
+    _save_conf(site)
+    _reschedule(old, data, site)
     return jsonify(data)
 
 
-@app.delete("/api/programs/<int:pid>")
+@site_route("/api/programs", methods=["PUT"])
+def api_programs_sync():
+    """
+    Bulk import: the body is the full program list (or {"programs": [...],
+    "prune": true, "dry_run": false}). Programs without an id get a new one;
+    with prune=false programs missing from the list are kept. Answers with
+    the diff counts; nothing is changed when any program is invalid.
+    """
+    site = g.site
+    body = request.get_json(force=True)
+    if isinstance(body, list):
+        body = {"programs": body}
+    if not isinstance(body, dict):
+        return jsonify({"errors": ["body: list of programs or {\"programs\": [...]}"]}), 400
+    programs = body.get("programs")
+    if isinstance(programs, list):
+        given = [p["id"] for p in programs if isinstance(p, dict) and type(p.get("id")) is int]
+        next_id = max([*site.programs, *given], default=0) + 1
+        for prog in programs:
+            if isinstance(prog, dict) and prog.get("id") is None:
+                prog["id"] = next_id
+                next_id += 1
+    errors = config.validate_programs(programs, site.compiled.zones_by_id)
+    if errors:
+        return jsonify({"errors": errors}), 400
+    result = _sync_programs(site, programs, prune=bool(body.get("prune", True)),
+                            dry_run=bool(body.get("dry_run", False)))
+    app_runtime.logger.info("Program import%s: %d added, %d updated, %d removed, %d jobs rescheduled in %.3fs",
+                            " (dry run)" if result["dry_run"] else "", result["added"], result["updated"],
+                            result["removed"], result["rescheduled"], result["seconds"])
+    return jsonify(result)
+
+
+@site_route("/api/programs/<int:pid>", methods=["DELETE"])
 def api_programs_delete(pid: int):
-    if pid not in app_runtime.programs:
+    site = g.site
+    if pid not in site.programs:
         abort(404)
-    app_runtime.programs.pop(pid)
-    _save_conf()
-    try:
-        sched.scheduler.remove_job(f"program:{pid}")
-    except Exception:
-        pass
+    site.programs.pop(pid)
+    _save_conf(site)
+    _unregister_job(pid, site)
     return "", 204
 
 
-@app.post("/api/programs/<int:pid>/run")
+@site_route("/api/programs/<int:pid>/run", methods=["POST"])
 def api_programs_run(pid: int):
-    prog = app_runtime.programs.get(pid)
+    site = g.site
+    prog = site.programs.get(pid)
     if prog is None:
         abort(404)
-    steps = [(s["zone_id"], s["minutes"] * 60) for s in prog.get("steps", []) if s["minutes"] > 0]
+    steps = _program_steps(site, prog)
     if steps:
-        sched.adhoc_program_run(steps=steps, name=prog["name"])
+        sched.adhoc_program_run(steps=steps, program_id=pid, name=prog["name"], site_id=_site_arg(site))
     return "", 204
 
 
-@app.post("/api/programs/<int:pid>/toggle")
+@site_route("/api/programs/<int:pid>/toggle", methods=["POST"])
 def api_programs_toggle(pid: int):
-    prog = app_runtime.programs.get(pid)
+    site = g.site
+    prog = site.programs.get(pid)
     if prog is None:
         abort(404)
     prog["active"] = not prog.get("active", False)
-    _save_conf()
-    _register_job(prog)
+    _save_conf(site)
+    _register_job(prog, site)
     return _render_programs_partial()
 
 
+@site_route("/api/program-runs", methods=["GET"])
+def api_program_runs():
+    """Recent program runs: duration, steps and every zone hand-over with its measured gap."""
+    return jsonify(list(g.site.program_runs))
+
+
+@site_route("/api/autoexec", methods=["GET"])
+def api_autoexec():
+    """OpenBK autoexec script for one relay board (?device=, default: the first)."""
+    import autoexec
+    site = g.site
+    try:
+        text = autoexec.compile_autoexec(site.compiled, list(site.programs.values()),
+                                         device=request.args.get("device"))
+    except KeyError:
+        abort(404)
+    return text, 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+
 # ----------------------------
 # Programs — UI (HTMX-driven, return partial HTML)
 # ----------------------------
 
-@app.get("/partial/programs")
+@site_route("/partial/programs", methods=["GET"])
 def partial_programs():
     return _render_programs_partial()
 
 
-@app.post("/programs/save")
+def _form_int(key: str, default: int = 0):
+    """Integer form field; other input is passed on as-is for validate_program to report."""
+    raw = (request.form.get(key) or "").strip()
+    if not raw:
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        return raw
+
+
+@site_route("/programs/save", methods=["POST"])
 def program_save():
+    site = g.site
     pid_str = request.form.get("id")
     steps = []
-    for z in ZONES:
-        minutes = int(request.form.get(f"zone_{z['id']}_minutes") or 0)
-        if minutes > 0:
-            steps.append({"zone_id": z["id"], "minutes": minutes})
+    for z in site.compiled.zones:
+        minutes = _form_int(f"zone_{z.id}_minutes")
+        if minutes != 0:
+            steps.append({"zone_id": z.id, "minutes": minutes})
     prog = {
         "name": request.form.get("name", "").strip(),
         "active": request.form.get("active") == "1",
         "rain_skip": request.form.get("rain_skip") == "1",
+        "moisture_skip": request.form.get("moisture_skip") == "1",
+        "board_run": request.form.get("board_run") == "1",
         "schedule": {
             "type": request.form.get("schedule_type", "daily"),
             "time": request.form.get("schedule_time", "06:00"),
@@ -373,59 +838,130 @@ def program_save():
             "date": request.form.get("schedule_date", ""),
         },
         "steps": steps,
+        "transition": {
+            "mode": request.form.get("transition_mode", "delay"),
+            "ms": _form_int("transition_ms"),
+        },
     }
-    pid = int(pid_str) if pid_str else max(app_runtime.programs.keys(), default=0) + 1
+    if prog["transition"] == config.DEFAULT_TRANSITION:
+        del prog["transition"]
+    pid = int(pid_str) if pid_str else None
+    errors = _program_errors(prog)
+    if errors:
+        # 200, not 400: HTMX only swaps successful responses
+        return _render_programs_partial({**prog, "id": pid}, errors)
+    prog = config.compact(prog)
+    if pid is None:
+        pid = max(site.programs.keys(), default=0) + 1
     prog["id"] = pid
-    app_runtime.programs[pid] = prog
-    _save_conf()
-    _register_job(prog)
+    old = site.programs.get(pid)
+    site.programs[pid] = prog
+    _save_conf(site)
+    _reschedule(old, prog, site)
     return _render_programs_partial()
 
 
-@app.post("/programs/<int:pid>/delete")
+@site_route("/programs/<int:pid>/delete", methods=["POST"])
 def program_delete(pid: int):
-    if pid not in app_runtime.programs:
+    site = g.site
+    if pid not in site.programs:
         abort(404)
-    app_runtime.programs.pop(pid)
-    _save_conf()
-    try:
-        sched.scheduler.remove_job(f"program:{pid}")
-    except Exception:
-        pass
+    site.programs.pop(pid)
+    _save_conf(site)
+    _unregister_job(pid, site)
     return _render_programs_partial()
 
 
-@app.post("/programs/<int:pid>/run")
+@site_route("/programs/<int:pid>/run", methods=["POST"])
 def program_run(pid: int):
-    prog = app_runtime.programs.get(pid)
+    site = g.site
+    prog = site.programs.get(pid)
     if prog is None:
         abort(404)
-    steps = [(s["zone_id"], s["minutes"] * 60) for s in prog.get("steps", []) if s["minutes"] > 0]
+    steps = _program_steps(site, prog)
     if steps:
-        sched.adhoc_program_run(steps=steps, name=prog["name"])
+        sched.adhoc_program_run(steps=steps, program_id=pid, name=prog["name"], site_id=_site_arg(site))
     return _render_programs_partial()
 
 
+@app.get("/api/startup")
+def api_startup():
+    return jsonify(startup.as_dict())
+
+
+@app.get("/api/profile")
+def api_profile():
+    """Wall-clock sampling profile of every thread for ?seconds= (collapsed stacks, text/plain)."""
+    seconds = request.args.get("seconds", 10, type=float)
+    hz = request.args.get("hz", 100, type=int)
+    if not 0 < seconds <= diagnostics.PROFILE_MAX_SECONDS or not 0 < hz <= diagnostics.PROFILE_MAX_HZ:
+        abort(400)
+    try:
+        counts, stats = diagnostics.sample_stacks(seconds, hz, lines=request.args.get("lines") == "1")
+    except diagnostics.ProfilerBusy:
+        abort(409)
+    app_runtime.logger.info("Profile: %(samples)d samples in %(seconds)ss, %(sample_ms)s ms/sample", stats)
+    resp = Response(diagnostics.collapse(counts), mimetype="text/plain")
+    resp.headers["X-Profile-Samples"] = str(stats["samples"])
+    resp.headers["X-Profile-Overhead"] = f"{stats['overhead_pct']}%"
+    return resp
+
+
+@app.get("/api/watchdog")
+def api_watchdog():
+    """Watchdog health, current problems and heartbeat ages (seconds)."""
+    return jsonify(WATCHDOG.status())
+
+
+@app.get("/api/logs")
+def api_logs():
+    """Recent records from the in-memory ring buffer (nothing here touches the SD card)."""
+    level = logging.getLevelName(request.args.get("level", "DEBUG").upper())
+    if not isinstance(level, int):
+        abort(400)
+    return jsonify({
+        "records": LOGS.ring.records(
+            since=request.args.get("since", 0, type=int),
+            min_level=level,
+            logger=request.args.get("logger"),
+            limit=min(request.args.get("limit", 200, type=int), 2000),
+        ),
+        "stats": LOGS.stats(),
+    })
+
+
 # ----------------------------
 # Main
 # ----------------------------
 def run_app():
-    app.run(host="0.0.0.0", port=5000)
+    app.run(host="0.0.0.0", port=int(os.environ.get("SPRINKLER_PORT", 5000)))
 
 
 # def run_scheduler():
 #   sched.scheduler.start()
 
 
-api_thread = Thread(target=run_app, daemon=True)
+api_thread = Thread(target=run_app, name="flask", daemon=True)
 
 
 if __name__ == "__main__":
     
     api_thread.start()
     sched.scheduler.start()
+    WATCHDOG.watch_thread("flask", lambda: api_thread)
+    if CONTROL.start():
+        WATCHDOG.watch_thread("control", lambda: CONTROL._thread, critical=False)
+    WATCHDOG.start()
+    startup.mark("serve")
+    diagnostics.release_memory()  # the YAML parse / compile garbage
+    app_runtime.logger.info("Startup: %s rss=%.1fMB", startup.summary(), diagnostics.rss_mb() or 0)
     try:
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
+        WATCHDOG.stop()
+        CONTROL.stop()
+        if HA is not None:
+            HA.release()
         sched.scheduler.shutdown()
+        LOGS.stop()
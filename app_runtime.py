@@ -3,155 +3,147 @@ import time
 import threading
 from threading import Event
 
+import events
 from mqtt_client import OBKMqtt
-from classes.Sprinkler import Sprinkler, RainSensor
+from classes.Site import Site
 
-mqttc: OBKMqtt | None = None
-rain_sensor: RainSensor | None = None
+mqttc: OBKMqtt | None = None  # the default site's client
 logger = logging.getLogger("sprinkler")
-SPRINKLER_BY_ID: dict[int, Sprinkler] = {}
-DRY_RUN: bool = False
-FAILSAFE_MAX: int = 600
 
-# Single source of truth for run timing: zone_id -> {"started_at": float, "duration": int}
-active_runs: dict[int, dict] = {}
+# All gardens served by this process, keyed by site id (first one is the default)
+SITES: dict[str, Site] = {}
+default_site: Site | None = None
 
-current_program: dict | None = None
-_program_stop_event: Event | None = None
+# One OBKMqtt per broker, shared by every site that talks to it
+_mqtt_pool: dict[tuple, OBKMqtt] = {}
+_failsafe_thread: threading.Thread | None = None
 
-last_adhoc_steps: dict[int, int] = {}  # zone_id -> minutes
-programs: dict[int, dict] = {}         # program_id -> program_dict
+# name → time.monotonic() of the last beat, checked by diagnostics.Watchdog
+heartbeats: dict[str, float] = {}
+
+# MQTT callbacks only publish events here; each consumer has its own worker
+bus = events.EventBus(logger)
+history = events.EventHistory()
+
+# Module-level names kept for code that predates sites; they read the default site.
+_DEFAULT_SITE_ATTRS = {
+    "SPRINKLER_BY_ID": "sprinkler_by_id",
+    "DRY_RUN": "dry_run",
+    "FAILSAFE_MAX": "failsafe_max",
+    "active_runs": "active_runs",
+    "current_program": "current_program",
+    "last_adhoc_steps": "last_adhoc_steps",
+    "programs": "programs",
+    "rain_sensor": "rain_sensor",
+}
+
+
+def __getattr__(name):
+    attr = _DEFAULT_SITE_ATTRS.get(name)
+    if attr is None or default_site is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(default_site, attr)
+
+
+def get_site(site_id: str | None = None) -> Site | None:
+    """The site with `site_id`, or the default site when `site_id` is None."""
+    if site_id is None:
+        return default_site
+    return SITES.get(site_id)
 
 
 def start_run(zone_id: int, duration_seconds: int) -> None:
-    active_runs[zone_id] = {
-        "started_at": time.time(),
-        "duration": duration_seconds,
-    }
+    default_site.start_run(zone_id, duration_seconds)
 
 
 def stop_run(zone_id: int) -> None:
-    active_runs.pop(zone_id, None)
+    default_site.stop_run(zone_id)
 
 
 def remaining(zone_id: int) -> int:
-    run = active_runs.get(zone_id)
-    if not run:
-        return 0
-    r = run["duration"] - (time.time() - run["started_at"])
-    return max(0, int(r))
+    return default_site.remaining(zone_id)
 
 
 def set_current_program(name: str, steps: list, stop_event: Event) -> None:
-    global current_program, _program_stop_event
-    _program_stop_event = stop_event
-    current_program = {
-        "name": name,
-        "steps": list(steps),
-        "current_step": 0,
-        "total_steps": len(steps),
-    }
+    default_site.set_current_program(name, steps, stop_event)
 
 
 def advance_current_program_step() -> None:
-    global current_program
-    if current_program is not None:
-        current_program["current_step"] += 1
+    default_site.advance_current_program_step()
 
 
 def abort_current_program() -> None:
-    global _program_stop_event
-    if _program_stop_event is not None:
-        _program_stop_event.set()
-    for zone_id in list(active_runs):
-        sp = SPRINKLER_BY_ID.get(zone_id)
-        if sp:
-            sp.turn_off()
-    clear_current_program()
+    default_site.abort_current_program()
 
 
 def clear_current_program() -> None:
-    global current_program, _program_stop_event
-    current_program = None
-    _program_stop_event = None
+    default_site.clear_current_program()
 
 
 def _current_program_zone_id() -> int | None:
-    if current_program and current_program["current_step"] > 0:
-        idx = current_program["current_step"] - 1
-        if 0 <= idx < len(current_program["steps"]):
-            return current_program["steps"][idx][0]
-    return None
+    return default_site.current_program_zone_id()
 
 
 def _failsafe_loop() -> None:
     while True:
         time.sleep(1)
-        for zone_id in list(active_runs):
-            if remaining(zone_id) == 0:
-                sp = SPRINKLER_BY_ID.get(zone_id)
-                if sp:
-                    logger.info("Failsafe: turning off zone %d", zone_id)
-                    sp.turn_off()
-
-
-def init_runtime(conf):
-    global mqttc, SPRINKLER_BY_ID, DRY_RUN, FAILSAFE_MAX
-    DRY_RUN = bool(conf.get("dry_run", False))
-    FAILSAFE_MAX = int(conf.get("failsafe", {}).get("max_seconds", 600))
-
-    SPRINKLER_BY_ID = {
-        z["id"]: Sprinkler(
-            id=z["id"],
-            name=z["name"],
-            channel=z["channel"],
-            mqttc=None,  # set after mqttc is created
-            logger=logger,
+        for site in list(SITES.values()):
+            site.failsafe_tick()
+        heartbeats["failsafe"] = time.monotonic()
+
+
+def _pooled_client(conf, dry_run: bool) -> OBKMqtt:
+    m = conf["mqtt"]
+    key = (m["host"], int(m["port"]), m.get("username") or "", dry_run)
+    client = _mqtt_pool.get(key)
+    if client is None:
+        client = OBKMqtt(
+            host=m["host"],
+            port=int(m["port"]),
+            username=m.get("username", ""),
+            password=m.get("password", ""),
+            qos=int(m.get("qos", 1)),
+            dry_run=dry_run,
         )
-        for z in conf["zones"]
-    }
-
-    _sprinkler_by_channel = {sp.channel: sp for sp in SPRINKLER_BY_ID.values()}
-
-    def _on_state(channel: int, value: int):
-        sp = _sprinkler_by_channel.get(channel)
-        if sp is None:
-            logger.warning("Received state for unknown channel %d", channel)
-            return
-        sp.state = value
-        logger.debug("State update: channel=%d state=%d", channel, value)
-        if value == 0:
-            stop_run(sp.id)
-        else:
-            if current_program and sp.id != _current_program_zone_id():
-                logger.info(
-                    "External ON on channel %d conflicts with program — aborting", channel
-                )
-                abort_current_program()
-            if sp.id not in active_runs:
-                logger.info(
-                    "External ON on channel %d — creating failsafe run (%ds)", channel, FAILSAFE_MAX
-                )
-                start_run(sp.id, FAILSAFE_MAX)
-
-    mqttc = OBKMqtt(
-        host=conf["mqtt"]["host"],
-        port=int(conf["mqtt"]["port"]),
-        username=conf["mqtt"].get("username", ""),
-        password=conf["mqtt"].get("password", ""),
-        qos=int(conf["mqtt"].get("qos", 1)),
-        set_tmpl=conf["mqtt"]["topics"]["set"],
-        state_sub=conf["mqtt"]["topics"]["state"],
-        on_state_cb=_on_state,
-        dry_run=DRY_RUN,
+        if m.get("record"):
+            from mqtt_recorder import MqttRecorder
+            client.recorder = MqttRecorder(m["record"], max_bytes=int(m.get("record_max_mb", 50) * 1024 * 1024))
+        _mqtt_pool[key] = client
+        client.start()
+    return client
+
+
+def init_runtime(conf, compiled, site_id: str = "default", name: str | None = None,
+                 conf_path: str | None = None, relay_queue=("coalesce", 256)) -> Site:
+    """
+    Create and register a site. `compiled` is the config.CompiledConf for
+    `conf` (see config.load_conf). Sites on the same broker share one client.
+    `relay_queue` is the (policy, maxsize) of the site's relay feedback
+    subscription on the event bus.
+    """
+    global mqttc, default_site, _failsafe_thread
+    if site_id in SITES:
+        raise ValueError(f"site {site_id!r} already registered")
+    site = Site(
+        id=site_id,
+        name=name or site_id,
+        conf=conf,
+        compiled=compiled,
+        conf_path=conf_path,
+        logger=logger if default_site is None else logger.getChild(site_id),
+        is_default=default_site is None,
+        bus=bus,
+        relay_queue=relay_queue,
     )
-
-    for sp in SPRINKLER_BY_ID.values():
-        sp.mqttc = mqttc
-
-    mqttc.start()
-
-    threading.Thread(target=_failsafe_loop, daemon=True).start()
-
-    global rain_sensor
-    rain_sensor = RainSensor(mqttc=mqttc, channel=conf["rainsensor"]["channel"])
+    site.attach(_pooled_client(conf, compiled.dry_run))
+    SITES[site_id] = site
+    if default_site is None:
+        default_site = site
+        mqttc = site.mqttc
+
+    if _failsafe_thread is None:
+        _failsafe_thread = threading.Thread(target=_failsafe_loop, name="failsafe", daemon=True)
+        _failsafe_thread.start()
+        bus.subscribe("history", history.record, (events.RelayState, events.ZoneRun),
+                      maxsize=1000, policy="drop_oldest")
+    return site
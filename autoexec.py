@@ -0,0 +1,295 @@
+"""
+autoexec.py — compile zones + programs into an OpenBK autoexec script, and
+interpret that script (for mock_openbk.py).
+
+The generated script, one per relay board, contains:
+  - per relay: an OnChannelChange handler that arms a one-shot failsafe of
+    `failsafe.max_seconds` (cancelled when the relay goes off) and, on a
+    board with `max_on: 1` (the default), switches the other relays off —
+    one relay at a time. Boards allowed more relays get no interlock; the
+    backend and the program bodies stay within max_on;
+  - per zone `button:` (and board `all_off_button:`): the physical button
+    handlers of the hand-written script — a press switches the zone's relay
+    on (its own handler then interlocks and arms the failsafe), the all-off
+    button switches every relay off and stops a running program label;
+  - per program whose steps all live on this board: a `program_<id>` label
+    with the step sequence (setChannel / delay_s / delay_ms) and the
+    program's zone hand-over (see classes.Program) and the same step
+    durations as the backend (config.program_steps). A program with
+    `board_run: true` is started on its board by jobs.py with
+    `startScript autoexec.bat program_<id>` and stopped with
+    `stopAllScripts`; the others are sequenced from the Pi over MQTT, but
+    their labels can still be started by hand, or without the Pi.
+At boot the script registers the handlers and jumps over the program bodies.
+
+Usage:
+  python3 autoexec.py [--device NAME] [-o autoexec.bat]
+  (ZONES_CONF selects the config, as for app.py; upload the result through
+   the OpenBK web UI → Filesystem. A program is then started on the board
+   with MQTT  cmnd/<client topic>/startScript  "autoexec.bat program_<id>"
+   and stopped with  cmnd/<client topic>/stopAllScripts.)
+"""
+
+import logging
+import re
+import threading
+
+from config import program_steps, program_transition
+
+SCRIPT_NAME = "autoexec.bat"
+
+logger = logging.getLogger(__name__)
+
+
+def program_label(program_id) -> str:
+    return f"program_{program_id}"
+
+
+def _comment(text) -> str:
+    return "// " + str(text).replace("\n", " ")
+
+
+def _delay(ms: int) -> str:
+    return f"delay_s {ms // 1000}" if ms % 1000 == 0 else f"delay_ms {ms}"
+
+
+def compile_autoexec(compiled, programs, device: str | None = None) -> str:
+    """
+    Script text for `device` (default: the first device). `compiled` is a
+    config.CompiledConf, `programs` the site's program dicts.
+    """
+    device = device or compiled.default_device
+    if device not in compiled.devices_by_name:
+        raise KeyError(f"unknown device {device!r}")
+    channels = compiled.channels_by_device[device]
+    zones = [z for z in compiled.zones if z.device == device]
+    failsafe = compiled.failsafe_max
+    max_on = compiled.devices_by_name[device].max_on
+
+    limit = "One relay at a time" if max_on == 1 else f"Up to {max_on} relays at once (no interlock)"
+    lines = [
+        _comment(f"Generated by autoexec.py for {device} — do not edit by hand."),
+        _comment(f"{limit}, {failsafe} s failsafe per run."),
+        "",
+    ]
+    for z in zones:
+        ch = z.channel
+        others = [f"setChannel {o} 0" for o in channels if o != ch] if max_on == 1 else []
+        arm = [f"cancelRepeatingEvent {ch}", f"addRepeatingEventID {failsafe} 1 {ch} setChannel {ch} 0"]
+        lines.append(_comment(f"Zone {z.id} \"{z.name}\" — channel {ch}"))
+        lines.append(f"addEventHandler OnChannelChange {ch} if $CH{ch}==1 then backlog "
+                     + "; ".join(others + arm))
+        lines.append(f"addEventHandler OnChannelChange {ch} if $CH{ch}==0 then cancelRepeatingEvent {ch}")
+        lines.append("")
+
+    for z in zones:
+        if z.button is not None:
+            lines.append(_comment(f"Button {z.button} pressed — zone {z.id} on"))
+            lines.append(f"addEventHandler OnChannelChange {z.button} if $CH{z.button}==1 "
+                         f"then setChannel {z.channel} 1")
+            lines.append("")
+    all_off = compiled.devices_by_name[device].all_off_button
+    if all_off is not None:
+        lines.append(_comment(f"Button {all_off} pressed — all relays off, program stopped"))
+        lines.append(f"addEventHandler OnChannelChange {all_off} if $CH{all_off}==1 then backlog "
+                     + "; ".join(["stopAllScripts"] + [f"setChannel {ch} 0" for ch in channels]))
+        lines.append("")
+
+    bodies = []
+    zone_channel = {z.id: z.channel for z in zones}
+    for prog in programs:
+        steps = program_steps(prog, failsafe)
+        label = program_label(prog["id"])
+        if not steps:
+            continue
+        if any(zid not in zone_channel for zid, _ in steps):
+            lines.append(_comment(f"{label} \"{prog['name']}\" uses zones on another board — "
+                                  "runs from the backend"))
+            continue
+        mode, ms = program_transition(prog.get("transition"))
+        if mode == "overlap" and max_on < 2:
+            mode, ms = "zero_gap", 0  # the interlock switches the previous relay off anyway
+        body = [_comment(f"Program {prog['id']} \"{prog['name']}\" — hand-over: {mode}"
+                         + (f" {ms} ms" if ms else "")), f"{label}:"]
+        chans = [zone_channel[zid] for zid, _ in steps]
+        seconds = [sec for _, sec in steps]
+        body.append(f"setChannel {chans[0]} 1")
+        carried = 0  # ms the current zone has already run during the previous overlap
+        for i, ch in enumerate(chans):
+            left = seconds[i] * 1000 - carried
+            if i == len(chans) - 1:
+                body += [_delay(left), f"setChannel {ch} 0"]
+            elif mode == "overlap":
+                lead = min(ms, left)
+                body += [_delay(left - lead), f"setChannel {chans[i + 1]} 1",
+                         _delay(lead), f"setChannel {ch} 0"]
+                carried = lead
+            else:
+                body += [_delay(left), f"setChannel {ch} 0"]
+                if ms:
+                    body.append(_delay(ms))
+                body.append(f"setChannel {chans[i + 1]} 1")
+        body += ["goto end", ""]
+        bodies.append(body)
+
+    lines += ["", "goto end", ""]
+    for body in bodies:
+        lines += body
+    lines.append("end:")
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------------------------------
+# Interpreter for the subset above (used by mock_openbk.py --autoexec)
+# ---------------------------------------------------------------------------
+_HANDLER_RE = re.compile(
+    r"^addEventHandler\s+OnChannelChange\s+(\d+)\s+if\s+\$CH(\d+)\s*==\s*(\d+)\s+then\s+(.+)$"
+)
+
+
+class ScriptInterpreter:
+    """
+    Runs an OpenBK script against a set of channels. `on_change(channel, value)`
+    is called for every actual channel change (the mock publishes state there).
+    `speed` divides every delay and repeating-event interval.
+    """
+
+    def __init__(self, text: str, on_change=None, speed: float = 1.0, log=None):
+        self.lines = [ln.strip() for ln in text.splitlines()]
+        self.labels = {ln[:-1]: i for i, ln in enumerate(self.lines) if re.match(r"^\w+:$", ln)}
+        self.handlers: dict[int, list[tuple[int, str]]] = {}
+        self.channels: dict[int, int] = {}
+        self.on_change = on_change
+        self.speed = speed
+        self.log = log or logger
+        self._events: dict[int, threading.Timer] = {}
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+    # ----- commands -----
+
+    def execute(self, cmd: str) -> None:
+        cmd = cmd.strip()
+        if not cmd or cmd.startswith("//"):
+            return
+        word, _, rest = cmd.partition(" ")
+        word = word.lower()
+        if word == "backlog":
+            for part in rest.split(";"):
+                self.execute(part)
+        elif word == "setchannel":
+            ch, val = rest.split()
+            self.set_channel(int(ch), int(val))
+        elif re.match(r"^power\d+$", word):
+            self.set_channel(int(word[5:]), 1 if rest.strip().lower() in ("1", "on") else 0)
+        elif word == "addrepeatingeventid":
+            interval, repeats, ev_id, ev_cmd = rest.split(None, 3)
+            self._add_event(int(ev_id), float(interval), int(repeats), ev_cmd)
+        elif word == "cancelrepeatingevent":
+            self._cancel_event(int(rest))
+        elif word == "addeventhandler":
+            m = _HANDLER_RE.match(cmd)
+            if not m or m.group(1) != m.group(2):
+                raise ValueError(f"unsupported handler: {cmd}")
+            self.handlers.setdefault(int(m.group(1)), []).append((int(m.group(3)), m.group(4)))
+        elif word == "startscript":
+            parts = rest.split()
+            self.start(parts[1] if len(parts) > 1 else None)
+        elif word == "stopallscripts":
+            self._stop.set()
+        else:
+            raise ValueError(f"unsupported command: {cmd}")
+
+    def set_channel(self, channel: int, value: int) -> None:
+        with self._lock:
+            if self.channels.get(channel, 0) == value:
+                return
+            self.channels[channel] = value
+            if self.on_change:
+                self.on_change(channel, value)
+            for want, cmd in list(self.handlers.get(channel, ())):
+                if want == value:
+                    self.execute(cmd)
+
+    def _add_event(self, ev_id: int, interval: float, repeats: int, cmd: str) -> None:
+        self._cancel_event(ev_id)
+
+        def fire(left=repeats):
+            with self._lock:
+                if self._events.get(ev_id) is not t:
+                    return
+                del self._events[ev_id]
+            self.log.info("[SCRIPT] event %d fired: %s", ev_id, cmd)
+            self.execute(cmd)
+            if left > 1 or repeats == -1:
+                self._add_event(ev_id, interval, left - 1 if repeats != -1 else -1, cmd)
+
+        t = threading.Timer(interval / self.speed, fire)
+        t.daemon = True
+        with self._lock:
+            self._events[ev_id] = t
+        t.start()
+
+    def _cancel_event(self, ev_id: int) -> None:
+        with self._lock:
+            t = self._events.pop(ev_id, None)
+        if t:
+            t.cancel()
+
+    # ----- script threads -----
+
+    def run(self, label: str | None = None) -> None:
+        """Execute from `label` (or the top) until the end or stopAllScripts."""
+        pc = self.labels[label] + 1 if label else 0
+        while pc < len(self.lines) and not self._stop.is_set():
+            ln = self.lines[pc]
+            pc += 1
+            if not ln or ln.startswith("//") or re.match(r"^\w+:$", ln):
+                continue
+            word, _, rest = ln.partition(" ")
+            word = word.lower()
+            if word == "goto":
+                pc = self.labels[rest.strip()] + 1
+            elif word == "delay_s":
+                self._stop.wait(float(rest) / self.speed)
+            elif word == "delay_ms":
+                self._stop.wait(float(rest) / 1000 / self.speed)
+            else:
+                self.execute(ln)
+
+    def start(self, label: str | None) -> threading.Thread:
+        """startScript: run `label` in its own thread, like an OpenBK script thread."""
+        self._stop.clear()
+        t = threading.Thread(target=self.run, args=(label,), daemon=True)
+        self._threads.append(t)
+        t.start()
+        return t
+
+    def stop_all(self) -> None:
+        self._stop.set()
+
+
+def main():
+    import argparse
+    import os
+    import sys
+
+    import config
+
+    parser = argparse.ArgumentParser(description="Generate an OpenBK autoexec script")
+    parser.add_argument("--device", default=None, help="relay board (default: the first)")
+    parser.add_argument("-o", "--output", default=None, help="file to write (default: stdout)")
+    args = parser.parse_args()
+
+    conf, compiled = config.load_conf(os.environ.get("ZONES_CONF", "zones.yaml"))
+    text = compile_autoexec(compiled, conf.get("programs", []), device=args.device)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+if __name__ == "__main__":
+    main()
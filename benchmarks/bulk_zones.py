@@ -0,0 +1,62 @@
+"""
+benchmarks/bulk_zones.py — all-off across 40 zones: per-zone route vs /api/zones/bulk.
+
+Builds a throw-away dry-run config with 40 zones on two relay boards, then
+times, through Flask's test client:
+  - 40 × POST /zones/<id>/off with HX-Request (what the dashboard does:
+    one abort check, publish and full _zones_partial render per zone)
+  - 1 × POST /api/zones/bulk {"commands": [{"action": "all_off"}]}
+Before each trial one zone per board is switched on.
+
+Usage:  python3 benchmarks/bulk_zones.py [--zones 40] [--trials 50]
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from common import load_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--zones", type=int, default=40)
+    parser.add_argument("--trials", type=int, default=50)
+    args = parser.parse_args()
+
+    app = load_app(args.zones)
+    client = app.app.test_client()
+    zone_ids = list(app.app_runtime.default_site.sprinkler_by_id)
+
+    def arm():
+        client.post("/api/zones/bulk", json={"commands": [
+            {"action": "on", "zone_id": zone_ids[0], "minutes": 5},
+            {"action": "on", "zone_id": zone_ids[1], "minutes": 5},
+        ]})
+
+    per_zone, bulk = [], []
+    for _ in range(args.trials):
+        arm()
+        t0 = time.perf_counter()
+        for zid in zone_ids:
+            r = client.post(f"/zones/{zid}/off", headers={"HX-Request": "true"})
+            assert r.status_code == 200
+        per_zone.append(time.perf_counter() - t0)
+
+        arm()
+        t0 = time.perf_counter()
+        r = client.post("/api/zones/bulk", json={"commands": [{"action": "all_off"}]})
+        assert r.status_code == 200 and r.get_json()["published"] == len(zone_ids)
+        bulk.append(time.perf_counter() - t0)
+
+    a, b = statistics.median(per_zone) * 1000, statistics.median(bulk) * 1000
+    print(f"all-off, {len(zone_ids)} zones, {args.trials} trials (median)")
+    print(f"  per-zone route : {a:8.2f} ms")
+    print(f"  /api/zones/bulk: {b:8.2f} ms")
+    print(f"  speed-up       : {a / b:8.1f}x")
+    os._exit(0)  # skip scheduler / logging thread shutdown
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Shared setup for the benchmark scripts: a throw-away dry-run config + the Flask app."""
+
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_conf(path: str, n_zones: int, extra: list[str] | None = None) -> None:
+    """zones.yaml with `n_zones` zones alternating between two relay boards, dry run."""
+    lines = [
+        "mqtt:",
+        '  host: "localhost"',
+        "  port: 1883",
+        "  qos: 1",
+        "devices:",
+        '  - name: "boardA"',
+        '    prefix: "benchA"',
+        '  - name: "boardB"',
+        '    prefix: "benchB"',
+        "zones:",
+    ]
+    for i in range(1, n_zones + 1):
+        lines += [f"  - id: {i}", f'    name: "Zóna {i}"', f"    channel: {i}",
+                  f'    device: "{"boardA" if i % 2 else "boardB"}"']
+    lines += [
+        "failsafe:",
+        "  max_seconds: 600",
+        'timezone: "Europe/Budapest"',
+        "dry_run: true",
+        "logging:",
+        '  level: "WARNING"',
+    ]
+    lines += extra or ["programs: []"]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def load_app(n_zones: int, extra: list[str] | None = None):
+    """Import app.py against a fresh config; returns the module with its scheduler started."""
+    tmp = tempfile.mkdtemp(prefix="bench-")
+    conf_path = os.path.join(tmp, "zones.yaml")
+    write_conf(conf_path, n_zones, extra)
+    os.environ["ZONES_CONF"] = conf_path
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    import app
+    app.sched.scheduler.start()
+    return app
@@ -0,0 +1,121 @@
+"""
+benchmarks/control_socket.py — local zone control: HTTP API vs the control socket.
+
+Builds a throw-away dry-run config with 40 zones, serves the Flask app on
+a loopback port (werkzeug, threaded — as app.py does) and the control
+socket (control.py) on a temp path, then times, over one kept-alive
+connection each:
+  - zone on/off round trips: POST /api/zones/bulk vs `on <id> 60` / `off <id>`
+  - state query: GET /api/zones vs `zones`
+  - the same socket round trip while --load threads keep the HTTP server
+    busy rendering /partial/zones
+  - one sprinklerctl.py process (start, connect, `zones`, exit) vs a bare
+    `python3 -S -c pass`
+
+Usage:  python3 benchmarks/control_socket.py [--zones 40] [--trials 500] [--load 8]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from common import ROOT, load_app
+
+
+def timed(fn, trials: int) -> list[float]:
+    out = []
+    for i in range(trials):
+        t0 = time.perf_counter()
+        fn(i)
+        out.append((time.perf_counter() - t0) * 1000)
+    return out
+
+
+def report(label: str, ms: list[float]) -> None:
+    ms = sorted(ms)
+    print(f"  {label:34s} median {statistics.median(ms):7.3f} ms   p95 {ms[int(len(ms) * 0.95)]:7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--zones", type=int, default=40)
+    parser.add_argument("--trials", type=int, default=500)
+    parser.add_argument("--load", type=int, default=8, help="threads hammering the HTTP server")
+    parser.add_argument("--cli-runs", type=int, default=20)
+    args = parser.parse_args()
+
+    sock_path = os.path.join(tempfile.mkdtemp(prefix="bench-"), "control.sock")
+    os.environ["SPRINKLER_SOCKET"] = sock_path
+    app = load_app(args.zones)
+    assert app.CONTROL.start()
+    from werkzeug.serving import make_server
+    server = make_server("127.0.0.1", 0, app.app, threaded=True)
+    port = server.server_port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    http_conn = http.client.HTTPConnection("127.0.0.1", port)
+
+    def http_call(method, path, body=None):
+        http_conn.request(method, path, body=body and json.dumps(body),
+                          headers={"Content-Type": "application/json"})
+        resp = http_conn.getresponse()
+        resp.read()
+        assert resp.status == 200, resp.status
+
+    ctl = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    ctl.connect(sock_path)
+    replies = ctl.makefile("rb")
+
+    def ctl_call(line):
+        ctl.sendall(line.encode() + b"\n")
+        assert replies.readline().startswith(b"ok")
+
+    def http_toggle(i):
+        action = "on" if i % 2 == 0 else "off"
+        http_call("POST", "/api/zones/bulk", {"commands": [{"action": action, "zone_id": 1, "seconds": 60}]})
+
+    def ctl_toggle(i):
+        ctl_call("on 1 60" if i % 2 == 0 else "off 1")
+
+    print(f"{args.zones} zones, {args.trials} round trips each, dry run")
+    report("HTTP POST /api/zones/bulk", timed(http_toggle, args.trials))
+    report("socket on / off", timed(ctl_toggle, args.trials))
+    report("HTTP GET /api/zones", timed(lambda i: http_call("GET", "/api/zones"), args.trials))
+    report("socket zones", timed(lambda i: ctl_call("zones"), args.trials))
+
+    stop = threading.Event()
+    served = [0]
+
+    def hammer():
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        while not stop.is_set():
+            conn.request("GET", "/partial/zones")
+            conn.getresponse().read()
+            served[0] += 1
+
+    loaders = [threading.Thread(target=hammer, daemon=True) for _ in range(args.load)]
+    for t in loaders:
+        t.start()
+    time.sleep(0.5)
+    report(f"HTTP on / off, {args.load} loaders", timed(http_toggle, args.trials // 5))
+    report(f"socket on / off, {args.load} loaders", timed(ctl_toggle, args.trials // 5))
+    stop.set()
+
+    cli = [sys.executable, "-S", os.path.join(ROOT, "sprinklerctl.py"), "-s", sock_path, "zones"]
+    bare = [sys.executable, "-S", "-c", "pass"]
+    report("sprinklerctl.py zones (process)", timed(lambda i: subprocess.run(cli, capture_output=True, check=True),
+                                                   args.cli_runs))
+    report("python3 -S -c pass (floor)", timed(lambda i: subprocess.run(bare, check=True), args.cli_runs))
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
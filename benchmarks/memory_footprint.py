@@ -0,0 +1,106 @@
+"""
+benchmarks/memory_footprint.py — resident memory with many zones and programs.
+
+Writes throw-away dry-run configs with --zones zones and --programs active
+programs (daily/weekly mix, 3 steps each), split over --sites sites, and
+starts app.py in a fresh child process twice: once with a cold parse cache
+(YAML parsed and compiled) and once warm (the pickled cache, as on every
+ordinary restart). Each child reports its resident set size (VmRSS / VmHWM
+from /proc/self/status):
+  - after importing the heavy libraries (Flask, APScheduler, paho, yaml)
+  - after app.py's startup (sites, programs, one APScheduler job each)
+  - after diagnostics.release_memory() (what the daemon does once started)
+
+Usage:  python3 benchmarks/memory_footprint.py [--zones 1000] [--programs 5000] [--sites 1]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import ROOT, write_conf
+from program_sync import make_programs
+
+
+def rss_mb() -> tuple[float, float]:
+    """(current, peak) resident set size in MB."""
+    vals = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(("VmRSS:", "VmHWM:")):
+                vals[line[:5]] = int(line.split()[1]) / 1024
+    return vals["VmRSS"], vals["VmHWM"]
+
+
+def write_sites(tmp: str, zones: int, programs: int, sites: int) -> str:
+    """Main config plus sites-1 extra site files; returns the main config's path."""
+    per_zones, per_programs = zones // sites, programs // sites
+    paths = [os.path.join(tmp, "zones.yaml")] + [os.path.join(tmp, f"site{i}.yaml") for i in range(1, sites)]
+    for i, path in enumerate(paths):
+        progs = make_programs(per_programs, per_zones)
+        for p in progs:
+            p["active"] = True
+        extra = ["programs:"] + ["  - " + json.dumps(p, ensure_ascii=False) for p in progs]
+        if i == 0 and sites > 1:
+            extra = ["sites:"] + [f'  - {{id: "s{k}", conf: "{p}"}}' for k, p in enumerate(paths[1:], 1)] + extra
+        write_conf(path, per_zones, extra)
+        if i:  # sites sharing the broker need their own topic prefixes
+            with open(path, encoding="utf-8") as f:
+                text = f.read().replace('"benchA"', f'"site{i}A"').replace('"benchB"', f'"site{i}B"')
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+    return paths[0]
+
+
+def child(conf_path: str) -> None:
+    import flask, apscheduler.schedulers.background, paho.mqtt.client, yaml  # noqa: F401 — the baseline
+    base, _ = rss_mb()
+    os.environ["ZONES_CONF"] = conf_path
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    t0 = time.perf_counter()
+    import app
+    app.sched.scheduler.start()
+    started = time.perf_counter() - t0
+    loaded, peak = rss_mb()
+    import diagnostics
+    diagnostics.release_memory()
+    released, _ = rss_mb()
+    print(json.dumps({
+        "base": base, "loaded": loaded, "released": released, "peak": peak, "seconds": started,
+        "programs": sum(len(s.programs) for s in app.app_runtime.SITES.values()),
+        "zones": sum(len(s.sprinkler_by_id) for s in app.app_runtime.SITES.values()),
+        "jobs": len(app.sched.scheduler.get_jobs()),
+    }))
+    sys.stdout.flush()
+    os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--zones", type=int, default=1000)
+    parser.add_argument("--programs", type=int, default=5000)
+    parser.add_argument("--sites", type=int, default=1)
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child)
+
+    conf_path = write_sites(tempfile.mkdtemp(prefix="bench-"), args.zones, args.programs, args.sites)
+    print(f"{args.zones} zones, {args.programs} programs, {args.sites} site(s); RSS in MB")
+    for label in ("cold cache", "warm cache"):
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", conf_path],
+                             capture_output=True, text=True, check=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print(f"  {label}: imports {r['base']:6.1f}  after startup {r['loaded']:6.1f}"
+              f" (+{r['loaded'] - r['base']:5.1f}, peak {r['peak']:6.1f})"
+              f"  after release {r['released']:6.1f} (+{r['released'] - r['base']:5.1f})"
+              f"  {r['seconds']:5.2f} s, {r['zones']} zones, {r['programs']} programs, {r['jobs']} jobs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+benchmarks/mqtt_burst.py — MQTT ingest latency while a relay board reboots.
+
+A program is running on zone 1 when the board comes back and republishes
+every channel (ON, then OFF) --repeats times. Each message goes through
+OBKMqtt._on_message exactly as paho delivers it, and the time paho's thread
+spends per message is measured:
+  - inline: Site.on_state handles the message on the MQTT thread (the first
+    foreign ON aborts the program and publishes OFFs from inside it)
+  - bus:    Site.on_state only publishes a RelayState event; the site's
+    coalescing runtime worker applies it
+Publishing is slowed by --publish-ms to stand in for a busy broker link.
+
+Usage:  python3 benchmarks/mqtt_burst.py [--zones 40] [--repeats 5] [--publish-ms 2]
+"""
+
+import argparse
+import os
+import statistics
+import threading
+import time
+import types
+
+from common import load_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--zones", type=int, default=40)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--publish-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    app = load_app(args.zones)
+    rt = app.app_runtime
+    site, mqttc = rt.default_site, rt.mqttc
+    bus = site.bus
+
+    real_publish = mqttc.publish
+
+    def slow_publish(topic, payload, retain=False):
+        time.sleep(args.publish_ms / 1000)
+        real_publish(topic, payload, retain)
+    mqttc.publish = slow_publish
+
+    topics = [mqttc.devices[sp.device].state_topic(sp.channel) for sp in site.sprinkler_by_id.values()]
+    burst = [(t, p) for _ in range(args.repeats) for p in (b"1", b"0") for t in topics]
+
+    def arm():
+        site.active_runs.clear()
+        for sp in site.sprinkler_by_id.values():
+            sp.state = 0
+        site.set_current_program("bench", [(1, 600)], threading.Event())
+        site.advance_current_program_step()
+        site.sprinkler_by_id[1].turn_on(600)
+
+    def run(label):
+        arm()
+        lat = []
+        t0 = time.perf_counter()
+        for topic, payload in burst:
+            msg = types.SimpleNamespace(topic=topic, payload=payload)
+            s = time.perf_counter()
+            mqttc._on_message(None, None, msg)
+            lat.append((time.perf_counter() - s) * 1000)
+        ingest = (time.perf_counter() - t0) * 1000
+        if site.bus is not None:
+            bus.drain()
+        done = (time.perf_counter() - t0) * 1000
+        lat.sort()
+        print(f"  {label:6s} per msg p50 {statistics.median(lat):7.3f} ms  p99 {lat[int(len(lat) * 0.99) - 1]:7.3f} ms"
+              f"  max {lat[-1]:7.2f} ms | burst ingested {ingest:7.1f} ms, applied {done:7.1f} ms")
+
+    print(f"{len(burst)} state messages, {args.zones} zones, publish {args.publish_ms} ms")
+    site.bus = None
+    run("inline")
+    site.bus = bus
+    run("bus")
+    time.sleep(0.2)
+    print("  runtime subscriber:", bus.stats()["subscribers"][f"runtime:{site.id}"])
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+benchmarks/profiler_overhead.py — cost of /api/profile on a busy dashboard.
+
+Renders the uncached zone partial (40 zones, the heaviest view) through
+Flask's test client --trials times, alone and while diagnostics.sample_stacks()
+samples every thread at --hz on another thread (--rounds interleaved rounds,
+best of each), and reports the slowdown and the profiler's time per sample.
+
+Usage:  python3 benchmarks/profiler_overhead.py [--zones 40] [--trials 300] [--hz 100] [--rounds 3]
+"""
+
+import argparse
+import os
+import statistics
+import threading
+import time
+
+from common import load_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--zones", type=int, default=40)
+    parser.add_argument("--trials", type=int, default=300)
+    parser.add_argument("--hz", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    app = load_app(args.zones)
+    import diagnostics
+    client = app.app.test_client()
+
+    def render():
+        times = []
+        for _ in range(args.trials):
+            app._card_cache.clear()
+            t0 = time.perf_counter()
+            client.get("/partial/zones")
+            times.append(time.perf_counter() - t0)
+        return statistics.median(times) * 1000, sum(times)
+
+    def profiled():
+        result = {}
+        profiler = threading.Thread(target=lambda: result.update(
+            zip(("counts", "stats"), diagnostics.sample_stacks(base_total * 3, args.hz))), name="profiler")
+        profiler.start()
+        time.sleep(0.05)
+        p50, total = render()
+        profiler.join()
+        return p50, total, result
+
+    render()  # warm up templates
+    base, prof = [], []
+    for _ in range(args.rounds):  # interleaved, best round of each
+        base.append(render())
+        base_total = base[-1][1]
+        prof.append(profiled())
+    base_p50, base_total = min(base, key=lambda r: r[1])
+    prof_p50, prof_total, result = min(prof, key=lambda r: r[1])
+    stats = result["stats"]
+
+    print(f"{args.trials} × /partial/zones, {args.zones} zones, cache cleared per request")
+    print(f"  alone          p50 {base_p50:6.2f} ms, total {base_total * 1000:7.1f} ms")
+    print(f"  profiling {args.hz:3d}Hz p50 {prof_p50:6.2f} ms, total {prof_total * 1000:7.1f} ms "
+          f"(+{(prof_total / base_total - 1) * 100:.1f}%)")
+    print(f"  profiler: {stats['samples']} samples, {stats['sample_ms']} ms/sample, "
+          f"{len(result['counts'])} distinct stacks")
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+benchmarks/program_sync.py — importing a program set: one request per program vs PUT /api/programs.
+
+Builds a throw-away dry-run config with 40 zones, generates --programs
+programs (daily/weekly mix, 3 steps each) and times, through Flask's test
+client:
+  - POST /api/programs per program (every one validates and rewrites the
+    whole zones.yaml): the first --sample, plus one more once all are in;
+    the one-by-one total is extrapolated from the two, as the cost grows
+    with the file
+  - PUT /api/programs with the full set (validate once, persist once)
+  - the same set with --edit programs' step minutes changed (no job
+    touched) and --edit programs' start time changed (jobs rescheduled)
+  - the unchanged set again (no write at all)
+
+Usage:  python3 benchmarks/program_sync.py [--programs 500] [--sample 50] [--edit 10]
+"""
+
+import argparse
+import copy
+import os
+import time
+
+from common import load_app
+
+DAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+
+def make_programs(n: int, n_zones: int) -> list[dict]:
+    programs = []
+    for i in range(1, n + 1):
+        weekly = i % 3 == 0
+        programs.append({
+            "id": i,
+            "name": f"Program {i}",
+            "active": i % 7 != 0,
+            "rain_skip": i % 2 == 0,
+            "schedule": {
+                "type": "weekly" if weekly else "daily",
+                "time": f"{i % 24:02d}:{i % 60:02d}",
+                "days": [DAYS[i % 7], DAYS[(i + 3) % 7]] if weekly else [],
+                "date": "",
+            },
+            "steps": [{"zone_id": (i + k) % n_zones + 1, "minutes": 5 + k} for k in range(3)],
+        })
+    return programs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--programs", type=int, default=500)
+    parser.add_argument("--zones", type=int, default=40)
+    parser.add_argument("--sample", type=int, default=50)
+    parser.add_argument("--edit", type=int, default=10)
+    args = parser.parse_args()
+
+    app = load_app(args.zones)
+    client = app.app.test_client()
+    site = app.app_runtime.default_site
+    programs = make_programs(args.programs, args.zones)
+
+    # one request per program (the pre-bulk way), on the first --sample programs
+    t0 = time.perf_counter()
+    for prog in programs[:args.sample]:
+        body = {k: v for k, v in prog.items() if k != "id"}
+        assert client.post("/api/programs", json=body).status_code == 201
+    per_post = time.perf_counter() - t0
+    n = min(args.sample, args.programs)
+    print(f"{args.programs} programs, {args.zones} zones, zones.yaml rewritten per change")
+    print(f"  POST × {n:<4d}                    {per_post * 1000:8.1f} ms")
+
+    def sync(label, progs):
+        t0 = time.perf_counter()
+        resp = client.put("/api/programs", json={"programs": progs})
+        elapsed = time.perf_counter() - t0
+        r = resp.get_json()
+        assert resp.status_code == 200, r
+        print(f"  {label:30s} {elapsed * 1000:8.1f} ms   +{r['added']} ~{r['updated']} -{r['removed']}"
+              f"  rescheduled {r['rescheduled']}{'' if r['saved'] else '  (not written)'}")
+
+    sync(f"PUT, {args.programs} programs", programs)
+    assert len(site.programs) == args.programs
+
+    edited = copy.deepcopy(programs)
+    for prog in edited[:args.edit]:
+        prog["steps"][0]["minutes"] += 1
+    sync(f"PUT, {args.edit} steps edited", edited)
+
+    retimed = copy.deepcopy(edited)
+    for prog in retimed[args.edit:2 * args.edit]:
+        prog["schedule"]["time"] = "23:59"
+    sync(f"PUT, {args.edit} start times moved", retimed)
+
+    sync("PUT, unchanged", retimed)
+
+    # one more POST at full size: each rewrite grows with the file, so the
+    # one-by-one import costs about n × (first + last) / 2
+    t0 = time.perf_counter()
+    assert client.post("/api/programs", json=make_programs(1, args.zones)[0]).status_code == 201
+    last = time.perf_counter() - t0
+    estimate = args.programs * (per_post / n + last) / 2
+    print(f"  POST #{args.programs + 1:<4d}                    {last * 1000:8.1f} ms"
+          f"   → one by one ≈ {estimate:.1f} s for {args.programs}")
+
+    jobs = {j.id for j in app.sched.scheduler.get_jobs()}
+    assert all((site.job_id(p["id"]) in jobs) == p["active"] for p in retimed)
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
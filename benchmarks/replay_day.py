@@ -0,0 +1,100 @@
+"""
+benchmarks/replay_day.py — replay throughput for a synthetic garden day.
+
+Writes a recording with mqtt_recorder.MqttRecorder the way OBKMqtt would
+see a busy day on 40 zones: each zone's program step (set → state ON, 10
+minutes later OFF), a rain sensor reading every minute, and a board reboot
+every two hours that republishes all of its channels five times. The
+recording is then replayed through replay.replay() into dry-run sites as
+fast as possible, and the final zone states are checked (all off).
+Throughput is counted in relay events the runtime actually handled: by
+default every report is queued (as replay.py does); --coalesce uses the
+daemon's latest-per-channel queue, where most of a burst never reaches Site.
+
+Usage:  python3 benchmarks/replay_day.py [--zones 40] [--hours 24] [--coalesce]
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from common import ROOT, write_conf
+
+
+def synth_day(path: str, compiled, hours: float) -> int:
+    from mqtt_recorder import MqttRecorder
+
+    # Fake the clock: records are written back to back with synthetic offsets
+    clock = [0.0]
+    real_monotonic = time.monotonic
+    time.monotonic = lambda: clock[0]
+    try:
+        rec = MqttRecorder(path)
+        events = []
+        zones = list(compiled.zones)
+        dev = {d.name: d for d in compiled.devices}
+        rain = compiled.devices[0].state_topic(90)
+        for minute in range(int(hours * 60)):
+            events.append((minute * 60.0, "in", rain, b"0"))
+        step = 0
+        for start_h in range(0, int(hours), 6):
+            for z in zones:
+                t = start_h * 3600 + step * 600.0 % 3600
+                d = dev[z.device]
+                events.append((t, "out", d.set_topic(z.channel), b"1"))
+                events.append((t + 0.05, "in", d.state_topic(z.channel), b"1"))
+                events.append((t + 600, "out", d.set_topic(z.channel), b"0"))
+                events.append((t + 600.05, "in", d.state_topic(z.channel), b"0"))
+                step += 1
+        for h in range(1, int(hours), 2):
+            for rep in range(5):
+                for z in zones:
+                    d = dev[z.device]
+                    events.append((h * 3600 + 1 + rep * 0.2, "in", d.state_topic(z.channel), b"0"))
+        events.sort(key=lambda e: e[0])
+        for t, direction, topic, payload in events:
+            clock[0] = t
+            (rec.record_in if direction == "in" else rec.record_out)(topic, payload)
+        rec.close()
+        return len(events)
+    finally:
+        time.monotonic = real_monotonic
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--zones", type=int, default=40)
+    parser.add_argument("--hours", type=float, default=24)
+    parser.add_argument("--coalesce", action="store_true")
+    args = parser.parse_args()
+
+    import sys
+    sys.path.insert(0, ROOT)
+    import config
+    import replay
+
+    tmp = tempfile.mkdtemp(prefix="bench-")
+    conf_path = os.path.join(tmp, "zones.yaml")
+    write_conf(conf_path, args.zones)
+    _, compiled = config.load_conf(conf_path)
+    rec_path = os.path.join(tmp, "day.rec")
+    n = synth_day(rec_path, compiled, args.hours)
+    size = os.path.getsize(rec_path)
+
+    logging.basicConfig(level=logging.ERROR)
+    result = replay.replay(rec_path, 0, conf_path, logging.getLogger("replay"), coalesce=args.coalesce)
+    on = [zid for zid, state in result["zones"]["default"].items() if state]
+    ev = result["relay_events"]
+    print(f"{args.hours:g} h, {args.zones} zones: {n} records, {size} bytes ({size / n:.1f} B/record)")
+    print(f"  replayed {result['messages']} inbound at full speed "
+          f"({'coalescing' if args.coalesce else 'every report queued'}): {result['applied_seconds']} s")
+    print(f"  relay events handled: {ev['delivered']} ({result['events_per_second']}/s), "
+          f"coalesced {ev['coalesced']}, dropped {ev['dropped']}")
+    print(f"  final state: {'all off' if not on else f'ON: {on}'}")
+    os._exit(0 if not on else 1)
+
+
+if __name__ == "__main__":
+    main()
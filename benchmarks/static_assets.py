@@ -0,0 +1,60 @@
+"""
+benchmarks/static_assets.py — bytes and round trips for the dashboard's assets.
+
+Fetches the stylesheet and HTMX the way a phone would, through Flask's test
+client, and compares:
+  - before: /static/main.css uncompressed, revalidated on every page load
+    (Flask's default has no max-age), HTMX from the CDN — compressed there
+    too, but a DNS/TLS handshake to a second host and no dashboard offline
+  - after:  /assets/<fingerprinted> with gzip (brotli if installed) and
+    `immutable` — the second visit does not touch the network for them
+
+Transfer time is estimated for a weak garden WiFi link (--kbps, --rtt-ms).
+
+Usage:  python3 benchmarks/static_assets.py [--kbps 500] [--rtt-ms 150]
+"""
+
+import argparse
+import os
+import re
+
+from common import load_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--kbps", type=float, default=500)
+    parser.add_argument("--rtt-ms", type=float, default=150)
+    args = parser.parse_args()
+
+    app = load_app(6)
+    client = app.app.test_client()
+    html = client.get("/").get_data(as_text=True)
+    urls = re.findall(r'(?:href|src)="(/assets/[^"]+)"', html)
+    accept = {"Accept-Encoding": "br, gzip, deflate"}
+
+    def cost(nbytes, round_trips):
+        return round_trips * args.rtt_ms + nbytes * 8 / args.kbps
+
+    before = after = 0
+    for url in urls:
+        name = app.ASSETS.lookup(url[len("/assets/"):]).name
+        a = client.get(f"/static/{name}").data
+        b = client.get(url, headers=accept)
+        before += len(b.data) if name.startswith("vendor/") else len(a)
+        after += len(b.data)
+        print(f"  {name:22s} {len(a):7d} B -> {len(b.data):7d} B ({b.headers.get('Content-Encoding') or 'identity'})")
+
+    # before: css from the Pi + htmx from the CDN (extra DNS + TCP + TLS ≈ 3 RTT)
+    before_first = cost(before, len(urls) + 3)
+    before_repeat = cost(0, 1)  # css revalidation (304); CDN copy usually cached
+    after_first = cost(after, len(urls))
+    after_repeat = 0.0
+    print(f"assets at {args.kbps:.0f} kbit/s, {args.rtt_ms:.0f} ms RTT (estimate)")
+    print(f"  first visit : {before_first:7.0f} ms -> {after_first:7.0f} ms")
+    print(f"  repeat visit: {before_repeat:7.0f} ms -> {after_repeat:7.0f} ms")
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+benchmarks/step_transitions.py — program cycle time per zone hand-over mode.
+
+Runs one program of --steps short steps (--seconds each) through
+classes.Program against simulated relay boards: every relay command is
+answered with state feedback after --latency-ms, and a board holding its
+max_on relays switches the longest-running one off (the OpenBK interlock).
+Zones alternate between two boards, so an overlap is possible; the last run
+keeps the program on one max_on=1 board, where overlap falls back to
+zero_gap. Reports total cycle time and the measured OFF→ON gaps (negative =
+both zones on) from the run summary.
+
+Usage:  python3 benchmarks/step_transitions.py [--steps 6] [--seconds 2] [--overlap-ms 500]
+"""
+
+import argparse
+import os
+import threading
+import time
+
+from common import load_app
+
+
+class Boards:
+    """Relay feedback with latency and a per-board max_on interlock."""
+
+    def __init__(self, site, latency: float):
+        self.site = site
+        self.latency = latency
+        self.on: dict[str, list[int]] = {}  # device → channels on, oldest first
+        self.lock = threading.Lock()
+
+    def command(self, channel, value, device):
+        threading.Timer(self.latency, self._apply, args=(device, channel, int(value))).start()
+
+    def _apply(self, device, channel, value):
+        limit = self.site.compiled.devices_by_name[device].max_on
+        with self.lock:
+            on = self.on.setdefault(device, [])
+            changes = []
+            if value and channel not in on:
+                while len(on) >= limit:
+                    changes.append((on.pop(0), 0))
+                on.append(channel)
+                changes.append((channel, 1))
+            elif not value and channel in on:
+                on.remove(channel)
+                changes.append((channel, 0))
+        for ch, v in changes:
+            self.site.on_state(device, ch, v)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--steps", type=int, default=6)
+    parser.add_argument("--seconds", type=int, default=2)
+    parser.add_argument("--overlap-ms", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=40)
+    args = parser.parse_args()
+
+    app = load_app(args.steps * 2)
+    from classes.Program import Program
+    site = app.app_runtime.default_site
+    boards = Boards(site, args.latency_ms / 1000)
+    site.mqttc.set_channel = lambda channel, value, device=None: boards.command(channel, value, device)
+    site.mqttc.set_channels = lambda commands: [boards.command(*c) for c in commands]
+
+    alternating = [(z, args.seconds) for z in range(1, args.steps + 1)]
+    one_board = [(z, args.seconds) for z in range(1, args.steps * 2, 2)]
+    runs = [
+        ("delay 2000 ms", alternating, ("delay", 2000)),
+        ("zero_gap", alternating, ("zero_gap", 0)),
+        (f"overlap {args.overlap_ms} ms", alternating, ("overlap", args.overlap_ms)),
+        (f"overlap {args.overlap_ms} ms, one board", one_board, ("overlap", args.overlap_ms)),
+    ]
+    print(f"{args.steps} steps × {args.seconds} s, feedback latency {args.latency_ms:g} ms")
+    for label, steps, transition in runs:
+        p = Program("bench", label, steps, logger=site.logger, site=site, transition=transition)
+        stop = threading.Event()
+        site.set_current_program(label, steps, stop)
+        summary = p.run_sequentially(on_step_start=site.advance_current_program_step, stop_event=stop)
+        site.finish_program(stop)
+        time.sleep(args.latency_ms / 1000 * 2)
+        gaps = [t["measured_ms"] for t in summary["transitions"] if t["measured_ms"] is not None]
+        applied = sorted({t["mode"] for t in summary["transitions"]})
+        dead = sum(g for g in gaps if g > 0) / 1000
+        print(f"  {label:28s} cycle {summary['seconds']:5.1f} s  gaps {min(gaps):6d}..{max(gaps):6d} ms"
+              f"  dead time {dead:4.1f} s  applied {','.join(applied)}"
+              f"{'  ABORTED' if summary['aborted'] else ''}")
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
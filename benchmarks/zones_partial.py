@@ -0,0 +1,76 @@
+"""
+benchmarks/zones_partial.py — zone poll cost with 40 zones, one running.
+
+Compares, through Flask's test client:
+  - full partial, cache cleared before every request (every card rendered,
+    as before the fragment cache)
+  - full partial from cached cards
+  - OOB poll (?oob=1) with the browser's keys up to date — only the
+    ad-hoc button comes back
+  - OOB poll after one zone changed — that one card comes back
+
+Usage:  python3 benchmarks/zones_partial.py [--zones 40] [--trials 200]
+"""
+
+import argparse
+import os
+import re
+import statistics
+import time
+
+from common import load_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--zones", type=int, default=40)
+    parser.add_argument("--trials", type=int, default=200)
+    args = parser.parse_args()
+
+    app = load_app(args.zones)
+    client = app.app.test_client()
+    site = app.app_runtime.default_site
+    site.sprinkler_by_id[1].turn_on(300)
+
+    def timed(fn):
+        times, size = [], 0
+        for _ in range(args.trials):
+            t0 = time.perf_counter()
+            size = len(fn())
+            times.append(time.perf_counter() - t0)
+        return statistics.median(times) * 1000, size
+
+    def full_uncached():
+        app._card_cache.clear()
+        return client.get("/partial/zones").data
+
+    def full_cached():
+        return client.get("/partial/zones").data
+
+    page = client.get("/partial/zones").get_data(as_text=True)
+    known = ",".join(f"{z}:{k}" for z, k in re.findall(r'data-zone-id="(\d+)"\s+data-key="([^"]*)"', page))
+    prog = app._program_key(site.current_program)
+
+    def oob_unchanged():
+        return client.get("/partial/zones", query_string={"oob": 1, "known": known, "prog": prog}).data
+
+    stale = re.sub(r"(^|,)2:[^,]*", r"\g<1>2:stale", known)
+
+    def oob_one_changed():
+        return client.get("/partial/zones", query_string={"oob": 1, "known": stale, "prog": prog}).data
+
+    rows = [
+        ("full, uncached", timed(full_uncached)),
+        ("full, cached cards", timed(full_cached)),
+        ("oob, nothing changed", timed(oob_unchanged)),
+        ("oob, one card changed", timed(oob_one_changed)),
+    ]
+    base_ms, base_size = rows[0][1]
+    print(f"/partial/zones, {args.zones} zones, {args.trials} trials (median)")
+    for name, (ms, size) in rows:
+        print(f"  {name:24s} {ms:7.3f} ms  {size:7d} B   ({base_ms / ms:5.1f}x time, {base_size / size:6.1f}x size)")
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,33 +11,260 @@ def program_constructor_from_db(program_id):
 
 
 class Program:
-    def __init__(self, id, name, runtimes, sprinkler_by_id=None, logger=None):
+    """
+    Runs (zone_id, seconds) steps one after another. The hand-over between
+    two steps follows `transition` (mode, ms), see config.TRANSITION_MODES:
+
+      delay     previous zone off, wait ms, next zone on (default: 2000 ms)
+      zero_gap  previous off and next on in one MQTT batch
+      overlap   next zone on ms before the previous one's time is up, then
+                previous off — every zone still gets its full duration
+
+    An overlap needs two relays on at once: on a board with max_on 1 (the
+    OpenBK interlock switches the other relays off) a same-board overlap is
+    run as zero_gap. Each hand-over is recorded in `transitions` with the
+    commanded gap and, once relay feedback has arrived, the measured gap
+    between the previous zone's OFF and the next zone's ON report (negative
+    while both were on).
+    """
+
+    BOARD_START_SECONDS = 30  # run_on_board: first relay report expected within this
+    BOARD_SLACK_SECONDS = 30  # ... and the last one this long after the script's own run time
+
+    __slots__ = ("logger", "id", "name", "runtimes", "site", "sprinkler_by_id", "step_filter",
+                 "transition", "transitions")
+
+    def __init__(self, id, name, runtimes, sprinkler_by_id=None, logger=None, site=None,
+                 step_filter=None, transition=("delay", 2000)):
         self.logger = logger or logging.getLogger(__name__)
         self.id = id
         self.name = name
         self.runtimes = runtimes  # list of (zone_id, seconds) tuples
-        self.sprinkler_by_id = sprinkler_by_id  # falls back to app_runtime.SPRINKLER_BY_ID
+        self.site = site  # classes.Site.Site; falls back to the app_runtime default site
+        self.sprinkler_by_id = sprinkler_by_id  # falls back to the site's sprinklers
+        self.step_filter = step_filter  # (zone_id, seconds) -> seconds, 0 skips the step
+        self.transition = transition
+        self.transitions: list[dict] = []
 
-    def run_sequentially(self, delay_seconds=2, on_step_start=None, stop_event=None):
-        import app_runtime
-        spr_by_id = self.sprinkler_by_id or app_runtime.SPRINKLER_BY_ID
-        for zone_id, duration in self.runtimes:
+    def _max_on(self, site, sp) -> int:
+        zone = site.compiled.zones_by_id.get(sp.id) if site is not None else None
+        if zone is None:
+            return 1
+        return site.compiled.devices_by_name[zone.device].max_on
+
+    def _wait(self, sp, site, until: float, stop_event) -> str:
+        """Sleep until `until`: "done", "aborted" (stop_event) or "stopped" (zone switched off outside)."""
+        while True:
+            now = time.time()
             if stop_event and stop_event.is_set():
-                break
-            sp = spr_by_id.get(zone_id)
-            if sp is None:
-                self.logger.warning("Zone %d not found, skipping", zone_id)
-                continue
-            sp.turn_on(duration)
+                return "aborted"
+            if sp.state == 0 and site.remaining(sp.id) == 0:
+                return "stopped"  # zone stopped externally — advance to next step
+            if now >= until:
+                return "done"
+            time.sleep(min(0.5, until - now))
+
+    def _hand_over(self, site, prev, nxt, duration, mode: str, ms: int, on_step_start,
+                   stop_event) -> dict | None:
+        """
+        Switch from zone `prev` to zone `nxt` (on for `duration` s); returns the
+        transition record, or None when the program was aborted in a delay or
+        overlap.
+        """
+        if on_step_start:
+            on_step_start()  # before the ON goes out: nxt's feedback must not read as a conflict
+        if mode == "overlap":
+            t_on = time.time()
+            nxt.turn_on(duration)
+            if stop_event and stop_event.wait(ms / 1000):
+                if not site.standby:  # after an HA step-down the new leader drives the relays
+                    nxt.turn_off()
+                return None
+            elif not stop_event:
+                time.sleep(ms / 1000)
+            t_off = time.time()
+            prev.turn_off()
+        elif mode == "zero_gap":
+            with site.lock:
+                t_off = time.time()
+                cmds = [prev.turn_off(publish=False), nxt.turn_on(duration, publish=False)]
+                site.mqttc.set_channels(cmds)
+                t_on = time.time()
+        else:
+            t_off = time.time()
+            prev.turn_off()
+            if ms and stop_event:
+                if stop_event.wait(ms / 1000):
+                    return None
+            elif ms:
+                time.sleep(ms / 1000)
+            t_on = time.time()
+            nxt.turn_on(duration)
+        return {"from": prev.id, "to": nxt.id, "mode": mode,
+                "commanded_ms": round((t_on - t_off) * 1000), "measured_ms": None,
+                "_t_off": t_off, "_t_on": t_on, "_prev": prev, "_next": nxt}
+
+    @staticmethod
+    def _measure(record: dict) -> dict:
+        """Fill measured_ms from relay feedback reported after the commands went out."""
+        off_at = record.pop("_prev").reported_at[0]
+        on_at = record.pop("_next").reported_at[1]
+        t_off, t_on = record.pop("_t_off"), record.pop("_t_on")
+        slack = 0.05  # feedback timestamps come from another thread's clock reading
+        if off_at is not None and on_at is not None and off_at >= t_off - slack and on_at >= t_on - slack:
+            record["measured_ms"] = round((on_at - off_at) * 1000)
+        return record
+
+    def run_sequentially(self, delay_seconds=None, on_step_start=None, stop_event=None) -> dict:
+        """
+        Run the steps; returns a summary (steps run, seconds, transitions).
+        `delay_seconds` overrides the transition with a plain delay.
+        """
+        import app_runtime
+        site = self.site or app_runtime.default_site
+        spr_by_id = self.sprinkler_by_id or site.sprinkler_by_id
+        mode, ms = ("delay", int(delay_seconds * 1000)) if delay_seconds is not None else self.transition
+        steps = iter(self.runtimes)
+        self.transitions = []
+
+        def next_step():
+            for zone_id, duration in steps:
+                sp = spr_by_id.get(zone_id)
+                if sp is None:
+                    self.logger.warning("Zone %d not found, skipping", zone_id)
+                    continue
+                if self.step_filter:
+                    duration = self.step_filter(zone_id, duration)
+                    if duration <= 0:
+                        if on_step_start:
+                            on_step_start()  # keep the UI's step counter aligned
+                        continue
+                return sp, duration
+            return None
+
+        started = time.time()
+        run = 0
+        outcome = "done"
+        step = next_step()
+        if step is not None and not (stop_event and stop_event.is_set()):
+            sp, duration = step
             if on_step_start:
                 on_step_start()
-            deadline = time.time() + duration
-            while time.time() < deadline:
+            sp.turn_on(duration)
+            step_start = time.time()
+            run = 1
+            while True:
+                lead = min(ms / 1000, duration) if mode == "overlap" else 0.0
+                outcome = self._wait(sp, site, step_start + duration - lead, stop_event)
+                if outcome == "aborted":
+                    break
+                nxt = next_step()
+                if nxt is None:
+                    if outcome == "done" and lead:
+                        outcome = self._wait(sp, site, step_start + duration, stop_event)
+                    if outcome != "aborted":
+                        sp.turn_off()
+                    break
+                nsp, nduration = nxt
+                step_mode = mode
+                if outcome == "stopped" and mode == "overlap":
+                    step_mode = "zero_gap"  # nothing left to overlap with
+                elif (mode == "overlap" and sp.device == nsp.device
+                        and self._max_on(site, sp) < 2):
+                    step_mode = "zero_gap"  # the board's interlock would switch sp off anyway
+                if step_mode == "overlap":
+                    overlap_ms = round(lead * 1000)
+                else:
+                    overlap_ms = ms if step_mode == "delay" else 0
+                    if outcome == "done" and lead:
+                        outcome = self._wait(sp, site, step_start + duration, stop_event)  # full step
+                        if outcome == "aborted":
+                            break
+                record = self._hand_over(site, sp, nsp, nduration, step_mode, overlap_ms,
+                                         on_step_start, stop_event)
+                if record is None:
+                    outcome = "aborted"
+                    break
+                if outcome == "stopped":
+                    record["_t_off"] = step_start  # its OFF report predates the hand-over
+                self.transitions.append(record)
+                sp, duration = nsp, nduration
+                step_start = self.transitions[-1]["_t_on"]
+                run += 1
                 if stop_event and stop_event.is_set():
-                    return  # program aborted
-                if sp.state == 0 and app_runtime.remaining(sp.id) == 0:
-                    break  # zone stopped externally — advance to next step
-                time.sleep(0.5)
-            sp.turn_off()
-            if delay_seconds and not (stop_event and stop_event.is_set()):
-                time.sleep(delay_seconds)
+                    outcome = "aborted"
+                    break
+
+        transitions = [self._measure(t) for t in self.transitions]
+        measured = [t["measured_ms"] for t in transitions if t["measured_ms"] is not None]
+        summary = {
+            "program_id": self.id,
+            "name": self.name,
+            "started_at": started,
+            "seconds": round(time.time() - started, 1),
+            "steps_run": run,
+            "aborted": outcome == "aborted",
+            "transition": {"mode": mode, "ms": ms},
+            "transitions": transitions,
+        }
+        if transitions:
+            self.logger.info(
+                "Program '%s' finished: %d steps in %.0fs, %d × %s hand-over, measured gap %s",
+                self.name, run, summary["seconds"], len(transitions), mode,
+                f"{min(measured)}..{max(measured)} ms" if measured else "n/a (no relay feedback)",
+            )
+        return summary
+
+    def run_on_board(self, device: str, stop_event) -> dict:
+        """
+        Start the program's autoexec.py label on relay board `device` and
+        follow it from relay feedback (Site._board_step advances the steps)
+        until the last step's relay is off. Aborts stop the script
+        (Site.abort_current_program); a board that does not start the label,
+        or overruns it, gets stopAllScripts and its relays switched off.
+        """
+        import app_runtime
+        import autoexec
+        site = self.site or app_runtime.default_site
+        mode, ms = self.transition
+        gaps = ms / 1000 if mode == "delay" else 0
+        expected = sum(sec for _, sec in self.runtimes) + gaps * (len(self.runtimes) - 1)
+        started = time.time()
+        site.send_board_command(device, "startScript", f"{autoexec.SCRIPT_NAME} {autoexec.program_label(self.id)}")
+        last = site.sprinkler_by_id[self.runtimes[-1][0]]
+        outcome = "done"
+        run = 0
+        while True:
+            cp = site.current_program
+            if stop_event.wait(0.5) or cp is None:
+                outcome = "aborted"
+                break
+            run, now = cp["current_step"], time.time()
+            if cp["current_step"] >= cp["total_steps"] and last.state == 0 and site.remaining(last.id) == 0:
+                break
+            if cp["current_step"] == 0 and now - started > self.BOARD_START_SECONDS:
+                self.logger.error("Program '%s': board %s did not start %s — is its autoexec.bat current?",
+                                  self.name, device, autoexec.program_label(self.id))
+                outcome = "failed"
+            elif now - started > expected + self.BOARD_SLACK_SECONDS:
+                self.logger.warning("Program '%s': board %s overran the script's %.0f s — stopping it",
+                                    self.name, device, expected)
+                outcome = "overrun"
+            else:
+                continue
+            site.abort_current_program()
+            break
+
+        summary = {
+            "program_id": self.id,
+            "name": self.name,
+            "started_at": started,
+            "seconds": round(time.time() - started, 1),
+            "steps_run": run,
+            "aborted": outcome != "done",
+            "transition": {"mode": mode, "ms": ms, "board": device},
+            "transitions": [],
+        }
+        self.logger.info("Program '%s' on board %s: %s after %.0fs", self.name, device, outcome,
+                         summary["seconds"])
+        return summary
@@ -11,12 +11,16 @@ from apscheduler.schedulers.background import BackgroundScheduler
 
 
 class StartTime:
+    __slots__ = ("hour", "minute")
+
     def __init__(self, hour: int, minute: int):
         self.hour = hour
         self.minute = minute
 
 
 class DayOption:
+    __slots__ = ("dop_name", "start_time", "program_id", "steps", "day")
+
     def __init__(self, dop_name, start_time: StartTime, 
                  program_id: str | None = None, 
                  steps: list[tuple[int,int]] | None = None,
@@ -90,22 +94,36 @@ class Scheduler:
     def adhoc_program_run(self, 
                           steps: list[tuple[int,int]] | None = None,
                           program_id: int | str = "adhoc",
-                          name: str = "Adhoc Program") -> str:
+                          name: str = "Adhoc Program",
+                          site_id: str | None = None) -> str:
         """Run once, almost immediately."""
         from jobs import start_program_by_id
-        jid = f"adhoc:{program_id}:{int(datetime.now(self.tz).timestamp())}"
+        site_part = f"{site_id}:" if site_id else ""
+        jid = f"adhoc:{site_part}{program_id}:{int(datetime.now(self.tz).timestamp())}"
         self.scheduler.add_job(
             start_program_by_id,
             'date',
             run_date=datetime.now(self.tz) + timedelta(seconds=1),
             id=jid,
             name=name,
-            kwargs={'program_id': program_id, 'steps': list(steps), 'name': name},
+            kwargs={'program_id': program_id, 'steps': list(steps), 'name': name, 'site_id': site_id},
             replace_existing=False,
         )
         self.logger.debug("Scheduled one-off %s (id=%s) to run now", name, jid)
         return jid
     
+    def add_heartbeat(self, seconds: int = 10) -> None:
+        """Interval job stamping app_runtime.heartbeats["scheduler"] (watched by diagnostics.Watchdog)."""
+        from jobs import scheduler_heartbeat
+        self.scheduler.add_job(
+            scheduler_heartbeat,
+            'interval',
+            seconds=seconds,
+            id="watchdog:heartbeat",
+            name="Watchdog heartbeat",
+            replace_existing=True,
+        )
+
     def trigger_now(self, dayOption: "DayOption") -> None:
         """Az adott dayOption-hoz tartozó job azonnali futtatása (következő időpont előrehozása)."""
         jid = self._job_id_for(dayOption)
@@ -0,0 +1,436 @@
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from threading import Event, RLock
+
+from classes.Sprinkler import Sprinkler, RainSensor
+from events import RelayState, ZoneRun
+from water import WaterLedger
+
+
+def _command_seconds(cmd: dict) -> int | None:
+    """Run time of an "on" command: `seconds`, else `minutes` × 60, else 60 (as zone_on)."""
+    if "seconds" in cmd:
+        v, mult = cmd["seconds"], 1
+    elif "minutes" in cmd:
+        v, mult = cmd["minutes"], 60
+    else:
+        return 60
+    if not isinstance(v, int) or isinstance(v, bool):
+        return None
+    return v * mult
+
+
+@dataclass(slots=True)
+class ActiveRun:
+    """A zone's current run: Site.active_runs values."""
+    started_at: float
+    duration: int
+
+
+class Site:
+    """
+    One garden: its zones, runtime state, programs and failsafe.
+
+    Several sites share one process — one Flask app, one APScheduler and a
+    pooled MQTT connection per broker (see app_runtime.init_runtime). The
+    first site registered is the default site served at the unprefixed URLs.
+    """
+
+    def __init__(self, id, name, conf, compiled, conf_path=None, logger=None, is_default=False,
+                 bus=None, relay_queue=("coalesce", 256)):
+        self.id = id
+        self.name = name
+        self.conf = conf            # prepared zones.yaml dict (programs re-read from here)
+        self.compiled = compiled    # config.CompiledConf
+        self.conf_path = conf_path
+        self.is_default = is_default
+        self.logger = logger or logging.getLogger("sprinkler")
+
+        self.dry_run = compiled.dry_run
+        self.failsafe_max = compiled.failsafe_max
+        self.mqttc = None
+        self.bus = bus  # events.EventBus; None → relay feedback is handled on the MQTT thread
+        self.relay_queue = relay_queue  # (policy, maxsize) of the relay feedback subscription
+        self.rain_sensor: RainSensor | None = None
+        self.moisture = None  # telemetry.MoisturePipeline when zones.yaml has `moisture:`
+
+        self.sprinkler_by_id: dict[int, Sprinkler] = {
+            z.id: Sprinkler(
+                id=z.id,
+                name=z.name,
+                channel=z.channel,
+                device=z.device,
+                mqttc=None,  # set in attach()
+                logger=self.logger,
+                site=self,
+            )
+            for z in compiled.zones
+        }
+        self._sprinkler_by_address = {
+            addr: self.sprinkler_by_id[z.id] for addr, z in compiled.zone_by_address.items()
+        }
+
+        # Held while a batch of zone commands is checked and applied (see submit_zone_commands)
+        self.lock = RLock()
+
+        # Hot standby (ha.py): a standby site mirrors the leader's state and
+        # never publishes relay commands; on_change(site) fires on every run
+        # or program state change so the leader can replicate it.
+        self.standby = False
+        self.on_change = None
+
+        # Single source of truth for run timing: zone_id -> ActiveRun
+        self.active_runs: dict[int, ActiveRun] = {}
+        self.current_program: dict | None = None
+        self._program_stop_event: Event | None = None
+        self.last_adhoc_steps: dict[int, int] = {}  # zone_id -> minutes
+        self.programs: dict[int, dict] = {}         # program_id -> program_dict
+        self.program_runs: deque = deque(maxlen=50)  # Program.run_sequentially summaries, newest last
+
+        water = conf.get("water") or {}
+        default_log = os.path.splitext(conf_path)[0] + ".water.csv" if conf_path else None
+        self.water = WaterLedger(
+            {z["id"]: float(z.get("flow_lpm", 0.0)) for z in conf.get("zones", [])},
+            path=water.get("log", default_log),
+            timezone=compiled.timezone,
+            pulses_per_litre=water.get("pulses_per_litre"),
+            logger=self.logger,
+        )
+        self.water.load()
+
+        self.weather = None  # weather.WeatherScaler when zones.yaml has `weather:`
+        if conf.get("weather") is not None:
+            import weather  # numpy is only loaded for sites that use it
+            self.weather = weather.WeatherScaler(
+                conf["weather"],
+                {z["id"]: float(z.get("crop_coefficient", 1.0)) for z in conf.get("zones", [])},
+                logger=self.logger,
+            )
+            self.weather.refresh()
+
+    def device_key(self, device: str) -> str:
+        """Name under which `device` is registered on a (possibly shared) OBKMqtt."""
+        return device if self.is_default else f"{self.id}/{device}"
+
+    def attach(self, mqttc) -> None:
+        """Register this site's relay boards and rain sensor on `mqttc`."""
+        self.mqttc = mqttc
+        if self.bus is not None:
+            # Latest state per relay wins: a rebooting board's burst collapses per channel
+            # (replay.py queues every report instead, so flaps reach the runtime)
+            policy, maxsize = self.relay_queue
+            self.bus.subscribe(
+                f"runtime:{self.id}", self._handle_relay_state, (RelayState,),
+                maxsize=maxsize, policy=policy,
+                key=lambda e: (e.device, e.channel), accept=lambda e: e.site_id == self.id,
+            )
+        for dev in self.compiled.devices:
+            mqttc.add_device(
+                dev,
+                self.compiled.channels_by_device[dev.name],
+                on_state_cb=self.on_state,
+                key=self.device_key(dev.name),
+            )
+        for sp in self.sprinkler_by_id.values():
+            sp.mqttc = mqttc
+            sp.device = self.device_key(sp.device)
+        rain_device, rain_channel = self.compiled.rain_address or (self.compiled.default_device, None)
+        rain = self.conf.get("rainsensor") or {}
+        self.rain_sensor = RainSensor(
+            mqttc=mqttc,
+            channel=rain_channel,
+            device=self.device_key(rain_device),
+            debounce_seconds=rain.get("debounce_seconds", 30),
+            wet_hold_seconds=rain.get("wet_hold_hours", 6) * 3600,
+            active_low=bool(rain.get("active_low", False)),
+            logger=self.logger,
+        )
+        self.rain_sensor.attach()
+        if self.conf.get("moisture") is not None:
+            import telemetry
+            self.moisture = telemetry.MoisturePipeline(
+                self.conf["moisture"], self.sprinkler_by_id, logger=self.logger
+            )
+            self.moisture.attach(mqttc)
+        meter_topic = (self.conf.get("water") or {}).get("meter_topic")
+        if meter_topic:
+            mqttc.subscribe(meter_topic, self.water.on_meter)
+
+    def job_id(self, program_id) -> str:
+        """APScheduler job id for a program; unique across sites sharing one scheduler."""
+        return f"program:{program_id}" if self.is_default else f"program:{self.id}:{program_id}"
+
+    # ----- run timing -----
+
+    def start_run(self, zone_id: int, duration_seconds: int) -> None:
+        self.active_runs[zone_id] = ActiveRun(time.time(), duration_seconds)
+        program = self.current_program["name"] if self.current_program else None
+        self.water.run_started(zone_id, program)
+        if self.bus is not None:
+            self.bus.publish(ZoneRun(self.id, zone_id, duration_seconds, program))
+        self._changed()
+
+    def stop_run(self, zone_id: int) -> None:
+        was_running = self.active_runs.pop(zone_id, None) is not None
+        self.water.run_finished(zone_id)
+        if was_running and self.bus is not None:
+            self.bus.publish(ZoneRun(self.id, zone_id, None))
+        self._changed()
+
+    def _changed(self) -> None:
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def remaining(self, zone_id: int) -> int:
+        run = self.active_runs.get(zone_id)
+        if not run:
+            return 0
+        r = run.duration - (time.time() - run.started_at)
+        return max(0, int(r))
+
+    # ----- current program -----
+
+    def set_current_program(self, name: str, steps: list, stop_event: Event,
+                            board: str | None = None) -> None:
+        """`board`: the relay board whose script runs the steps (board_run) — see _board_step."""
+        self._program_stop_event = stop_event
+        self.current_program = {
+            "name": name,
+            "steps": list(steps),
+            "current_step": 0,
+            "total_steps": len(steps),
+        }
+        if board is not None:
+            self.current_program["board"] = board
+        self._changed()
+
+    def advance_current_program_step(self) -> None:
+        if self.current_program is not None:
+            self.current_program["current_step"] += 1
+            self._changed()
+
+    def abort_current_program(self) -> None:
+        if self._program_stop_event is not None:
+            self._program_stop_event.set()
+        self._stop_board_program()
+        for zone_id in list(self.active_runs):
+            sp = self.sprinkler_by_id.get(zone_id)
+            if sp:
+                sp.turn_off()
+        self.clear_current_program()
+
+    def clear_current_program(self) -> None:
+        self.current_program = None
+        self._program_stop_event = None
+        self._changed()
+
+    def finish_program(self, stop_event: Event) -> None:
+        """Clear the current program if it is still the run started with `stop_event`."""
+        # After an abort a newer run, or after an HA step-down the leader's replica, may own it
+        if self._program_stop_event is stop_event:
+            self.clear_current_program()
+
+    def detach_program(self) -> None:
+        """Stop the program thread without touching the relays (another node now drives them)."""
+        if self._program_stop_event is not None:
+            self._program_stop_event.set()
+        self.clear_current_program()
+
+    def send_board_command(self, device: str, command: str, payload: str = "") -> None:
+        """OpenBK console command to relay board `device` (e.g. startScript)."""
+        if self.standby:
+            return
+        self.mqttc.publish(self.compiled.devices_by_name[device].command_topic(command), payload)
+
+    def _stop_board_program(self) -> None:
+        """Stop the script of a board-run program before its relays are switched off."""
+        cp = self.current_program
+        if cp and cp.get("board"):
+            self.send_board_command(cp["board"], "stopAllScripts")
+
+    def _board_step(self, zone_id: int) -> bool:
+        """
+        A board-run program's script switched `zone_id` on: when that is the
+        next step, advance to it and time the run by the step — the board, not
+        the Pi, moves the program on.
+        """
+        cp = self.current_program
+        if not cp or not cp.get("board") or cp["current_step"] >= len(cp["steps"]):
+            return False
+        zid, seconds = cp["steps"][cp["current_step"]]
+        if zid != zone_id:
+            return False
+        self.advance_current_program_step()
+        self.start_run(zone_id, seconds)
+        return True
+
+    def current_program_zone_id(self) -> int | None:
+        cp = self.current_program
+        if cp and cp["current_step"] > 0:
+            idx = cp["current_step"] - 1
+            if 0 <= idx < len(cp["steps"]):
+                return cp["steps"][idx][0]
+        return None
+
+    # ----- bulk zone commands -----
+
+    def validate_zone_commands(self, commands) -> list[str]:
+        """Problems with a list of zone commands (empty when all of them can be applied)."""
+        if not isinstance(commands, list) or not commands:
+            return ["commands: required non-empty list"]
+        errors = []
+        for i, cmd in enumerate(commands):
+            if not isinstance(cmd, dict):
+                errors.append(f"commands[{i}]: must be a mapping")
+                continue
+            action = cmd.get("action")
+            if action == "all_off":
+                continue
+            if action not in ("on", "off"):
+                errors.append(f"commands[{i}].action: {action!r} not in ('on', 'off', 'all_off')")
+                continue
+            if cmd.get("zone_id") not in self.sprinkler_by_id:
+                errors.append(f"commands[{i}].zone_id: unknown zone {cmd.get('zone_id')!r}")
+                continue
+            if action == "on":
+                seconds = _command_seconds(cmd)
+                if seconds is None or seconds <= 0:
+                    errors.append(f"commands[{i}]: seconds/minutes must be a positive integer")
+        if errors:
+            return errors
+
+        # max_on per board counts what is on once the batch is through: the
+        # batch's final ons plus running zones it leaves alone
+        with self.lock:
+            final, _ = self._fold_zone_commands(commands)
+            left_on = [zid for zid in self.active_runs if zid not in final]
+        on_per_device: dict[str, list[int]] = {}
+        for zid in left_on + [zid for zid, sec in final.items() if sec is not None]:
+            on_per_device.setdefault(self.compiled.zones_by_id[zid].device, []).append(zid)
+        for device, ons in on_per_device.items():
+            max_on = self.compiled.devices_by_name[device].max_on
+            if len(ons) > max_on:
+                errors.append(f"commands: zones {', '.join(map(str, sorted(ons)))} would be on together on "
+                              f"relay board {device} ({max_on} relay{'s' if max_on > 1 else ''} at a time)")
+        return errors
+
+    def submit_zone_commands(self, commands) -> tuple[list[str], int]:
+        """
+        Validate and apply under one hold of the lock, so that two concurrent
+        batches cannot both pass the max_on check against the same runs:
+        (errors, 0) when rejected, else ([], messages published).
+        """
+        with self.lock:
+            errors = self.validate_zone_commands(commands)
+            if errors:
+                return errors, 0
+            return [], self.apply_zone_commands(commands)
+
+    def _fold_zone_commands(self, commands) -> tuple[dict[int, int | None], bool]:
+        """
+        Fold validated commands in order into zone_id → seconds to run (None =
+        off); also returns whether they abort the running program, in which
+        case every active run is switched off as well.
+        """
+        final: dict[int, int | None] = {}
+        stop_all = False
+        for cmd in commands:
+            if cmd["action"] == "all_off":
+                final = {zid: None for zid in self.sprinkler_by_id}
+                stop_all = True
+            elif cmd["action"] == "off":
+                final[cmd["zone_id"]] = None
+            else:
+                final[cmd["zone_id"]] = min(_command_seconds(cmd), self.failsafe_max)
+
+        # Like zone_on/zone_off: all_off, switching on another zone or off
+        # the program's current zone aborts the running program.
+        program_zone = self.current_program_zone_id()
+        abort_program = bool(self.current_program) and (stop_all or any(
+            (sec is None) == (zid == program_zone) for zid, sec in final.items()
+        ))
+        if abort_program:
+            for zid in self.active_runs:
+                final.setdefault(zid, None)
+        return final, abort_program
+
+    def apply_zone_commands(self, commands) -> int:
+        """
+        Apply validated zone commands in order as one unit and publish the
+        resulting MQTT commands as one batch (offs before ons). Returns the
+        number of messages published.
+        """
+        with self.lock:
+            final, abort_program = self._fold_zone_commands(commands)
+            if abort_program:
+                if self._program_stop_event is not None:
+                    self._program_stop_event.set()
+                self._stop_board_program()
+                self.clear_current_program()
+
+            offs = [self.sprinkler_by_id[zid].turn_off(publish=False)
+                    for zid, sec in final.items() if sec is None]
+            ons = [self.sprinkler_by_id[zid].turn_on(sec, publish=False)
+                   for zid, sec in final.items() if sec is not None]
+            self.mqttc.set_channels(offs + ons)
+            return len(offs) + len(ons)
+
+    def zone_states(self) -> list[list[int]]:
+        """Compact [zone_id, on, remaining_seconds] rows."""
+        return [[sp.id, sp.state, self.remaining(sp.id)] for sp in self.sprinkler_by_id.values()]
+
+    # ----- failsafe + MQTT feedback -----
+
+    def failsafe_tick(self) -> None:
+        if self.standby:
+            return
+        now = time.time()
+        with self.lock:
+            for zone_id, run in list(self.active_runs.items()):
+                # exact end, not remaining()'s whole seconds: a program step must not lose its last second
+                if now >= run.started_at + run.duration:
+                    sp = self.sprinkler_by_id.get(zone_id)
+                    if sp:
+                        self.logger.info("Failsafe: turning off zone %d", zone_id)
+                        sp.turn_off()
+
+    def on_state(self, device: str, channel: int, value: int) -> None:
+        """Relay feedback from the MQTT thread: only queued when the site has a bus."""
+        if self.bus is not None:
+            self.bus.publish(RelayState(self.id, device, channel, value))
+            return
+        with self.lock:
+            self._on_state(device, channel, value)
+
+    def _handle_relay_state(self, event: RelayState) -> None:
+        with self.lock:
+            self._on_state(event.device, event.channel, event.value, event.ts)
+
+    def _on_state(self, device: str, channel: int, value: int, ts: float | None = None) -> None:
+        sp = self._sprinkler_by_address.get((device, channel))
+        if sp is None:
+            self.logger.warning("Received state for unknown channel %s/%d", device, channel)
+            return
+        sp.state = value
+        sp.reported_at[1 if value else 0] = ts or time.time()
+        self.logger.debug("State update: %s channel=%d state=%d", device, channel, value)
+        if self.standby:
+            return  # run timing comes from the leader's replicated state
+        if value == 0:
+            self.stop_run(sp.id)
+        else:
+            if (self.current_program and sp.id != self.current_program_zone_id()
+                    and not self._board_step(sp.id)):
+                self.logger.info(
+                    "External ON on channel %s/%d conflicts with program — aborting", device, channel
+                )
+                self.abort_current_program()
+            if sp.id not in self.active_runs:
+                self.logger.info(
+                    "External ON on channel %s/%d — creating failsafe run (%ds)",
+                    device, channel, self.failsafe_max,
+                )
+                self.start_run(sp.id, self.failsafe_max)
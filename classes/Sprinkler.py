@@ -1,35 +1,143 @@
 import logging
+import threading
+import time
+from collections import deque
 
 
 class RainSensor:
-    def __init__(self, mqttc, channel):
+    """
+    Rain sensor relay input, fed by MQTT state messages (OBKMqtt routes the
+    channel's state topic here). A reading must stay unchanged for
+    `debounce_seconds` before it counts; after the sensor dries, it is still
+    reported wet for `wet_hold_seconds`. get_rain_status() only reads the
+    cached state, so the 06:00 rain-skip check never waits on the broker.
+    """
+
+    def __init__(self, mqttc, channel, device=None, debounce_seconds=30,
+                 wet_hold_seconds=6 * 3600, active_low=False, history_size=200, logger=None):
         self.mqttc = mqttc
         self.channel = channel
+        self.device = device
+        self.debounce_seconds = debounce_seconds
+        self.wet_hold_seconds = wet_hold_seconds
+        self.active_low = active_low
+        self.logger = logger or logging.getLogger(__name__)
+
+        self.wet = False             # debounced state
+        self.changed_at = None       # when the debounced state last changed
+        self.dry_since = None        # end of the last wet period (for the hold window)
+        self.last_reading = None     # raw 0/1 from the sensor, None until the first message
+        self.last_reading_at = None
+        self._pending = None         # raw value waiting out the debounce
+        self._pending_since = None
+        self.history: deque = deque(maxlen=history_size)
+        self._lock = threading.Lock()
+
+    def attach(self) -> None:
+        """Route the sensor's state topic to this instance (covered by the board's wildcard)."""
+        if self.channel is None:
+            return
+        topic = self.mqttc.devices[self.device].state_topic(self.channel)
+        self.mqttc.route(topic, self._on_payload)
+
+    def _on_payload(self, payload: bytes) -> None:
+        text = payload.decode("utf-8").strip()
+        value = 1 if text in ("1", "ON", "on", "true", "True") else 0
+        self.on_reading(value ^ 1 if self.active_low else value)
+
+    def on_reading(self, wet: int, now: float | None = None) -> None:
+        now = time.time() if now is None else now
+        with self._lock:
+            self.last_reading, self.last_reading_at = wet, now
+            if wet == self._pending:
+                self._settle(now)
+                return
+            if self._pending is not None and now - self._pending_since < self.debounce_seconds:
+                self.history.append({"ts": now, "event": "bounce", "reading": wet})
+            self._pending, self._pending_since = wet, now
+            self._settle(now)
 
-    def get_rain_status(self):
-        # TODO: implement via MQTT
-        return False
+    def _settle(self, now: float) -> None:
+        """Apply the pending reading once it has been stable long enough (lock held)."""
+        if self._pending is None or bool(self._pending) == self.wet:
+            return
+        if now - self._pending_since < self.debounce_seconds:
+            return
+        self.wet = bool(self._pending)
+        self.changed_at = self._pending_since
+        if not self.wet:
+            self.dry_since = self._pending_since
+        self.history.append({"ts": self._pending_since, "event": "wet" if self.wet else "dry"})
+        self.logger.info("Rain sensor: %s", "wet" if self.wet else "dry")
+
+    def get_rain_status(self, now: float | None = None) -> bool:
+        """True while wet, and for wet_hold_seconds after it dried."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._settle(now)
+            if self.wet:
+                return True
+            return self.dry_since is not None and now - self.dry_since < self.wet_hold_seconds
+
+    def record_skip(self, program_name: str, now: float | None = None) -> None:
+        with self._lock:
+            self.history.append({
+                "ts": time.time() if now is None else now,
+                "event": "skip",
+                "program": program_name,
+                "wet": self.wet,
+            })
+
+    def status(self) -> dict:
+        raining = self.get_rain_status()
+        with self._lock:
+            return {
+                "configured": self.channel is not None,
+                "raining": raining,
+                "wet": self.wet,
+                "holding": raining and not self.wet,
+                "changed_at": self.changed_at,
+                "dry_since": self.dry_since,
+                "last_reading": self.last_reading,
+                "last_reading_at": self.last_reading_at,
+                "debounce_seconds": self.debounce_seconds,
+                "wet_hold_seconds": self.wet_hold_seconds,
+            }
 
 
 class Sprinkler:
-    def __init__(self, id, name, channel, mqttc, logger=None):
+    __slots__ = ("id", "name", "channel", "device", "mqttc", "site", "state", "reported_at", "logger")
+
+    def __init__(self, id, name, channel, mqttc, logger=None, device=None, site=None):
         self.id = id
         self.name = name
         self.channel = channel
+        self.device = device  # relay board name; None → the client's default device
         self.mqttc = mqttc
+        self.site = site  # classes.Site.Site owning the run timing; None → app_runtime default
         self.state = 0  # updated by MQTT feedback; set optimistically on turn_on/off
+        self.reported_at = [None, None]  # time of the last OFF / ON report from the board
         self.logger = logger or logging.getLogger(__name__)
 
-    def turn_on(self, seconds: int):
+    def _runtime(self):
+        if self.site is not None:
+            return self.site
         import app_runtime
+        return app_runtime
+
+    def turn_on(self, seconds: int, publish: bool = True):
+        """Switch on for `seconds`. publish=False returns the (channel, 1, device) command unsent."""
         self.state = 1
-        self.mqttc.set_channel(self.channel, 1)
-        app_runtime.start_run(self.id, seconds)
+        if publish:
+            self.mqttc.set_channel(self.channel, 1, device=self.device)
+        self._runtime().start_run(self.id, seconds)
         self.logger.info("Turning on %s (channel %d) for %ds", self.name, self.channel, seconds)
+        return None if publish else (self.channel, 1, self.device)
 
-    def turn_off(self):
-        import app_runtime
+    def turn_off(self, publish: bool = True):
         self.state = 0
-        app_runtime.stop_run(self.id)
-        self.mqttc.set_channel(self.channel, 0)
+        self._runtime().stop_run(self.id)
+        if publish:
+            self.mqttc.set_channel(self.channel, 0, device=self.device)
         self.logger.info("Turning off %s (channel %d)", self.name, self.channel)
+        return None if publish else (self.channel, 0, self.device)
@@ -0,0 +1,777 @@
+"""
+config.py — zones.yaml loading, validation and compilation.
+
+Parsing YAML is the slowest part of startup on a Pi Zero, so the prepared
+config (with derived MQTT topic templates) is pickled next to the YAML file
+as `.<name>.cache`. The cache is keyed by the YAML file's mtime/size and,
+when those change, by its SHA-256 — a `touch` or an identical rewrite does
+not force a re-parse. PyYAML is only imported when the cache misses.
+
+On a miss the config is validated once and compiled into a `CompiledConf`:
+read-only index tables (zone id → zone, (device, channel) → zone, device →
+channels, per-relay topic strings) shared by the Flask routes, `OBKMqtt`,
+`app_runtime` and `mock_openbk.py`, so hot paths never re-derive them.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import re
+import shutil
+import sys
+import time
+from dataclasses import dataclass, fields
+from types import MappingProxyType
+from typing import Mapping
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 5  # cache entry layout; the validation rules are keyed by _validator_fingerprint()
+
+SCHEDULE_TYPES = ("daily", "weekly", "once")
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+TRANSITION_MODES = ("delay", "zero_gap", "overlap")
+DEFAULT_TRANSITION = {"mode": "delay", "ms": 2000}  # off → 2 s pause → next zone on
+MAX_TRANSITION_MS = 60_000
+_TIME_RE = re.compile(r"^([01]?\d|2[0-3]):[0-5]\d$")
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_SITE_ID_RE = re.compile(r"^[A-Za-z0-9_-]+$")
+_INTERN_MAX = 32  # longer strings (program names, paths) are rarely repeated
+
+
+class ConfigError(ValueError):
+    """zones.yaml (or a program submitted through the API) failed validation."""
+
+    def __init__(self, errors: list[str]):
+        self.errors = list(errors)
+        super().__init__("invalid config: " + "; ".join(self.errors))
+
+
+@dataclass(frozen=True, slots=True)
+class DeviceSpec:
+    """One relay board and its topic scheme ("{channel}" left for per-channel topics)."""
+    name: str
+    set_tmpl: str     # e.g. "sprinkler/{channel}/set"
+    state_tmpl: str   # e.g. "sprinkler/{channel}/get"
+    set_sub: str      # e.g. "sprinkler/+/set"
+    state_sub: str    # e.g. "sprinkler/+/get"
+    max_on: int = 1   # relays the board (and its water supply) may hold on at once
+    all_off_button: int | None = None  # input channel of a physical "all off" button (autoexec.py)
+
+    def set_topic(self, channel: int) -> str:
+        return self.set_tmpl.format(channel=channel)
+
+    def state_topic(self, channel: int) -> str:
+        return self.state_tmpl.format(channel=channel)
+
+    def command_topic(self, command: str) -> str:
+        """OpenBK console command topic (startScript, stopAllScripts) — the name is the client topic."""
+        return f"cmnd/{self.name}/{command}"
+
+    def channel_from_level(self, level: str) -> int | None:
+        """Channel number from the state-topic level matched by "+" in state_sub."""
+        tmpl = next(lv for lv in self.state_tmpl.split("/") if "{channel}" in lv)
+        head, _, tail = tmpl.partition("{channel}")
+        ch = level[len(head):len(level) - len(tail)]
+        if level.startswith(head) and level.endswith(tail) and ch.isdigit():
+            return int(ch)
+        return None
+
+
+def _wildcard(tmpl: str) -> str:
+    """"sprinkler/{channel}/get" → "sprinkler/+/get" (the channel's whole level)."""
+    return "/".join("+" if "{channel}" in lv else lv for lv in tmpl.split("/"))
+
+
+@dataclass(frozen=True, slots=True)
+class ZoneSpec:
+    id: int
+    name: str
+    channel: int
+    device: str
+    set_topic: str   # precompiled, e.g. "sprinkler/31/set"
+    get_topic: str   # precompiled, e.g. "sprinkler/31/get"
+    button: int | None = None  # input channel of the zone's physical button (autoexec.py)
+
+
+@dataclass(frozen=True)
+class CompiledConf:
+    """
+    Immutable lookup tables built once from a validated config. Relays are
+    addressed by (device name, channel) so boards may reuse channel numbers.
+    """
+    zones: tuple[ZoneSpec, ...]
+    zones_by_id: Mapping[int, ZoneSpec]
+    devices: tuple[DeviceSpec, ...]
+    devices_by_name: Mapping[str, DeviceSpec]
+    default_device: str
+    zone_by_address: Mapping[tuple[str, int], ZoneSpec]
+    channels_by_device: Mapping[str, tuple[int, ...]]
+    set_topics: Mapping[tuple[str, int], str]            # (device, channel) → set topic
+    address_by_state_topic: Mapping[str, tuple[str, int]]
+    address_by_set_topic: Mapping[str, tuple[str, int]]
+    failsafe_max: int
+    poll_sec: int
+    timezone: str
+    dry_run: bool
+    rain_address: tuple[str, int] | None
+
+    def __post_init__(self):
+        for f in fields(self):
+            v = getattr(self, f.name)
+            if isinstance(v, dict):
+                object.__setattr__(self, f.name, MappingProxyType(v))
+
+    def __reduce__(self):
+        # mappingproxy is not picklable; rebuild from plain dicts
+        args = tuple(
+            dict(v) if isinstance(v, MappingProxyType) else v
+            for v in (getattr(self, f.name) for f in fields(self))
+        )
+        return (self.__class__, args)
+
+
+def cache_path_for(conf_path: str) -> str:
+    head, tail = os.path.split(os.path.abspath(conf_path))
+    return os.path.join(head, f".{tail}.cache")
+
+
+def _yaml_load(text: str):
+    import yaml
+    # libyaml's C loader is ~10x faster than the pure-Python one
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    return yaml.load(text, Loader=loader)
+
+
+def _yaml_dump(data) -> str:
+    import yaml
+    # same text as yaml.dump for plain data, ~4x faster with libyaml
+    dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+    return yaml.dump(data, Dumper=dumper, allow_unicode=True, sort_keys=False, default_flow_style=False)
+
+
+def compact(value):
+    """
+    `value` (parsed YAML / JSON) with every mapping key and short string
+    interned: the few hundred distinct keys, times and day names are then
+    shared by all programs instead of being one string object per use.
+    """
+    if isinstance(value, dict):
+        return {sys.intern(k) if isinstance(k, str) else k: compact(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [compact(v) for v in value]
+    if isinstance(value, str) and len(value) <= _INTERN_MAX:
+        return sys.intern(value)
+    return value
+
+
+def _prepare(conf: dict) -> dict:
+    """Add runtime-only keys derived from the raw YAML (stripped again on save)."""
+    prefix = conf["mqtt"].get("mqtt_topic_prefix", "sprinkler")
+    conf["mqtt"]["topics"] = {
+        "set":   f"{prefix}/{{channel}}/set",
+        "get":   f"{prefix}/{{channel}}/get",
+        "state": f"{prefix}/+/get",
+    }
+    return conf
+
+
+def _is_int(v) -> bool:
+    return isinstance(v, int) and not isinstance(v, bool)
+
+
+def _raw_devices(conf: dict) -> list:
+    """
+    The `devices:` list, or a single device synthesised from the legacy
+    `device.name` + `mqtt.mqtt_topic_prefix` keys.
+    """
+    if "devices" in conf:
+        return conf["devices"]
+    mqtt = conf.get("mqtt") or {}
+    device = conf.get("device") or {}
+    return [{
+        "name": device.get("name", "default"),
+        "prefix": mqtt.get("mqtt_topic_prefix", "sprinkler"),
+        **{k: device[k] for k in ("max_on", "all_off_button") if k in device},
+    }]
+
+
+def _device_templates(dev: dict, conf: dict) -> tuple[str, str]:
+    prefix = dev.get("prefix") or (conf.get("mqtt") or {}).get("mqtt_topic_prefix", "sprinkler")
+    out = []
+    for key, default in (("set_topic", "{prefix}/{channel}/set"),
+                         ("state_topic", "{prefix}/{channel}/get")):
+        tmpl = dev.get(key) or default
+        out.append(tmpl.replace("{prefix}", prefix).replace("{device}", str(dev.get("name"))))
+    return out[0], out[1]
+
+
+def validate_program(prog, zone_ids, where: str = "program") -> list[str]:
+    """Return a list of problems with a program dict (empty when valid)."""
+    if not isinstance(prog, dict):
+        return [f"{where}: must be a mapping"]
+    errors = []
+    if not isinstance(prog.get("name"), str) or not prog["name"].strip():
+        errors.append(f"{where}.name: required string")
+    sched = prog.get("schedule") or {}
+    if not isinstance(sched, dict):
+        errors.append(f"{where}.schedule: must be a mapping")
+        sched = {}
+    stype = sched.get("type", "daily")
+    if stype not in SCHEDULE_TYPES:
+        errors.append(f"{where}.schedule.type: {stype!r} not in {SCHEDULE_TYPES}")
+    time_str = sched.get("time", "06:00")
+    if not isinstance(time_str, str) or not _TIME_RE.match(time_str):
+        errors.append(f"{where}.schedule.time: {time_str!r} is not HH:MM")
+    if stype == "weekly":
+        bad = [d for d in sched.get("days") or [] if d not in WEEKDAYS]
+        if bad:
+            errors.append(f"{where}.schedule.days: unknown day(s) {bad}")
+    if stype == "once" and sched.get("date"):
+        if not _DATE_RE.match(str(sched["date"])):
+            errors.append(f"{where}.schedule.date: {sched['date']!r} is not YYYY-MM-DD")
+    steps = prog.get("steps") or []
+    if not isinstance(steps, list):
+        errors.append(f"{where}.steps: must be a list")
+        steps = []
+    for i, step in enumerate(steps):
+        if not isinstance(step, dict):
+            errors.append(f"{where}.steps[{i}]: must be a mapping")
+            continue
+        if step.get("zone_id") not in zone_ids:
+            errors.append(f"{where}.steps[{i}].zone_id: unknown zone {step.get('zone_id')!r}")
+        if not _is_int(step.get("minutes")) or step["minutes"] < 0:
+            errors.append(f"{where}.steps[{i}].minutes: must be a non-negative integer")
+    transition = prog.get("transition")
+    if transition is not None:
+        if not isinstance(transition, dict):
+            errors.append(f"{where}.transition: must be a mapping")
+        else:
+            mode, ms = transition.get("mode", "delay"), transition.get("ms", 0)
+            if mode not in TRANSITION_MODES:
+                errors.append(f"{where}.transition.mode: {mode!r} not in {TRANSITION_MODES}")
+            if not _is_int(ms) or not 0 <= ms <= MAX_TRANSITION_MS:
+                errors.append(f"{where}.transition.ms: must be an integer from 0 to {MAX_TRANSITION_MS}")
+            elif mode == "overlap" and ms == 0:
+                errors.append(f"{where}.transition.ms: overlap needs a positive ms")
+    if not isinstance(prog.get("board_run", False), bool):
+        errors.append(f"{where}.board_run: must be true or false")
+    elif prog.get("board_run") and prog.get("moisture_skip"):
+        errors.append(f"{where}.board_run: moisture_skip needs the backend to sequence the steps")
+    return errors
+
+
+def program_steps(prog: dict, failsafe_max: int) -> list[tuple[int, int]]:
+    """
+    (zone_id, seconds) of a program's steps with minutes > 0. Each step is
+    capped at failsafe_max — the board's failsafe would cut it there anyway —
+    the same whether the backend or the board's script (autoexec.py) runs it.
+    """
+    return [(s["zone_id"], min(int(s["minutes"]) * 60, failsafe_max))
+            for s in prog.get("steps", []) if s["minutes"] > 0]
+
+
+def program_transition(transition: dict | None) -> tuple[str, int]:
+    """(mode, ms) for a program's validated `transition`; None keeps the 2 s pause."""
+    t = transition or DEFAULT_TRANSITION
+    mode = t.get("mode", "delay")
+    return mode, 0 if mode == "zero_gap" else int(t.get("ms", 0))
+
+
+def validate_conf(conf) -> list[str]:
+    """Return a list of problems with a prepared config (empty when valid)."""
+    if not isinstance(conf, dict):
+        return ["config: top level must be a mapping"]
+    errors = []
+    mqtt = conf.get("mqtt")
+    if not isinstance(mqtt, dict):
+        errors.append("mqtt: required mapping")
+    else:
+        if not mqtt.get("host"):
+            errors.append("mqtt.host: required")
+        try:
+            int(mqtt.get("port"))
+        except (TypeError, ValueError):
+            errors.append(f"mqtt.port: {mqtt.get('port')!r} is not a port number")
+        if mqtt.get("qos", 1) not in (0, 1, 2):
+            errors.append(f"mqtt.qos: {mqtt.get('qos')!r} not in (0, 1, 2)")
+        if "record" in mqtt and not isinstance(mqtt["record"], str):
+            errors.append("mqtt.record: must be a file path")
+        v = mqtt.get("record_max_mb")
+        if v is not None and (isinstance(v, bool) or not isinstance(v, (int, float)) or v <= 0):
+            errors.append("mqtt.record_max_mb: must be a positive number")
+
+    devices = _raw_devices(conf)
+    device_names: list[str] = []
+    seen_templates: set[str] = set()
+    if not isinstance(devices, list) or not devices:
+        errors.append("devices: required non-empty list")
+        devices = []
+    for i, dev in enumerate(devices):
+        if not isinstance(dev, dict) or not isinstance(dev.get("name"), str):
+            errors.append(f"devices[{i}].name: required string")
+            continue
+        if dev["name"] in device_names:
+            errors.append(f"devices[{i}].name: duplicate device {dev['name']!r}")
+        device_names.append(dev["name"])
+        for tmpl in _device_templates(dev, conf):
+            levels = tmpl.split("/")
+            if tmpl.count("{channel}") != 1 or "+" in levels or "#" in levels:
+                errors.append(f"devices[{i}]: topic {tmpl!r} needs exactly one "
+                              "'{channel}' and no wildcards")
+            elif tmpl in seen_templates:
+                errors.append(f"devices[{i}]: topic {tmpl!r} is shared with another device")
+            seen_templates.add(tmpl)
+        if "max_on" in dev and (not _is_int(dev["max_on"]) or dev["max_on"] < 1):
+            errors.append(f"devices[{i}].max_on: must be a positive integer")
+
+    zones = conf.get("zones")
+    zone_ids: set[int] = set()
+    if not isinstance(zones, list) or not zones:
+        errors.append("zones: required non-empty list")
+        zones = []
+    addresses: set[tuple] = set()
+    default_device = device_names[0] if device_names else None
+    for i, z in enumerate(zones):
+        if not isinstance(z, dict):
+            errors.append(f"zones[{i}]: must be a mapping")
+            continue
+        if not _is_int(z.get("id")):
+            errors.append(f"zones[{i}].id: required integer")
+        elif z["id"] in zone_ids:
+            errors.append(f"zones[{i}].id: duplicate id {z['id']}")
+        else:
+            zone_ids.add(z["id"])
+        if not isinstance(z.get("name"), str):
+            errors.append(f"zones[{i}].name: required string")
+        flow = z.get("flow_lpm")
+        if flow is not None and (isinstance(flow, bool) or not isinstance(flow, (int, float)) or flow < 0):
+            errors.append(f"zones[{i}].flow_lpm: must be a non-negative number")
+        kc = z.get("crop_coefficient")
+        if kc is not None and (isinstance(kc, bool) or not isinstance(kc, (int, float)) or kc < 0):
+            errors.append(f"zones[{i}].crop_coefficient: must be a non-negative number")
+        device = z.get("device", default_device)
+        if device not in device_names:
+            errors.append(f"zones[{i}].device: unknown device {device!r}")
+        if not _is_int(z.get("channel")) or z["channel"] < 0:
+            errors.append(f"zones[{i}].channel: required non-negative integer")
+        elif (device, z["channel"]) in addresses:
+            errors.append(f"zones[{i}].channel: channel {z['channel']} used twice on {device!r}")
+        else:
+            addresses.add((device, z["channel"]))
+
+    # Physical buttons are board inputs: not a relay, not shared
+    rain = conf.get("rainsensor")
+    inputs: set[tuple] = set()
+    if isinstance(rain, dict) and _is_int(rain.get("channel")):
+        inputs.add((rain.get("device", default_device), rain["channel"]))
+    buttons = [(f"zones[{i}].button", z.get("device", default_device), z["button"])
+               for i, z in enumerate(zones) if isinstance(z, dict) and "button" in z]
+    buttons += [(f"devices[{i}].all_off_button", dev.get("name"), dev["all_off_button"])
+                for i, dev in enumerate(devices) if isinstance(dev, dict) and "all_off_button" in dev]
+    for where, device, ch in buttons:
+        if not _is_int(ch) or ch < 0:
+            errors.append(f"{where}: must be a non-negative integer")
+        elif (device, ch) in addresses:
+            errors.append(f"{where}: channel {ch} is a zone relay")
+        elif (device, ch) in inputs:
+            errors.append(f"{where}: channel {ch} is already an input on {device!r}")
+        else:
+            inputs.add((device, ch))
+
+    if rain is not None:
+        device = rain.get("device", default_device) if isinstance(rain, dict) else None
+        if not isinstance(rain, dict) or not _is_int(rain.get("channel")):
+            errors.append("rainsensor.channel: required integer")
+        elif device not in device_names:
+            errors.append(f"rainsensor.device: unknown device {device!r}")
+        elif (device, rain["channel"]) in addresses:
+            errors.append(f"rainsensor.channel: channel {rain['channel']} is also a zone")
+        if isinstance(rain, dict):
+            for key in ("debounce_seconds", "wet_hold_hours"):
+                if key in rain and (not isinstance(rain[key], (int, float))
+                                    or isinstance(rain[key], bool) or rain[key] < 0):
+                    errors.append(f"rainsensor.{key}: must be a non-negative number")
+
+    failsafe = conf.get("failsafe") or {}
+    for key in ("max_seconds", "poll_seconds"):
+        if key in failsafe and (not _is_int(failsafe[key]) or failsafe[key] <= 0):
+            errors.append(f"failsafe.{key}: must be a positive integer")
+
+    tz = conf.get("timezone")
+    if not isinstance(tz, str):
+        errors.append("timezone: required string")
+    else:
+        from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+        try:
+            ZoneInfo(tz)
+        except (ZoneInfoNotFoundError, ValueError):
+            errors.append(f"timezone: unknown zone {tz!r}")
+
+    log_conf = conf.get("logging") or {}
+    if not isinstance(log_conf, dict):
+        errors.append("logging: must be a mapping")
+    elif "level" in log_conf and str(log_conf["level"]).upper() not in (
+            "DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"):
+        errors.append(f"logging.level: unknown level {log_conf['level']!r}")
+
+    weather = conf.get("weather")
+    if weather is not None:
+        if not isinstance(weather, dict):
+            errors.append("weather: must be a mapping")
+            weather = {}
+        paths = weather.get("csv", "weather.csv")
+        if not (isinstance(paths, str) or (isinstance(paths, list) and paths
+                                           and all(isinstance(p, str) for p in paths))):
+            errors.append("weather.csv: path or list of paths required")
+        lat = weather.get("latitude", 47.5)
+        if isinstance(lat, bool) or not isinstance(lat, (int, float)) or not -90 <= lat <= 90:
+            errors.append(f"weather.latitude: {lat!r} is not a latitude")
+        for key in ("reference_et0_mm", "max_factor"):
+            v = weather.get(key)
+            if v is not None and (isinstance(v, bool) or not isinstance(v, (int, float)) or v <= 0):
+                errors.append(f"weather.{key}: must be a positive number")
+        for key in ("rain_efficiency", "min_factor"):
+            v = weather.get(key)
+            if v is not None and (isinstance(v, bool) or not isinstance(v, (int, float)) or v < 0):
+                errors.append(f"weather.{key}: must be a non-negative number")
+        if "lookback_days" in weather and (not _is_int(weather["lookback_days"])
+                                           or weather["lookback_days"] < 1):
+            errors.append("weather.lookback_days: must be a positive integer")
+
+    water = conf.get("water")
+    if water is not None:
+        if not isinstance(water, dict):
+            errors.append("water: must be a mapping")
+            water = {}
+        topic = water.get("meter_topic")
+        if topic is not None:
+            if not isinstance(topic, str) or "+" in topic or "#" in topic:
+                errors.append(f"water.meter_topic: {topic!r} must be a topic without wildcards")
+            ppl = water.get("pulses_per_litre")
+            if isinstance(ppl, bool) or not isinstance(ppl, (int, float)) or ppl <= 0:
+                errors.append("water.pulses_per_litre: required positive number with meter_topic")
+        if "log" in water and not isinstance(water["log"], str):
+            errors.append("water.log: must be a path")
+
+    moisture = conf.get("moisture")
+    if moisture is not None:
+        if not isinstance(moisture, dict):
+            errors.append("moisture: must be a mapping")
+            moisture = {}
+        topic = moisture.get("topic", "soil/{zone}/moisture")
+        if not isinstance(topic, str) or "{zone}" not in topic.split("/") or topic.count("{zone}") != 1:
+            errors.append(f"moisture.topic: {topic!r} needs {{zone}} as exactly one whole level")
+        elif "+" in topic or "#" in topic:
+            errors.append(f"moisture.topic: {topic!r} must not contain wildcards")
+        for key in ("window_seconds", "buffer_size", "queue_size", "max_age_seconds"):
+            if key in moisture and (not _is_int(moisture[key]) or moisture[key] <= 0):
+                errors.append(f"moisture.{key}: must be a positive integer")
+        for key in ("skip_above", "shorten_above"):
+            v = moisture.get(key)
+            if v is not None and (isinstance(v, bool) or not isinstance(v, (int, float))
+                                  or not 0 <= v <= 100):
+                errors.append(f"moisture.{key}: must be a percentage (0–100)")
+        skip, shorten = moisture.get("skip_above"), moisture.get("shorten_above")
+        if isinstance(skip, (int, float)) and isinstance(shorten, (int, float)) and shorten >= skip:
+            errors.append("moisture.shorten_above: must be below skip_above")
+
+    ha = conf.get("ha")
+    if ha is not None:
+        if not isinstance(ha, dict):
+            errors.append("ha: must be a mapping")
+            ha = {}
+        topic = ha.get("topic", "sprinkler/ha")
+        if not isinstance(topic, str) or not topic or "+" in topic or "#" in topic:
+            errors.append(f"ha.topic: {topic!r} must be a topic prefix without wildcards")
+        if "node_id" in ha and (not isinstance(ha["node_id"], str) or not _SITE_ID_RE.match(ha["node_id"])):
+            errors.append("ha.node_id: letters/digits/_/- only")
+        for key in ("lease_seconds", "renew_seconds"):
+            v = ha.get(key)
+            if v is not None and (isinstance(v, bool) or not isinstance(v, (int, float)) or v <= 0):
+                errors.append(f"ha.{key}: must be a positive number")
+        lease, renew = ha.get("lease_seconds", 6), ha.get("renew_seconds", 2)
+        if isinstance(lease, (int, float)) and isinstance(renew, (int, float)) and renew * 2 > lease:
+            errors.append("ha.renew_seconds: must be at most half of lease_seconds")
+
+    watchdog = conf.get("watchdog")
+    if watchdog is not None:
+        if not isinstance(watchdog, dict):
+            errors.append("watchdog: must be a mapping")
+            watchdog = {}
+        for key in ("interval_seconds", "failsafe_late_seconds", "stall_seconds", "rss_budget_mb"):
+            v = watchdog.get(key)
+            if v is not None and (isinstance(v, bool) or not isinstance(v, (int, float)) or v <= 0):
+                errors.append(f"watchdog.{key}: must be a positive number")
+        late, stall = watchdog.get("failsafe_late_seconds", 5), watchdog.get("stall_seconds", 30)
+        if isinstance(late, (int, float)) and isinstance(stall, (int, float)) and late >= stall:
+            errors.append("watchdog.failsafe_late_seconds: must be below stall_seconds")
+
+    ctl = conf.get("control")
+    if ctl is not None:
+        if not isinstance(ctl, dict):
+            errors.append("control: must be a mapping")
+            ctl = {}
+        if ctl.get("socket") is not None and not isinstance(ctl["socket"], str):
+            errors.append("control.socket: must be a path (null disables the socket)")
+        if "mode" in ctl and not re.fullmatch(r"[0-7]{3,4}", str(ctl["mode"])):
+            errors.append(f"control.mode: {ctl['mode']!r} is not an octal mode like \"660\"")
+
+    sites = conf.get("sites") or []
+    site_ids: set[str] = {"default"}
+    if not isinstance(sites, list):
+        errors.append("sites: must be a list")
+        sites = []
+    for i, site in enumerate(sites):
+        if not isinstance(site, dict):
+            errors.append(f"sites[{i}]: must be a mapping")
+            continue
+        sid = site.get("id")
+        if not isinstance(sid, str) or not _SITE_ID_RE.match(sid):
+            errors.append(f"sites[{i}].id: required, letters/digits/_/- only")
+        elif sid in site_ids:
+            errors.append(f"sites[{i}].id: duplicate or reserved id {sid!r}")
+        else:
+            site_ids.add(sid)
+        if not isinstance(site.get("conf"), str):
+            errors.append(f"sites[{i}].conf: required path to the site's YAML")
+
+    errors.extend(validate_programs(conf.get("programs") or [], zone_ids))
+    return errors
+
+
+def validate_programs(programs, zone_ids) -> list[str]:
+    """Problems with a whole program list: each program plus unique integer ids."""
+    if not isinstance(programs, list):
+        return ["programs: must be a list"]
+    errors = []
+    program_ids: set[int] = set()
+    for i, prog in enumerate(programs):
+        if isinstance(prog, dict):
+            if not _is_int(prog.get("id")):
+                errors.append(f"programs[{i}].id: required integer")
+            elif prog["id"] in program_ids:
+                errors.append(f"programs[{i}].id: duplicate id {prog['id']}")
+            else:
+                program_ids.add(prog["id"])
+        errors.extend(validate_program(prog, zone_ids, where=f"programs[{i}]"))
+    return errors
+
+
+def compile_conf(conf: dict) -> CompiledConf:
+    """Validate a prepared config and build its lookup tables. Raises ConfigError."""
+    errors = validate_conf(conf)
+    if errors:
+        raise ConfigError(errors)
+    devices = []
+    for dev in _raw_devices(conf):
+        set_tmpl, state_tmpl = _device_templates(dev, conf)
+        devices.append(DeviceSpec(
+            name=dev["name"],
+            set_tmpl=set_tmpl,
+            state_tmpl=state_tmpl,
+            set_sub=_wildcard(set_tmpl),
+            state_sub=_wildcard(state_tmpl),
+            max_on=dev.get("max_on", 1),
+            all_off_button=dev.get("all_off_button"),
+        ))
+    devices_by_name = {d.name: d for d in devices}
+    default_device = devices[0].name
+    zones = []
+    for z in conf["zones"]:
+        dev = devices_by_name[z.get("device", default_device)]
+        zones.append(ZoneSpec(
+            id=z["id"],
+            name=z["name"],
+            channel=z["channel"],
+            device=dev.name,
+            set_topic=dev.set_topic(z["channel"]),
+            get_topic=dev.state_topic(z["channel"]),
+            button=z.get("button"),
+        ))
+    zones = tuple(zones)
+    failsafe = conf.get("failsafe") or {}
+    rain = conf.get("rainsensor")
+    return CompiledConf(
+        zones=zones,
+        zones_by_id={z.id: z for z in zones},
+        devices=tuple(devices),
+        devices_by_name=devices_by_name,
+        default_device=default_device,
+        zone_by_address={(z.device, z.channel): z for z in zones},
+        channels_by_device={
+            d.name: tuple(z.channel for z in zones if z.device == d.name) for d in devices
+        },
+        set_topics={(z.device, z.channel): z.set_topic for z in zones},
+        address_by_state_topic={z.get_topic: (z.device, z.channel) for z in zones},
+        address_by_set_topic={z.set_topic: (z.device, z.channel) for z in zones},
+        failsafe_max=int(failsafe.get("max_seconds", 600)),
+        poll_sec=int(failsafe.get("poll_seconds", 3)),
+        timezone=conf["timezone"],
+        dry_run=bool(conf.get("dry_run", False)),
+        rain_address=(rain.get("device", default_device), rain["channel"]) if rain else None,
+    )
+
+
+_VALIDATOR_FINGERPRINT: str | None = None
+
+
+def _validator_fingerprint() -> str:
+    """SHA-256 of this module's source: a cache built by other validation rules is a miss."""
+    global _VALIDATOR_FINGERPRINT
+    if _VALIDATOR_FINGERPRINT is None:
+        try:
+            with open(__file__, "rb") as f:
+                _VALIDATOR_FINGERPRINT = hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            _VALIDATOR_FINGERPRINT = ""
+    return _VALIDATOR_FINGERPRINT
+
+
+def _read_cache(cache_path: str):
+    try:
+        with open(cache_path, "rb") as f:
+            entry = pickle.load(f)
+    except Exception:
+        # Unreadable or written by an older config.py — just re-parse the YAML
+        return None
+    if (not isinstance(entry, dict) or entry.get("version") != CACHE_VERSION
+            or entry.get("validator") != _validator_fingerprint()):
+        return None
+    return entry
+
+
+def _write_cache(cache_path: str, st: os.stat_result, digest: str,
+                 conf: dict, compiled: CompiledConf) -> None:
+    entry = {
+        "version": CACHE_VERSION,
+        "validator": _validator_fingerprint(),
+        "mtime_ns": st.st_mtime_ns,
+        "size": st.st_size,
+        "sha256": digest,
+        "conf": conf,
+        "compiled": compiled,
+    }
+    tmp = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_path)
+    except OSError as e:
+        # A read-only install dir only costs us the cache, never the startup
+        logger.debug("config cache not written (%s): %s", cache_path, e)
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+
+def load_conf(conf_path: str, use_cache: bool = True) -> tuple[dict, CompiledConf]:
+    """
+    Return (prepared config, compiled tables) for `conf_path`, from cache when
+    still valid. Validation only runs on a cache miss; raises ConfigError.
+    """
+    st = os.stat(conf_path)
+    cache_path = cache_path_for(conf_path)
+    entry = _read_cache(cache_path) if use_cache else None
+    if entry and entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size:
+        return entry["conf"], entry["compiled"]
+
+    with open(conf_path, "rb") as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()
+    if entry and entry["sha256"] == digest:
+        conf, compiled = entry["conf"], entry["compiled"]
+    else:
+        conf = compact(_yaml_load(raw.decode("utf-8")))  # the cache pickles the shared strings once
+        if not isinstance(conf, dict) or not isinstance(conf.get("mqtt"), dict):
+            raise ConfigError(validate_conf(conf) or ["mqtt: required mapping"])
+        compiled = compile_conf(_prepare(conf))
+        # The parse leaves these objects scattered among the parser's freed
+        # ones, pinning their heap pages (~60 MB at 1000 zones / 5000
+        # programs); a copy through pickle is packed like a warm start's
+        packed = pickle.dumps((conf, compiled), protocol=pickle.HIGHEST_PROTOCOL)
+        del conf, compiled  # freed first: the copy reuses their pages
+        conf, compiled = pickle.loads(packed)
+    if use_cache:
+        _write_cache(cache_path, st, digest, conf, compiled)
+    return conf, compiled
+
+
+def save_conf(conf_path: str, conf: dict) -> None:
+    """
+    Validate and write config back to YAML, stripping runtime-only keys, and
+    refresh the cache. Raises ConfigError without touching the file. The
+    YAML goes to a temp file next to it that replaces it once on disk, so a
+    crash or power cut mid-write leaves the old or the new config, never half.
+    """
+    compiled = compile_conf(conf)
+    mqtt_clean = {k: v for k, v in conf["mqtt"].items() if k != "topics"}
+    conf_to_save = {**conf, "mqtt": mqtt_clean}
+    text = _yaml_dump(conf_to_save)
+    raw = text.encode("utf-8")
+    tmp = f"{conf_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(raw)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(conf_path):
+            shutil.copymode(conf_path, tmp)
+        os.replace(tmp, conf_path)
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    _write_cache(cache_path_for(conf_path), os.stat(conf_path),
+                 hashlib.sha256(raw).hexdigest(), conf, compiled)
+
+
+class StartupTimer:
+    """Collects named wall-clock phases of the startup path."""
+
+    def __init__(self, t0: float | None = None):
+        self.t0 = t0 if t0 is not None else time.perf_counter()
+        self._last = self.t0
+        self.phases: list[tuple[str, float]] = []
+
+    def mark(self, label: str) -> None:
+        now = time.perf_counter()
+        self.phases.append((label, now - self._last))
+        self._last = now
+
+    def as_dict(self) -> dict:
+        out = {label: round(secs * 1000, 1) for label, secs in self.phases}
+        out["total"] = round((self._last - self.t0) * 1000, 1)
+        return out
+
+    def summary(self) -> str:
+        return " ".join(f"{k}={v}ms" for k, v in self.as_dict().items())
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Validate zones.yaml and its sites, and build the parse cache")
+    parser.add_argument("conf", nargs="?", default=os.environ.get("ZONES_CONF", "zones.yaml"))
+    args = parser.parse_args()
+    paths = [args.conf]
+    try:
+        conf, compiled = load_conf(args.conf)
+        counts = [(len(compiled.zones), len(conf.get("programs") or []))]
+        for site in conf.get("sites") or []:
+            paths.append(site["conf"])
+            sconf, scompiled = load_conf(site["conf"])
+            counts.append((len(scompiled.zones), len(sconf.get("programs") or [])))
+    except ConfigError as e:
+        print(f"{paths[-1]}:", *e.errors, sep="\n  ")
+        sys.exit(1)
+    for path, (zones, programs) in zip(paths, counts):
+        print(f"{path}: ok, {zones} zones, {programs} programs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+control.py — local control socket: a line protocol on a Unix domain socket.
+
+For scripts on the Pi itself (cron hooks, Home Assistant shell commands,
+sprinklerctl.py): no HTTP, no Flask, no JSON. One request per line, one
+reply line per request, any number of requests per connection:
+
+  request   [@<site id>] <command> [args...]
+  reply     ok[ <payload>]   |   err <message>
+
+  ping                  ok pong
+  sites                 ok default nyaralo ...
+  zones                 ok 1:0:0 2:1:245 ...      zone id : on : remaining seconds
+  zone <id>             ok 2:1:245
+  program               ok -  |  ok <step>/<total> <name>
+  on <id> [seconds]     ok <published>            default 60 s, capped at failsafe.max_seconds
+  off <id>              ok <published>
+  alloff                ok <published>
+  run <program id>      ok
+  abort                 ok
+
+Zone commands go through Site.submit_zone_commands (validate + apply),
+exactly like POST /api/zones/bulk (max_on checks, program abort, one MQTT
+batch). A standby node refuses the changing commands, as the HTTP API does.
+
+Every connection gets its own daemon thread; the listener thread is named
+"control". The socket file (`control.socket`, $SPRINKLER_SOCKET overrides)
+is created with `control.mode` permissions; a stale file from a crashed
+process is replaced, a live one (another instance) is left alone.
+"""
+
+import logging
+import os
+import socket
+import socketserver
+import threading
+
+DEFAULT_SOCKET = "/run/sprinkler/control.sock"  # service/sprinkler.service: RuntimeDirectory=sprinkler
+DEFAULTS = {
+    "socket": DEFAULT_SOCKET,
+    "mode": "660",
+}
+MAX_LINE = 1024
+
+WRITE_COMMANDS = {"on", "off", "alloff", "run", "abort"}
+
+
+class ControlError(Exception):
+    """Answered to the client as `err <message>`."""
+
+
+def _int_arg(args: list[str], i: int, what: str) -> int:
+    if len(args) <= i:
+        raise ControlError(f"missing {what}")
+    try:
+        return int(args[i])
+    except ValueError:
+        raise ControlError(f"{what} must be an integer, not {args[i]!r}") from None
+
+
+def _zone_row(row) -> str:
+    return ":".join(map(str, row))
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        control = self.server.control
+        while True:
+            raw = self.rfile.readline(MAX_LINE + 1)
+            if not raw:
+                return
+            if len(raw) > MAX_LINE:
+                self.wfile.write(b"err line too long\n")
+                return
+            line = raw.decode("utf-8", "replace").strip()
+            if line:
+                self.wfile.write((control.execute(line) + "\n").encode("utf-8"))
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ControlServer:
+    def __init__(self, conf: dict | None, sites: dict, run_program=None,
+                 logger: logging.Logger | None = None):
+        conf = {**DEFAULTS, **(conf or {})}
+        self.path = os.environ.get("SPRINKLER_SOCKET") or conf["socket"]
+        self.mode = int(str(conf["mode"]), 8)
+        self.sites = sites
+        self.default_site = next(s for s in sites.values() if s.is_default)
+        self.run_program = run_program  # (site, program id) → False when there is no such program
+        self.logger = logger or logging.getLogger(__name__)
+        self.requests = 0
+        self._server: _Server | None = None
+        self._thread: threading.Thread | None = None
+        self._commands = {
+            "ping": self._cmd_ping,
+            "sites": self._cmd_sites,
+            "zones": self._cmd_zones,
+            "zone": self._cmd_zone,
+            "program": self._cmd_program,
+            "on": self._cmd_on,
+            "off": self._cmd_off,
+            "alloff": self._cmd_alloff,
+            "run": self._cmd_run,
+            "abort": self._cmd_abort,
+        }
+
+    # ----- wiring -----
+
+    def start(self) -> bool:
+        """Bind and serve in a daemon thread; False (logged) when the socket cannot be created."""
+        if not self.path:
+            return False
+        try:
+            self._remove_stale()
+            self._server = _Server(self.path, _Handler)
+            os.chmod(self.path, self.mode)
+        except OSError as e:
+            self.logger.warning("Control socket %s unavailable: %s", self.path, e)
+            self._server = None
+            return False
+        self._server.control = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name="control", daemon=True)
+        self._thread.start()
+        self.logger.info("Control socket listening on %s", self.path)
+        return True
+
+    def _remove_stale(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except OSError:
+            os.unlink(self.path)  # nobody listening: left over from a crash
+            return
+        finally:
+            probe.close()
+        raise OSError(f"another process is listening on {self.path}")
+
+    def stop(self) -> None:
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    # ----- protocol -----
+
+    def execute(self, line: str) -> str:
+        """One request line → one reply line (without the newline)."""
+        self.requests += 1
+        words = line.split()
+        site = self.default_site
+        if words[0].startswith("@"):
+            site = self.sites.get(words[0][1:])
+            if site is None:
+                return f"err unknown site {words[0][1:]!r}"
+            words = words[1:]
+        if not words:
+            return "err empty command"
+        cmd, args = words[0].lower(), words[1:]
+        handler = self._commands.get(cmd)
+        if handler is None:
+            return f"err unknown command {cmd!r}"
+        if cmd in WRITE_COMMANDS and site.standby:
+            return "err standby node — send commands to the leader"
+        try:
+            payload = handler(site, args)
+        except ControlError as e:
+            return f"err {e}"
+        except Exception:
+            self.logger.exception("Control command failed: %s", line)
+            return "err internal error (see log)"
+        return f"ok {payload}" if payload else "ok"
+
+    def _cmd_ping(self, site, args):
+        return "pong"
+
+    def _cmd_sites(self, site, args):
+        return " ".join(self.sites)
+
+    def _cmd_zones(self, site, args):
+        return " ".join(_zone_row(r) for r in site.zone_states())
+
+    def _cmd_zone(self, site, args):
+        zid = _int_arg(args, 0, "zone id")
+        if zid not in site.sprinkler_by_id:
+            raise ControlError(f"unknown zone {zid}")
+        return _zone_row([zid, site.sprinkler_by_id[zid].state, site.remaining(zid)])
+
+    def _cmd_program(self, site, args):
+        cp = site.current_program
+        if not cp:
+            return "-"
+        return f"{cp['current_step']}/{cp['total_steps']} {cp['name']}"
+
+    def _apply(self, site, commands: list[dict]) -> str:
+        errors, published = site.submit_zone_commands(commands)
+        if errors:
+            raise ControlError("; ".join(e.split(": ", 1)[-1] for e in errors))
+        return str(published)
+
+    def _cmd_on(self, site, args):
+        zid = _int_arg(args, 0, "zone id")
+        seconds = _int_arg(args, 1, "seconds") if len(args) > 1 else 60
+        return self._apply(site, [{"action": "on", "zone_id": zid, "seconds": seconds}])
+
+    def _cmd_off(self, site, args):
+        return self._apply(site, [{"action": "off", "zone_id": _int_arg(args, 0, "zone id")}])
+
+    def _cmd_alloff(self, site, args):
+        return self._apply(site, [{"action": "all_off"}])
+
+    def _cmd_run(self, site, args):
+        pid = _int_arg(args, 0, "program id")
+        if self.run_program is None or not self.run_program(site, pid):
+            raise ControlError(f"unknown program {pid}")
+        return ""
+
+    def _cmd_abort(self, site, args):
+        site.abort_current_program()
+        return ""
+
+    def status(self) -> dict:
+        return {"socket": self.path if self._server else None, "requests": self.requests}
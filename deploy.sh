@@ -1,5 +1,7 @@
 #!/bin/bash
 cd /home/pi/sprinkler
 git pull origin master
+python3 static_assets.py > /dev/null  # precompress static/ before the restart
+python3 config.py "${ZONES_CONF:-zones.yaml}" || exit 1  # validate + parse cache: the daemon never parses YAML
 sudo systemctl restart sprinkler
 journalctl -u sprinkler -f
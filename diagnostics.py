@@ -0,0 +1,306 @@
+"""
+diagnostics.py — sampling profiler, stall watchdog, memory and systemd notification.
+
+Profiler (GET /api/profile?seconds=10): the request thread wakes `hz` times
+a second, walks sys._current_frames() of every other thread and counts each
+stack. The answer is collapsed-stack text, one line per distinct stack —
+
+  flask;run_app (app.py);... ;partial_zones (app.py) 37
+
+— ready for flamegraph.pl or speedscope. It is a wall-clock profile: a
+thread blocked in sleep(), a lock or a socket read is counted where it
+waits, which is exactly what a sluggish dashboard needs. Nothing runs while
+no profile is requested; at 100 Hz a sample costs ≈ 0.1 ms on a Pi.
+
+Watchdog: a daemon thread checks every `interval_seconds`
+  - heartbeats (app_runtime.heartbeats): the failsafe loop stamps one every
+    second, an APScheduler job every 10 s. A beat older than its `late`
+    limit logs the stack of its thread; one older than `stall_seconds`
+    logs every thread's stack (a lock holder shows up there).
+  - threads that must stay alive (paho network loop, Flask server);
+  - event bus handlers busy for longer than `stall_seconds`;
+  - with `rss_budget_mb`, the resident set size (logged, never critical).
+Each problem is logged once per episode, and once more when it clears.
+
+systemd (service/sprinkler.service, Type=notify + WatchdogSec): READY=1
+after startup, then WATCHDOG=1 on every check while no critical check
+fails. A wedged failsafe loop, a dead MQTT thread or a stuck relay-state
+worker stops the pings, and systemd kills and restarts the process.
+"""
+
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+DEFAULTS = {
+    "interval_seconds": 2,
+    "failsafe_late_seconds": 5,
+    "stall_seconds": 30,
+    "rss_budget_mb": None,
+}
+
+PROFILE_MAX_SECONDS = 60
+PROFILE_MAX_HZ = 250
+
+
+# ----- systemd -----
+
+def sd_notify(message: str) -> bool:
+    """Send `message` (e.g. "READY=1") to $NOTIFY_SOCKET; False when not run by systemd."""
+    addr = os.environ.get("NOTIFY_SOCKET")
+    if not addr:
+        return False
+    if addr.startswith("@"):
+        addr = "\0" + addr[1:]  # abstract namespace
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as s:
+            s.connect(addr)
+            s.sendall(message.encode("utf-8"))
+        return True
+    except OSError:
+        return False
+
+
+# ----- memory -----
+
+def rss_mb() -> float | None:
+    """Resident set size of this process in MB (None where /proc is missing)."""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def release_memory() -> bool:
+    """
+    Collect garbage and return freed heap pages to the OS (glibc malloc_trim).
+    Startup parses YAML and compiles tables into short-lived objects; without
+    this their pages stay in the resident set. False where there is no glibc.
+    """
+    import gc
+    gc.collect()
+    try:
+        import ctypes
+        libc = ctypes.CDLL("libc.so.6")
+        return bool(libc.malloc_trim(0))
+    except (OSError, AttributeError):
+        return False
+
+
+# ----- sampling profiler -----
+
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    """Another profile is already running."""
+
+
+def _thread_names() -> dict[int, str]:
+    return {t.ident: t.name for t in threading.enumerate()}
+
+
+def sample_stacks(seconds: float, hz: int = 100, lines: bool = False) -> tuple[Counter, dict]:
+    """
+    Sample every other thread for `seconds`; returns (Counter of collapsed
+    stack → samples, stats). Raises ProfilerBusy if a profile is running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("a profile is already running")
+    try:
+        me = threading.get_ident()
+        counts: Counter = Counter()
+        labels: dict = {}
+        period = 1.0 / hz
+        samples = 0
+        cost = 0.0
+        start = time.monotonic()
+        deadline = start + seconds
+        next_at = start
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if next_at > now:
+                time.sleep(next_at - now)
+            next_at += period
+            t0 = time.perf_counter()
+            names = _thread_names()
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    key = (code, frame.f_lineno) if lines else code
+                    label = labels.get(key)
+                    if label is None:
+                        where = os.path.basename(code.co_filename)
+                        if lines:
+                            where = f"{where}:{frame.f_lineno}"
+                        label = labels[key] = f"{code.co_name} ({where})"
+                    stack.append(label)
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}").replace(";", ":"))
+                counts[";".join(reversed(stack))] += 1
+            cost += time.perf_counter() - t0
+            samples += 1
+        elapsed = time.monotonic() - start
+        return counts, {
+            "samples": samples,
+            "seconds": round(elapsed, 3),
+            "hz": hz,
+            "sample_ms": round(cost / samples * 1000, 3) if samples else 0.0,
+            "overhead_pct": round(cost / elapsed * 100, 2) if elapsed else 0.0,
+        }
+    finally:
+        _profile_lock.release()
+
+
+def collapse(counts: Counter) -> str:
+    """Brendan Gregg's collapsed-stack text, heaviest stacks first."""
+    return "".join(f"{stack} {n}\n" for stack, n in counts.most_common())
+
+
+def format_thread_stacks(idents=None) -> str:
+    """Current stacks of the given threads (all threads when None), as in a traceback."""
+    names = _thread_names()
+    out = []
+    for ident, frame in sys._current_frames().items():
+        if idents is not None and ident not in idents:
+            continue
+        out.append(f'Thread "{names.get(ident, ident)}" ({ident}):\n')
+        out.extend(traceback.format_stack(frame))
+    return "".join(out)
+
+
+# ----- watchdog -----
+
+class Watchdog:
+    def __init__(self, conf: dict | None, heartbeats: dict, logger: logging.Logger | None = None):
+        conf = {**DEFAULTS, **(conf or {})}
+        self.interval = float(conf["interval_seconds"])
+        self.stall_seconds = float(conf["stall_seconds"])
+        self.failsafe_late = float(conf["failsafe_late_seconds"])
+        self.rss_budget = conf["rss_budget_mb"]  # MB; None = not checked
+        self.heartbeats = heartbeats            # name → monotonic time of the last beat (shared dict)
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._beats: dict[str, tuple] = {}      # name → (late seconds, thread getter, critical)
+        self._threads: dict[str, tuple] = {}    # name → (thread getter, critical)
+        self._buses: list = []
+        self._problems: dict[str, tuple] = {}   # key → (message, critical), while the problem lasts
+        self.healthy = True
+        self._failing: list[str] = []
+        self.checks = 0
+        self.systemd = False
+        self._thread: threading.Thread | None = None
+
+    # ----- registration -----
+
+    def watch_heartbeat(self, name: str, late: float, thread=None, critical: bool = False) -> None:
+        """`thread` is a callable returning the beating thread (or None); its stack is logged when late."""
+        self._beats[name] = (late, thread, critical)
+
+    def watch_thread(self, name: str, thread, critical: bool = True) -> None:
+        """`thread` is a callable returning a Thread that must stay alive (None = not started, skipped)."""
+        self._threads[name] = (thread, critical)
+
+    def watch_bus(self, bus) -> None:
+        self._buses.append(bus)
+
+    # ----- loop -----
+
+    def start(self) -> None:
+        self.systemd = sd_notify("READY=1")
+        self._thread = threading.Thread(target=self._loop, name="watchdog", daemon=True)
+        self._thread.start()
+        self.logger.info("Watchdog started (every %gs, stall after %gs%s)", self.interval,
+                         self.stall_seconds, ", systemd notify" if self.systemd else "")
+
+    def stop(self) -> None:
+        sd_notify("STOPPING=1")
+
+    def _loop(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception:
+                self.logger.exception("Watchdog check failed")
+
+    def check(self) -> bool:
+        """One round of checks; logs new / cleared problems, pings systemd while healthy."""
+        now = time.monotonic()
+        found: dict[str, tuple[str, bool, set | None]] = {}  # key → (message, critical, threads to dump)
+
+        for name, (late, thread_fn, critical) in self._beats.items():
+            last = self.heartbeats.get(name)
+            if last is None:
+                continue  # not beating yet
+            age = now - last
+            if age > self.stall_seconds:
+                found[f"beat:{name}"] = (f"{name} heartbeat stalled for {age:.0f}s", critical, None)
+            elif age > late:
+                t = thread_fn() if thread_fn else None
+                found[f"beat:{name}"] = (f"{name} heartbeat late by {age:.1f}s", False,
+                                         {t.ident} if t is not None else None)
+
+        for name, (thread_fn, critical) in self._threads.items():
+            t = thread_fn()
+            if t is not None and not t.is_alive():
+                found[f"thread:{name}"] = (f"{name} thread died", critical, set())
+
+        for bus in self._buses:
+            for sub in bus.subscriptions():
+                busy = sub.busy_for()
+                if busy > self.stall_seconds:
+                    found[f"bus:{sub.name}"] = (f"event handler {sub.name} busy for {busy:.0f}s",
+                                                True, {sub.thread_ident})
+
+        if self.rss_budget:
+            rss = rss_mb()
+            if rss is not None and rss > self.rss_budget:
+                found["memory"] = (f"resident memory {rss:.0f} MB over the {self.rss_budget} MB budget",
+                                   False, set())
+
+        for key, (message, critical, idents) in found.items():
+            seen = self._problems.get(key)
+            if seen is None or (critical and not seen[1]):  # new, or escalated to critical
+                stacks = format_thread_stacks(idents) if idents != set() else ""
+                self.logger.error("Watchdog: %s%s\n%s", message, " (critical)" if critical else "", stacks)
+            self._problems[key] = (message, critical)
+        for key in list(self._problems):
+            if key not in found:
+                self.logger.warning("Watchdog: recovered — %s", self._problems.pop(key)[0])
+
+        self.healthy = not any(critical for _, critical, _ in found.values())
+        self.checks += 1
+        if self.healthy:
+            sd_notify("WATCHDOG=1")
+        failing = sorted(key for key, (_, critical, _) in found.items() if critical)
+        if failing != self._failing:  # `systemctl status` shows what blocks the pings
+            sd_notify("STATUS=" + ("stalled: " + ", ".join(failing) if failing else "running"))
+            self._failing = failing
+        return self.healthy
+
+    def status(self) -> dict:
+        now = time.monotonic()
+        return {
+            "healthy": self.healthy,
+            "systemd": self.systemd,
+            "checks": self.checks,
+            "problems": sorted(m for m, _ in self._problems.values()),
+            "heartbeat_age": {name: round(now - t, 1) for name, t in self.heartbeats.items()},
+            "rss_mb": round(rss_mb() or 0, 1),
+            "rss_budget_mb": self.rss_budget,
+        }
@@ -0,0 +1,221 @@
+"""
+events.py — in-process event bus between the MQTT thread and the runtime.
+
+paho's network thread must never wait on business logic: a relay board that
+reboots republishes every channel at once, and a state change that aborts a
+program publishes an OFF for every active run. OBKMqtt callbacks therefore
+only build a small typed event and hand it to EventBus.publish(), which never
+blocks. Every subscriber owns a bounded queue and a worker thread:
+
+  policy="coalesce"     keep only the newest event per key (e.g. per relay
+                        channel) — a reboot burst collapses to one event per
+                        channel and the final state is never lost
+  policy="drop_new"     full queue → the incoming event is dropped
+  policy="drop_oldest"  full queue → the oldest queued event is dropped
+
+Each subscription counts delivered / dropped / coalesced events, handler
+errors, its queue high-water mark and the worst publish→handle lag
+(GET /api/events → "subscribers").
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+POLICIES = ("coalesce", "drop_new", "drop_oldest")
+
+
+@dataclass(frozen=True, slots=True)
+class RelayState:
+    """A relay board reported a channel state (MQTT state topic)."""
+    site_id: str
+    device: str
+    channel: int
+    value: int
+    ts: float = field(default_factory=time.time)
+
+
+@dataclass(frozen=True, slots=True)
+class ZoneRun:
+    """A zone run started (duration in seconds) or stopped (duration None)."""
+    site_id: str
+    zone_id: int
+    duration: int | None
+    program: str | None = None
+    ts: float = field(default_factory=time.time)
+
+
+class Subscription:
+    def __init__(self, name: str, handler, event_types: tuple, maxsize: int,
+                 policy: str, key=None, accept=None, logger: logging.Logger | None = None):
+        if policy not in POLICIES:
+            raise ValueError(f"policy {policy!r} not in {POLICIES}")
+        if policy == "coalesce" and key is None:
+            raise ValueError("policy 'coalesce' needs a key function")
+        self.name = name
+        self.handler = handler
+        self.event_types = event_types
+        self.maxsize = maxsize
+        self.policy = policy
+        self.key = key
+        self.accept = accept  # optional event → bool filter, evaluated on the publisher's thread
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._pending: dict | deque = {} if policy == "coalesce" else deque()
+        self._cond = threading.Condition(threading.Lock())
+        self.delivered = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.high_water = 0
+        self.max_lag_ms = 0.0
+        self._busy_since: float | None = None  # monotonic start of the batch being handled
+        self._thread = threading.Thread(target=self._work, name=f"events:{name}", daemon=True)
+        self._thread.start()
+
+    def offer(self, event) -> None:
+        """Queue `event` without blocking; applies the overflow policy."""
+        with self._cond:
+            pending = self._pending
+            if self.policy == "coalesce":
+                k = self.key(event)
+                if k in pending:
+                    pending[k] = event
+                    self.coalesced += 1
+                    return
+                if len(pending) >= self.maxsize:
+                    self.dropped += 1
+                    return
+                pending[k] = event
+            elif len(pending) >= self.maxsize:
+                self.dropped += 1
+                if self.policy == "drop_new":
+                    return
+                pending.popleft()
+                pending.append(event)
+            else:
+                pending.append(event)
+            if len(pending) > self.high_water:
+                self.high_water = len(pending)
+            self._cond.notify()
+
+    def _take(self) -> list:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            if self.policy == "coalesce":
+                batch = list(self._pending.values())
+                self._pending = {}
+            else:
+                batch = list(self._pending)
+                self._pending.clear()
+            self._busy_since = time.monotonic()
+            return batch
+
+    def _work(self) -> None:
+        while True:
+            for event in self._take():
+                try:
+                    self.handler(event)
+                except Exception:
+                    self.errors += 1
+                    self.logger.exception("event handler %s failed on %r", self.name, event)
+                self.delivered += 1
+                lag = (time.time() - event.ts) * 1000
+                if lag > self.max_lag_ms:
+                    self.max_lag_ms = lag
+            self._busy_since = None
+
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def idle(self) -> bool:
+        with self._cond:
+            return not self._pending and self._busy_since is None
+
+    def busy_for(self) -> float:
+        """Seconds the current batch has been in the handler (0 when waiting)."""
+        since = self._busy_since
+        return time.monotonic() - since if since is not None else 0.0
+
+    @property
+    def thread_ident(self) -> int | None:
+        return self._thread.ident
+
+    def stats(self) -> dict:
+        return {
+            "policy": self.policy,
+            "maxsize": self.maxsize,
+            "depth": self.depth(),
+            "high_water": self.high_water,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "max_lag_ms": round(self.max_lag_ms, 1),
+        }
+
+
+class EventBus:
+    def __init__(self, logger: logging.Logger | None = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self._subs: list[Subscription] = []
+        self._by_type: dict[type, tuple[Subscription, ...]] = {}
+        self.published = 0
+
+    def subscribe(self, name: str, handler, event_types: tuple, maxsize: int = 1000,
+                  policy: str = "drop_new", key=None, accept=None) -> Subscription:
+        """handler(event) runs on the subscription's own worker thread."""
+        sub = Subscription(name, handler, tuple(event_types), maxsize, policy,
+                           key=key, accept=accept, logger=self.logger)
+        self._subs.append(sub)
+        # Rebuilt on subscribe so publish() is one dict lookup, no locking
+        self._by_type = {
+            t: tuple(s for s in self._subs if t in s.event_types)
+            for t in {t for s in self._subs for t in s.event_types}
+        }
+        return sub
+
+    def publish(self, event) -> None:
+        """Hand `event` to every interested subscriber; never blocks."""
+        self.published += 1
+        for sub in self._by_type.get(type(event), ()):
+            if sub.accept is None or sub.accept(event):
+                sub.offer(event)
+
+    def subscriptions(self) -> list[Subscription]:
+        return list(self._subs)
+
+    def drain(self, timeout: float = 10.0) -> bool:
+        """Wait until every queue is empty and no handler is running (replay, benchmarks)."""
+        deadline = time.monotonic() + timeout
+        while not all(s.idle() for s in self._subs):
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.001)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "published": self.published,
+            "subscribers": {s.name: s.stats() for s in self._subs},
+        }
+
+
+class EventHistory:
+    """Newest `size` events as dicts, for GET /api/events (fed by a drop_oldest subscription)."""
+
+    def __init__(self, size: int = 500):
+        self._events: deque = deque(maxlen=size)
+        self._seq = 0
+
+    def record(self, event) -> None:
+        self._seq += 1
+        self._events.append({"seq": self._seq, "type": type(event).__name__,
+                             **{f: getattr(event, f) for f in event.__slots__}})
+
+    def records(self, since: int = 0, limit: int = 200) -> list[dict]:
+        out = [e for e in self._events if e["seq"] > since]
+        return out[-limit:] if limit > 0 else []
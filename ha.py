@@ -0,0 +1,302 @@
+"""
+ha.py — hot standby: leader election and state replication over MQTT.
+
+Two (or more) app.py processes share one broker and one zones.yaml, each
+with its own node id (`ha.node_id` or $SPRINKLER_NODE). Exactly one — the
+leader — drives the relays, runs programs and the failsafe; the others keep
+a replicated copy of its state and take over when it disappears.
+
+  <prefix>/lease                 retained {"node": id, "ts": ...}, renewed
+                                 every renew_seconds by the leader
+  <prefix>/state/<site id>       retained {"ts": ..., active_runs, current_program},
+                                 republished with every lease renewal
+  <prefix>/programs/<site id>    retained program list (edits on the leader)
+
+A node claims the lease once nobody renewed it for lease_seconds (a fresh
+process waits that long too, so it sees the retained lease first). There is
+no compare-and-set on a broker: if two nodes claim at once, the lower node
+id wins and the other steps down as soon as it sees that lease.
+
+Times are replicated as durations ("running for 40 s of 300 s") measured at
+publish time. Lease and state carry the publisher's wall-clock `ts`: a
+retained message older than lease_seconds (a leader that died long ago, both
+nodes back after a power cut) is ignored, so the Pis' clocks must agree to
+well within lease_seconds (NTP).
+
+A standby keeps following relay feedback (sp.state) itself. On takeover it
+switches off runs that expired in the gap, resumes the interrupted program
+from the current step with the step's remaining time (turn_on re-arms that
+zone's failsafe run) and lets the failsafe loop handle replicated manual
+runs — but only when the replicated state was fresh when the lease lapsed.
+Stale state is dropped; relays reporting on get a failsafe run instead.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from classes.Site import ActiveRun
+
+DEFAULTS = {
+    "topic": "sprinkler/ha",
+    "lease_seconds": 6,
+    "renew_seconds": 2,
+}
+
+
+class HotStandby:
+    def __init__(self, conf: dict, sites: dict, mqttc, resume_program=None,
+                 apply_programs=None, logger: logging.Logger | None = None):
+        conf = {**DEFAULTS, **(conf or {})}
+        self.node_id = str(os.environ.get("SPRINKLER_NODE") or conf.get("node_id") or socket.gethostname())
+        self.prefix = conf["topic"].rstrip("/")
+        self.lease_seconds = float(conf["lease_seconds"])
+        self.renew_seconds = float(conf["renew_seconds"])
+        self.sites = sites
+        self.mqttc = mqttc
+        self.resume_program = resume_program    # (site, steps, name) → start a program run
+        self.apply_programs = apply_programs    # (site, [program dict]) → store, persist, reschedule
+        self.logger = logger or logging.getLogger(__name__)
+
+        self.lease_topic = f"{self.prefix}/lease"
+        self.is_leader = False
+        self.leader: str | None = None          # node id holding the lease, as last seen
+        self._lease_seen = time.monotonic()     # startup counts as "just seen": wait one lease
+        self._last_renew = 0.0
+        self._dirty: set[str] = set()           # site ids whose state must be published
+        self._replica: dict[str, tuple[float, dict]] = {}  # site id → (published, as monotonic; payload)
+        self._seq = 0
+        self.takeovers = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    # ----- wiring -----
+
+    def start(self) -> None:
+        self.mqttc.subscribe(self.lease_topic, self._on_lease)
+        self.mqttc.subscribe(f"{self.prefix}/state/+", self._on_state)
+        self.mqttc.subscribe(f"{self.prefix}/programs/+", self._on_programs)
+        for site in self.sites.values():
+            site.standby = True
+            site.on_change = self._mark_dirty
+        if self.mqttc.dry_run:
+            # No broker, no peer: lead right away so dry runs behave as before
+            self._take_over(time.monotonic())
+        self._thread = threading.Thread(target=self._loop, name="ha", daemon=True)
+        self._thread.start()
+
+    def release(self) -> None:
+        """Clear the lease on clean shutdown so a standby takes over without waiting."""
+        if self.is_leader:
+            self.mqttc.publish(self.lease_topic, "", retain=True)
+
+    def _mark_dirty(self, site) -> None:
+        if self.is_leader:
+            with self._lock:
+                self._dirty.add(site.id)
+            self._wake.set()
+
+    # ----- election -----
+
+    def _loop(self) -> None:
+        while True:
+            self._wake.wait(min(0.5, self.renew_seconds))
+            self._wake.clear()
+            try:
+                self._tick(time.monotonic())
+            except Exception:
+                self.logger.exception("HA tick failed")
+
+    def _tick(self, now: float) -> None:
+        if self.is_leader:
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+            if now - self._last_renew >= self.renew_seconds:
+                self._publish_lease(now)
+                dirty = set(self.sites)  # keeps the retained state younger than lease_seconds
+            for site_id in dirty:
+                self._publish_state(self.sites[site_id])
+        elif now - self._lease_seen >= self.lease_seconds:
+            self._take_over(now)
+
+    def _publish_lease(self, now: float) -> None:
+        self._last_renew = now
+        self.mqttc.publish(self.lease_topic, json.dumps({"node": self.node_id, "ts": time.time()}),
+                           retain=True)
+
+    def _on_lease(self, payload: bytes) -> None:
+        now = time.monotonic()
+        if not payload:
+            # Leader released the lease on shutdown
+            with self._lock:
+                if not self.is_leader:
+                    self.leader, self._lease_seen = None, -self.lease_seconds
+            self._wake.set()
+            return
+        lease = json.loads(payload)
+        node = str(lease["node"])
+        if node == self.node_id or self._stale(lease):
+            return  # a stale lease is a retained leftover of a node that is gone
+        with self._lock:
+            if self.is_leader and node > self.node_id:
+                # Competing claim we win: overwrite the retained lease right away
+                self._last_renew = 0.0
+                self._wake.set()
+                return
+            self.leader, self._lease_seen = node, now
+            step_down = self.is_leader
+        if step_down:
+            self._step_down(node)
+
+    def _take_over(self, now: float) -> None:
+        self.logger.warning("HA: no lease from %s for %.0fs — node %s taking over",
+                            self.leader or "anyone", self.lease_seconds, self.node_id)
+        with self._lock:
+            self.is_leader, self.leader = True, self.node_id
+            self.takeovers += 1
+        self._publish_lease(now)
+        for site in self.sites.values():
+            self._activate(site)
+
+    def _stale(self, msg: dict) -> bool:
+        return time.time() - float(msg.get("ts") or 0) > self.lease_seconds
+
+    def _replica_fresh(self, site_id: str) -> bool:
+        """Whether the site's replicated state was current when the leader's lease lapsed."""
+        replica = self._replica.get(site_id)
+        return replica is not None and replica[0] >= self._lease_seen - self.lease_seconds
+
+    def _activate(self, site) -> None:
+        resume = None
+        fresh = self._replica_fresh(site.id)
+        with site.lock:
+            site.standby = False
+            if not fresh and (site.current_program or site.active_runs):
+                self.logger.warning("HA: replicated state of site %s is stale — not resuming it", site.id)
+                site.current_program = None
+                site.active_runs = {}
+            cp = site.current_program
+            if cp is not None and cp.get("board"):
+                # The board's script keeps running it: its further steps read as external ONs
+                self.logger.warning("HA: program '%s' runs on board %s — leaving it to the board",
+                                    cp["name"], cp["board"])
+                site.current_program = None
+                cp = None
+            if cp is not None:
+                # The old leader's program thread is gone: continue from the current step
+                steps = [tuple(s) for s in cp["steps"][cp["current_step"]:]]
+                zid = site.current_program_zone_id()
+                if zid is not None and site.remaining(zid) > 0:
+                    steps.insert(0, (zid, site.remaining(zid)))
+                resume = (steps, cp["name"])
+                site.current_program = None
+            else:
+                for zid in site.active_runs:
+                    site.water.run_started(zid, None)
+            for sp in site.sprinkler_by_id.values():
+                if sp.state and sp.id not in site.active_runs:
+                    # On without a replicated run: same failsafe run as an external ON
+                    site.start_run(sp.id, site.failsafe_max)
+        # Runs that expired while nobody was leader are switched off now, not on the next tick
+        site.failsafe_tick()
+        self._mark_dirty(site)
+        if resume and resume[0] and self.resume_program:
+            self.logger.warning("HA: resuming program '%s' with steps %r", resume[1], resume[0])
+            self.resume_program(site, resume[0], resume[1])
+        if self.apply_programs:
+            self.publish_programs(site)
+
+    def _step_down(self, leader: str) -> None:
+        self.logger.warning("HA: node %s holds the lease — %s stepping down", leader, self.node_id)
+        with self._lock:
+            self.is_leader = False
+            self._dirty.clear()
+        for site in self.sites.values():
+            with site.lock:
+                site.standby = True
+                site.detach_program()
+
+    # ----- replication -----
+
+    def _publish_state(self, site) -> None:
+        now = time.time()
+        with site.lock:
+            runs = {str(zid): [run.duration, round(now - run.started_at, 1)]
+                    for zid, run in site.active_runs.items()}
+            cp = site.current_program
+            program = None if cp is None else {
+                "name": cp["name"],
+                "steps": [list(s) for s in cp["steps"]],
+                "current_step": cp["current_step"],
+                "board": cp.get("board"),
+            }
+        self._seq += 1
+        self.mqttc.publish(f"{self.prefix}/state/{site.id}", json.dumps({
+            "node": self.node_id, "seq": self._seq, "ts": now, "active_runs": runs, "current_program": program,
+        }), retain=True)
+
+    def _on_state(self, payload: bytes, site_id: str) -> None:
+        site = self.sites.get(site_id)
+        if site is None or not payload or self.is_leader:
+            return
+        state = json.loads(payload)
+        if state.get("node") == self.node_id:
+            return  # our own retained state from before a restart
+        if self._stale(state):
+            self.logger.info("HA: ignoring stale state of site %s from %s", site_id, state.get("node"))
+            return
+        now = time.time()
+        age = max(0.0, now - state["ts"])
+        self._replica[site_id] = (time.monotonic() - age, state)
+        with site.lock:
+            site.active_runs = {
+                int(zid): ActiveRun(now - age - elapsed, duration)
+                for zid, (duration, elapsed) in state["active_runs"].items()
+            }
+            cp = state.get("current_program")
+            site.current_program = None if cp is None else {
+                "name": cp["name"],
+                "steps": [tuple(s) for s in cp["steps"]],
+                "current_step": cp["current_step"],
+                "total_steps": len(cp["steps"]),
+            }
+            if cp is not None and cp.get("board"):
+                site.current_program["board"] = cp["board"]
+
+    def publish_programs(self, site) -> None:
+        """Called on the leader after a program edit; standbys store the same list."""
+        if not self.is_leader:
+            return
+        self.mqttc.publish(f"{self.prefix}/programs/{site.id}", json.dumps({
+            "node": self.node_id, "programs": list(site.programs.values()),
+        }), retain=True)
+
+    def _on_programs(self, payload: bytes, site_id: str) -> None:
+        site = self.sites.get(site_id)
+        if site is None or not payload or self.is_leader or self.apply_programs is None:
+            return
+        msg = json.loads(payload)
+        if msg.get("node") == self.node_id:
+            return
+        programs = msg["programs"]
+        if programs != list(site.programs.values()):
+            self.logger.info("HA: %d programs replicated from %s", len(programs), msg.get("node"))
+            self.apply_programs(site, programs)
+
+    # ----- status -----
+
+    def status(self) -> dict:
+        now = time.monotonic()
+        return {
+            "node": self.node_id,
+            "role": "leader" if self.is_leader else "standby",
+            "leader": self.leader,
+            "lease_age_seconds": None if self.is_leader else round(max(0.0, now - self._lease_seen), 1),
+            "lease_seconds": self.lease_seconds,
+            "takeovers": self.takeovers,
+            "replica_age_seconds": {sid: round(now - t, 1) for sid, (t, _) in self._replica.items()},
+        }
@@ -1,48 +1,120 @@
 import threading
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
 import app_runtime
+import config
 from classes.Program import Program
 
 
-def start_scheduled_program(program_id: int, rain_skip: bool = False):
+def _site(site_id):
+    site = app_runtime.get_site(site_id)
+    if site is None:
+        app_runtime.logger.error("unknown site %r", site_id)
+    return site
+
+
+def _board_for(site, prog: dict | None) -> str | None:
+    """Relay board that runs `prog` from its script (board_run: true, every step on that board)."""
+    if not prog or not prog.get("board_run"):
+        return None
+    devices = {site.compiled.zones_by_id[zid].device for zid, _ in config.program_steps(prog, site.failsafe_max)}
+    if len(devices) != 1:
+        app_runtime.logger.warning("Program '%s': board_run needs every step on one relay board "
+                                   "— sequencing it from here", prog["name"])
+        return None
+    return devices.pop()
+
+
+def start_scheduled_program(program_id: int, rain_skip: bool = False, site_id: str | None = None):
     """Called by APScheduler for configured programs. Respects rain-skip."""
     logger = app_runtime.logger
-    prog = app_runtime.programs.get(program_id)
+    site = _site(site_id)
+    if site is None:
+        return
+    if site.standby:
+        logger.debug("Standby — program %s is run by the leader", program_id)
+        return
+    prog = site.programs.get(program_id)
     if prog is None:
         logger.error("start_scheduled_program: program %s not found", program_id)
         return
-    if rain_skip and app_runtime.rain_sensor and app_runtime.rain_sensor.get_rain_status():
+    if rain_skip and site.rain_sensor and site.rain_sensor.get_rain_status():
         logger.info("Rain detected — skipping program '%s'", prog["name"])
+        site.rain_sensor.record_skip(prog["name"])
         return
-    steps = [(s["zone_id"], s["minutes"] * 60) for s in prog.get("steps", []) if s["minutes"] > 0]
+    steps = config.program_steps(prog, site.failsafe_max)
+    board = _board_for(site, prog)
+    # a board_run script has its step durations compiled in: no weather scaling
+    if steps and site.weather and prog.get("weather_scaling", True) and board is None:
+        today = datetime.now(ZoneInfo(site.compiled.timezone)).date()
+        steps = site.weather.scale_steps(steps, today, max_seconds=site.failsafe_max)
+        logger.info("Program '%s' ET-scaled steps: %r", prog["name"], steps)
+        steps = [(zid, sec) for zid, sec in steps if sec > 0]
     if not steps:
         logger.warning("Program '%s' has no runnable steps, skipping", prog["name"])
         return
-    start_program_by_id(program_id=program_id, steps=steps, name=prog["name"])
+    step_filter = site.moisture.adjust_step if prog.get("moisture_skip") and site.moisture else None
+    start_program_by_id(program_id=program_id, steps=steps, name=prog["name"], site_id=site_id,
+                        step_filter=step_filter, transition=prog.get("transition"), board=board)
 
 
 def start_program_by_id(program_id: int | str,
                         steps: list[tuple[int, int]] | None = None,
-                        name: str | None = None):
+                        name: str | None = None,
+                        site_id: str | None = None,
+                        step_filter=None,
+                        transition: dict | None = None,
+                        board: str | None = None):
+    """
+    Run a program's steps. With `board` (a board_run program, see _board_for)
+    the board's script runs them as compiled by autoexec.py and this thread
+    only follows it; ad-hoc runs of such a program pass board=None and look
+    it up here.
+    """
     logger = app_runtime.logger
+    site = _site(site_id)
+    if site is None:
+        return
+    if site.standby:
+        logger.warning("Standby — not starting program %s", program_id)
+        return
 
     if steps is None:
         from classes.Program import program_constructor_from_db
         p = program_constructor_from_db(program_id)
     else:
         logger.debug("start_program_by_id: steps=%r", steps)
-        p = Program(program_id, name or f"Program {program_id}", steps, logger=logger)
+        stored = site.programs.get(program_id)
+        if transition is None:  # ad-hoc runs of a stored program keep its hand-over
+            transition = (stored or {}).get("transition")
+        if board is None and stored and steps == config.program_steps(stored, site.failsafe_max):
+            board = _board_for(site, stored)
+        p = Program(program_id, name or f"Program {program_id}", steps, logger=logger, site=site,
+                    step_filter=step_filter,
+                    transition=config.program_transition(transition))
 
     stop_event = threading.Event()
-    app_runtime.set_current_program(
+    site.set_current_program(
         name or f"Program {program_id}",
         p.runtimes or [],
         stop_event,
+        board=board,
     )
 
     def _on_step_start():
-        app_runtime.advance_current_program_step()
+        site.advance_current_program_step()
 
     try:
-        p.run_sequentially(on_step_start=_on_step_start, stop_event=stop_event)
+        if board is not None:
+            site.program_runs.append(p.run_on_board(board, stop_event))
+        else:
+            site.program_runs.append(p.run_sequentially(on_step_start=_on_step_start, stop_event=stop_event))
     finally:
-        app_runtime.clear_current_program()
+        site.finish_program(stop_event)
+
+
+def scheduler_heartbeat():
+    """Interval job: proves the APScheduler executor still picks up jobs (diagnostics.Watchdog)."""
+    app_runtime.heartbeats["scheduler"] = time.monotonic()
@@ -0,0 +1,187 @@
+"""
+log_pipeline.py — asynchronous, rate-limited logging for the Pi's SD card.
+
+Request, scheduler and MQTT threads only put records on a bounded queue
+(QueueHandler); a single background QueueListener formats and writes them.
+A per-message-key rate limiter drops repeats of the same message (same
+logger, level and rendered text — "Turning off zone 3" and "... zone 4" are
+different messages) beyond a burst per window before they are even queued, and reports how many were suppressed on the next one let
+through. Everything down to DEBUG lands in an in-memory ring buffer
+(served at /api/logs); only records at `logging.level` and above reach
+stderr/journald or the optional log file.
+"""
+
+import itertools
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from collections import deque
+
+DEFAULTS = {
+    "level": "INFO",          # what reaches stderr / the log file
+    "file": None,             # optional path, rotated at 1 MB × 3
+    "ring_size": 2000,        # records kept in memory for /api/logs
+    "queue_size": 10000,      # records waiting for the writer thread
+    "rate_limit": {"burst": 5, "per_seconds": 60},
+}
+
+FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+class RateLimitFilter(logging.Filter):
+    """Allow `burst` records per (logger, level, rendered message) every `per_seconds`."""
+
+    def __init__(self, burst: int = 5, per_seconds: float = 60.0):
+        super().__init__()
+        self.burst = burst
+        self.per_seconds = per_seconds
+        self._windows: dict[tuple, list] = {}  # key → [window_start, count, suppressed]
+        self._lock = threading.Lock()
+        self.suppressed_total = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.burst <= 0:
+            return True  # never hide problems
+        try:
+            text = record.getMessage()
+        except Exception:
+            text = record.msg  # the handler reports the bad arguments when it formats the record
+        key = (record.name, record.levelno, text)
+        now = record.created
+        with self._lock:
+            w = self._windows.get(key)
+            if w is None or now - w[0] >= self.per_seconds:
+                suppressed = w[2] if w else 0
+                self._windows[key] = [now, 1, 0]
+                if len(self._windows) > 4096:
+                    self._windows.clear()
+                if suppressed:
+                    record.msg = f"{record.msg} (+{suppressed} similar suppressed)"
+                return True
+            if w[1] < self.burst:
+                w[1] += 1
+                return True
+            w[2] += 1
+            self.suppressed_total += 1
+            return False
+
+
+class RingBufferHandler(logging.Handler):
+    """Keeps the last `capacity` records in memory, each tagged with a sequence number."""
+
+    def __init__(self, capacity: int = 2000):
+        super().__init__(level=logging.DEBUG)
+        self._buf: deque = deque(maxlen=capacity)
+        self._seq = itertools.count(1)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            msg = record.getMessage()
+            if record.exc_text:
+                msg = f"{msg}\n{record.exc_text}"
+            self._buf.append({
+                "seq": next(self._seq),
+                "ts": record.created,
+                "level": record.levelname,
+                "levelno": record.levelno,
+                "logger": record.name,
+                "thread": record.threadName,
+                "message": msg,
+            })
+        except Exception:
+            self.handleError(record)
+
+    def records(self, since: int = 0, min_level: int = logging.DEBUG,
+                logger: str | None = None, limit: int = 200) -> list[dict]:
+        out = [
+            r for r in list(self._buf)
+            if r["seq"] > since and r["levelno"] >= min_level
+            and (logger is None or r["logger"].startswith(logger))
+        ]
+        return out[-limit:]
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks the caller: a full queue drops the record."""
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.enqueued = 0
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting is left to the writer thread, except for mutable args
+        # that could change before it gets there.
+        if record.args and any(isinstance(a, (dict, list, set)) for a in
+                               (record.args.values() if isinstance(record.args, dict) else record.args)):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    def __init__(self, queue_handler, listener, ring, rate_limit, started_at):
+        self.queue_handler = queue_handler
+        self.listener = listener
+        self.ring = ring
+        self.rate_limit = rate_limit
+        self.started_at = started_at
+
+    def stats(self) -> dict:
+        return {
+            "enqueued": self.queue_handler.enqueued,
+            "dropped": self.queue_handler.dropped,
+            "suppressed": self.rate_limit.suppressed_total,
+            "queued": self.queue_handler.queue.qsize(),
+            "uptime_s": round(time.time() - self.started_at, 1),
+        }
+
+    def stop(self) -> None:
+        self.listener.stop()
+
+
+def setup_logging(conf: dict | None = None) -> LogPipeline:
+    """Install the pipeline on the root logger (replacing its handlers)."""
+    conf = {**DEFAULTS, **(conf or {})}
+    rl_conf = {**DEFAULTS["rate_limit"], **(conf.get("rate_limit") or {})}
+
+    formatter = logging.Formatter(FORMAT)
+    sinks = []
+    stream = logging.StreamHandler()
+    stream.setLevel(str(conf["level"]).upper())
+    stream.setFormatter(formatter)
+    sinks.append(stream)
+    if conf.get("file"):
+        fh = logging.handlers.RotatingFileHandler(
+            conf["file"], maxBytes=1_000_000, backupCount=3, encoding="utf-8", delay=True
+        )
+        fh.setLevel(str(conf["level"]).upper())
+        fh.setFormatter(formatter)
+        sinks.append(fh)
+    ring = RingBufferHandler(int(conf["ring_size"]))
+
+    q = queue.Queue(maxsize=int(conf["queue_size"]))
+    qh = _DroppingQueueHandler(q)
+    rate_limit = RateLimitFilter(int(rl_conf["burst"]), float(rl_conf["per_seconds"]))
+    qh.addFilter(rate_limit)
+    listener = logging.handlers.QueueListener(q, ring, *sinks, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(qh)
+    root.setLevel(logging.DEBUG)
+    listener.start()
+    return LogPipeline(qh, listener, ring, rate_limit, time.time())
@@ -1,36 +1,59 @@
 """
 mock_openbk.py — Simulates OpenBK7231N autoexec relay behavior for testing.
 
-Connects to the same Mosquitto broker as the main app. Subscribes to
-sprinkler/+/set, publishes state back on sprinkler/{channel}/get.
+Connects to the same Mosquitto broker as the main app. For every device in
+zones.yaml it subscribes to that device's set wildcard (e.g. sprinkler/+/set)
+and publishes state back on its state topic (e.g. sprinkler/{channel}/get).
 
-Autoexec rules mirrored:
-  - Only one relay ON at a time (turning on a new one turns off any active one)
+Autoexec rules mirrored (per device — each board enforces its own rules):
+  - At most `max_on` relays ON at a time (devices[].max_on, default 1): turning
+    on one more turns off the one that has been on longest
   - 600-second hardware failsafe per relay (auto-OFF if not cancelled)
   - State published on every change
 
+With --autoexec the rules above are not hardcoded: each board runs the
+script generated by autoexec.py (or the file given) through
+autoexec.ScriptInterpreter, and also accepts OpenBK commands on
+cmnd/<device>/<command> (e.g. startScript "autoexec.bat program_1").
+--speed divides every script delay and failsafe interval.
+
+The rain sensor (rainsensor: in zones.yaml) is simulated too: its state is
+published on the sensor channel's state topic, --rain sets the initial
+reading or, with "cycle", alternates wet/dry every --rain-period seconds
+with a short contact bounce before each change (to exercise debouncing).
+Publishing "1"/"0" to the sensor channel's set topic also changes it.
+
+--moisture RATE publishes soil-moisture probe readings (moisture.topic in
+zones.yaml) RATE times per second per zone: a slow random walk that rises
+while the zone's relay is on and dries out otherwise.
+
 Usage:
-  python3 mock_openbk.py [--host HOST] [--port PORT]
+  python3 mock_openbk.py [--host HOST] [--port PORT] [--device NAME ...]
+                         [--autoexec [FILE]] [--speed N]
+                         [--rain {dry,wet,cycle}] [--rain-period SECONDS]
+                         [--moisture RATE]
   Default host/port read from zones.yaml (falls back to localhost:1883)
 """
 
 import argparse
 import logging
-import re
 import threading
 import time
 
 import paho.mqtt.client as mqtt
 
+from topic_router import TopicTrie
+
 # ---------------------------------------------------------------------------
 # Config (set dynamically in main() from zones.yaml)
 # ---------------------------------------------------------------------------
-CHANNELS: list[int] = []
+ADDRESSES: list[tuple[str, int]] = []   # (device, channel) of every simulated relay
 FAILSAFE_SECONDS: int = 600
-SET_TOPIC: str = ""
-GET_TOPIC: str = ""
-SUBSCRIBE_WILDCARD: str = ""
-_PREFIX: str = ""
+DEVICES: dict = {}                      # name → config.DeviceSpec
+_ROUTER = TopicTrie()                   # set topic → handler(payload, *levels)
+_SCRIPTS: dict = {}                     # device → autoexec.ScriptInterpreter (--autoexec)
+RAIN_ADDRESS: tuple[str, int] | None = None  # (device, channel) of the simulated rain sensor
+_rain = 0
 
 logging.basicConfig(
     level=logging.INFO,
@@ -42,132 +65,262 @@ log = logging.getLogger("mock_openbk")
 # ---------------------------------------------------------------------------
 # State
 # ---------------------------------------------------------------------------
-_state: dict[int, int] = {}   # channel → 0/1  (populated after config load)
-_timers: dict[int, threading.Timer] = {}               # channel → failsafe Timer
+_state: dict[tuple[str, int], int] = {}              # (device, channel) → 0/1
+_timers: dict[tuple[str, int], threading.Timer] = {}  # (device, channel) → failsafe Timer
+_on_since: dict[tuple[str, int], float] = {}          # (device, channel) → monotonic time switched on
 _lock = threading.Lock()
 _client: mqtt.Client | None = None
 
 
-def _publish_state(channel: int, value: int):
-    topic = GET_TOPIC.format(channel=channel)
-    _client.publish(topic, str(value), qos=1, retain=True)
+def _name(addr: tuple[str, int]) -> str:
+    return f"{addr[0]}/{addr[1]}"
 
 
-def _cancel_timer(channel: int):
-    t = _timers.pop(channel, None)
+def _publish_state(addr: tuple[str, int], value: int):
+    device, channel = addr
+    _client.publish(DEVICES[device].state_topic(channel), str(value), qos=1, retain=True)
+
+
+def _cancel_timer(addr: tuple[str, int]):
+    t = _timers.pop(addr, None)
     if t:
         t.cancel()
 
 
-def _failsafe_off(channel: int):
+def _failsafe_off(addr: tuple[str, int]):
     with _lock:
-        if _state.get(channel) == 1:
-            _state[channel] = 0
-            _timers.pop(channel, None)
-            _publish_state(channel, 0)
-            log.info("[MOCK] channel %d OFF (failsafe triggered)", channel)
-
-
-def _turn_on(channel: int):
-    """Turn on channel; turn off any currently active channel first."""
-    # Turn off any other active channel
-    for ch, val in list(_state.items()):
-        if ch != channel and val == 1:
-            _state[ch] = 0
-            _cancel_timer(ch)
-            _publish_state(ch, 0)
-            log.info("[MOCK] channel %d OFF — turned off before channel %d", ch, channel)
-
-    if _state[channel] == 1:
-        log.info("[MOCK] channel %d already ON, refreshing failsafe", channel)
-        _cancel_timer(channel)
+        if _state.get(addr) == 1:
+            _state[addr] = 0
+            _on_since.pop(addr, None)
+            _timers.pop(addr, None)
+            _publish_state(addr, 0)
+            log.info("[MOCK] channel %s OFF (failsafe triggered)", _name(addr))
+
+
+def _turn_on(addr: tuple[str, int]):
+    """Turn on channel; past the device's max_on, turn off its longest-running channel first."""
+    active = sorted((since, other) for other, since in _on_since.items()
+                    if other != addr and other[0] == addr[0] and _state.get(other) == 1)
+    limit = DEVICES[addr[0]].max_on
+    for _, other in active[:max(0, len(active) - limit + 1)]:
+        _state[other] = 0
+        _on_since.pop(other, None)
+        _cancel_timer(other)
+        _publish_state(other, 0)
+        log.info("[MOCK] channel %s OFF — turned off before channel %s", _name(other), _name(addr))
+
+    if _state[addr] == 1:
+        log.info("[MOCK] channel %s already ON, refreshing failsafe", _name(addr))
+        _cancel_timer(addr)
     else:
-        _state[channel] = 1
-        _publish_state(channel, 1)
-        log.info("[MOCK] channel %d ON (failsafe: %ds)", channel, FAILSAFE_SECONDS)
+        _state[addr] = 1
+        _on_since[addr] = time.monotonic()
+        _publish_state(addr, 1)
+        log.info("[MOCK] channel %s ON (failsafe: %ds)", _name(addr), FAILSAFE_SECONDS)
 
     # Start (or restart) failsafe timer
-    t = threading.Timer(FAILSAFE_SECONDS, _failsafe_off, args=(channel,))
+    t = threading.Timer(FAILSAFE_SECONDS, _failsafe_off, args=(addr,))
     t.daemon = True
     t.start()
-    _timers[channel] = t
+    _timers[addr] = t
+
+
+def _turn_off(addr: tuple[str, int]):
+    if _state[addr] == 0:
+        log.info("[MOCK] channel %s already OFF", _name(addr))
+        return
+    _state[addr] = 0
+    _on_since.pop(addr, None)
+    _cancel_timer(addr)
+    _publish_state(addr, 0)
+    log.info("[MOCK] channel %s OFF", _name(addr))
+
+
+def _on_set(addr: tuple[str, int], payload: bytes):
+    payload = payload.decode("utf-8").strip()
+    value = 1 if payload in ("1", "ON", "on", "true", "True") else 0
+    script = _SCRIPTS.get(addr[0])
+    if script is not None:
+        script.set_channel(addr[1], value)
+        return
+    with _lock:
+        if value == 1:
+            _turn_on(addr)
+        else:
+            _turn_off(addr)
 
 
-def _turn_off(channel: int):
-    if _state[channel] == 0:
-        log.info("[MOCK] channel %d already OFF", channel)
+def _on_script_change(device: str, channel: int, value: int):
+    addr = (device, channel)
+    if addr not in _state:
         return
-    _state[channel] = 0
-    _cancel_timer(channel)
-    _publish_state(channel, 0)
-    log.info("[MOCK] channel %d OFF", channel)
+    _state[addr] = value
+    _publish_state(addr, value)
+    log.info("[MOCK] channel %s %s (script)", _name(addr), "ON" if value else "OFF")
+
+
+def _on_command(device: str, payload: bytes, command: str):
+    cmd = f"{command} {payload.decode('utf-8').strip()}".strip()
+    log.info("[MOCK] %s: %s", device, cmd)
+    try:
+        _SCRIPTS[device].execute(cmd)
+    except (ValueError, KeyError) as e:
+        log.warning("[MOCK] %s: cannot run %r (%s)", device, cmd, e)
+
+
+def _load_scripts(path: str | None, compiled, programs, speed: float):
+    import autoexec
+    for name in DEVICES:
+        if path:
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+        else:
+            text = autoexec.compile_autoexec(compiled, programs, device=name)
+        script = autoexec.ScriptInterpreter(
+            text,
+            on_change=lambda ch, val, _d=name: _on_script_change(_d, ch, val),
+            speed=speed,
+            log=log,
+        )
+        script.run()  # boot: register handlers, then `goto end`
+        _SCRIPTS[name] = script
+        _ROUTER.add(f"cmnd/{name}/+", lambda payload, cmd, _d=name: _on_command(_d, payload, cmd))
+        log.info("[MOCK] %s runs autoexec (%d lines, labels: %s)",
+                 name, len(script.lines), ", ".join(script.labels))
+
+
+def _set_rain(value: int, note: str = ""):
+    global _rain
+    _rain = value
+    device, channel = RAIN_ADDRESS
+    _client.publish(DEVICES[device].state_topic(channel), str(value), qos=1, retain=True)
+    log.info("[MOCK] rain sensor %s %s", "WET" if value else "DRY", note)
+
+
+def _rain_cycle(period: float):
+    """Alternate wet/dry every `period` seconds, bouncing a few times before each change."""
+    while True:
+        time.sleep(period)
+        target = 1 - _rain
+        for _ in range(3):
+            _set_rain(target, "(bounce)")
+            time.sleep(0.5)
+            _set_rain(1 - target, "(bounce)")
+            time.sleep(0.5)
+        _set_rain(target)
+
+
+def _moisture_loop(topic_tmpl: str, zones: dict, rate: float):
+    """zones: zone id → (device, channel). Publishes every zone `rate` times per second."""
+    import random
+    level = {zid: random.uniform(20.0, 40.0) for zid in zones}
+    interval = 1.0 / rate
+    while True:
+        started = time.time()
+        for zid, addr in zones.items():
+            wet = _state.get(addr) == 1
+            level[zid] = min(100.0, max(0.0, level[zid] + (0.5 if wet else -0.01) * interval
+                                        + random.gauss(0, 0.2)))
+            _client.publish(topic_tmpl.replace("{zone}", str(zid)), f"{level[zid]:.1f}", qos=0)
+        time.sleep(max(0.0, interval - (time.time() - started)))
+
+
+def _on_set_unknown(device: str, payload: bytes, channel: str):
+    log.warning("[MOCK] received command for unknown channel %s/%s, ignoring", device, channel)
 
 
 # ---------------------------------------------------------------------------
 # MQTT callbacks
 # ---------------------------------------------------------------------------
 def _on_connect(client, userdata, flags, reason_code, properties=None):
-    client.subscribe(SUBSCRIBE_WILDCARD, qos=1)
-    log.info("[MOCK] connected to broker, subscribed to %s", SUBSCRIBE_WILDCARD)
+    for dev in DEVICES.values():
+        client.subscribe(dev.set_sub, qos=1)
+        log.info("[MOCK] connected to broker, subscribed to %s", dev.set_sub)
+    for name in _SCRIPTS:
+        client.subscribe(f"cmnd/{name}/+", qos=1)
     # Publish current state for all channels
-    for ch in CHANNELS:
-        _publish_state(ch, _state[ch])
+    for addr in ADDRESSES:
+        _publish_state(addr, _state[addr])
+    if RAIN_ADDRESS:
+        _set_rain(_rain)
 
 
 def _on_message(client, userdata, msg):
-    m = re.match(rf"^{re.escape(_PREFIX)}/(\d+)/set$", msg.topic)
-    if not m:
-        return
-    channel = int(m.group(1))
-    if channel not in CHANNELS:
-        log.warning("[MOCK] received command for unknown channel %d, ignoring", channel)
-        return
-    payload = msg.payload.decode("utf-8").strip()
-    value = 1 if payload in ("1", "ON", "on", "true", "True") else 0
-    with _lock:
-        if value == 1:
-            _turn_on(channel)
-        else:
-            _turn_off(channel)
+    hit = _ROUTER.match(msg.topic)
+    if hit:
+        handler, levels = hit
+        handler(msg.payload, *levels)
 
 
 # ---------------------------------------------------------------------------
 # Entry point
 # ---------------------------------------------------------------------------
 def main():
-    global _client, CHANNELS, FAILSAFE_SECONDS, SET_TOPIC, GET_TOPIC, SUBSCRIBE_WILDCARD, _PREFIX, _state
+    global _client, ADDRESSES, FAILSAFE_SECONDS, DEVICES, _state, RAIN_ADDRESS, _rain
 
     parser = argparse.ArgumentParser(description="Mock OpenBK7231N relay simulator")
     parser.add_argument("--host", default=None)
     parser.add_argument("--port", type=int, default=None)
     parser.add_argument("--username", default=None)
     parser.add_argument("--password", default=None)
+    parser.add_argument("--device", action="append", default=None,
+                        help="simulate only this device (repeatable; default: all)")
+    parser.add_argument("--autoexec", nargs="?", const="", default=None, metavar="FILE",
+                        help="run an autoexec script (default: generate it from zones.yaml)")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="script time acceleration factor (with --autoexec)")
+    parser.add_argument("--rain", choices=("dry", "wet", "cycle"), default="dry",
+                        help="simulated rain sensor (default: dry)")
+    parser.add_argument("--rain-period", type=float, default=300.0,
+                        help="seconds between wet/dry changes with --rain cycle")
+    parser.add_argument("--moisture", type=float, default=0.0, metavar="RATE",
+                        help="publish soil-moisture readings RATE times/s per zone (default: off)")
     args = parser.parse_args()
 
     # Try to read broker config from zones.yaml
+    import config
     host, port, username, password = "localhost", 1883, None, None
+    conf, compiled = {}, None
     try:
-        import yaml, os
-        conf_path = os.environ.get("ZONES_CONF", "zones.yaml")
-        with open(conf_path, "r", encoding="utf-8") as f:
-            conf = yaml.safe_load(f)
+        import os
+        conf, compiled = config.load_conf(os.environ.get("ZONES_CONF", "zones.yaml"))
         host = conf["mqtt"]["host"]
         port = int(conf["mqtt"]["port"])
         username = conf["mqtt"].get("username") or None
         password = conf["mqtt"].get("password") or None
-        _PREFIX = conf["mqtt"].get("mqtt_topic_prefix", "sprinkler")
-        CHANNELS = [z["channel"] for z in conf.get("zones", [])]
-        FAILSAFE_SECONDS = int(conf.get("failsafe", {}).get("max_seconds", 600))
+        DEVICES = dict(compiled.devices_by_name)
+        ADDRESSES = list(compiled.zone_by_address)
+        FAILSAFE_SECONDS = compiled.failsafe_max
+        RAIN_ADDRESS = compiled.rain_address
     except Exception as e:
         log.warning("Could not read zones.yaml (%s), using defaults", e)
-        _PREFIX = "sprinkler"
-        CHANNELS = [31, 32, 33]
-
-    SET_TOPIC = f"{_PREFIX}/{{channel}}/set"
-    GET_TOPIC = f"{_PREFIX}/{{channel}}/get"
-    SUBSCRIBE_WILDCARD = f"{_PREFIX}/+/set"
-    _state = {ch: 0 for ch in CHANNELS}
-    log.info("[MOCK] prefix=%s channels=%s failsafe=%ds", _PREFIX, CHANNELS, FAILSAFE_SECONDS)
+        dev = config.DeviceSpec("default", "sprinkler/{channel}/set", "sprinkler/{channel}/get",
+                                "sprinkler/+/set", "sprinkler/+/get")
+        DEVICES = {dev.name: dev}
+        ADDRESSES = [(dev.name, ch) for ch in (31, 32, 33)]
+
+    if args.device:
+        DEVICES = {name: d for name, d in DEVICES.items() if name in args.device}
+        ADDRESSES = [a for a in ADDRESSES if a[0] in DEVICES]
+    for dev in DEVICES.values():
+        _ROUTER.add(dev.set_sub, lambda payload, ch, _d=dev.name: _on_set_unknown(_d, payload, ch))
+    for addr in ADDRESSES:
+        _ROUTER.add(DEVICES[addr[0]].set_topic(addr[1]), lambda payload, _a=addr: _on_set(_a, payload))
+    if RAIN_ADDRESS and RAIN_ADDRESS[0] in DEVICES:
+        rain_dev = DEVICES[RAIN_ADDRESS[0]]
+        _ROUTER.add(rain_dev.set_topic(RAIN_ADDRESS[1]),
+                    lambda payload: _set_rain(1 if payload.strip() in (b"1", b"ON", b"on") else 0,
+                                              "(set over MQTT)"))
+        _rain = 1 if args.rain == "wet" else 0
+    else:
+        RAIN_ADDRESS = None
+    _state = {addr: 0 for addr in ADDRESSES}
+    if args.autoexec is not None:
+        if compiled is None and not args.autoexec:
+            parser.error("--autoexec without FILE needs a readable zones.yaml")
+        _load_scripts(args.autoexec or None, compiled, conf.get("programs", []), args.speed)
+    log.info("[MOCK] devices=%s channels=%s failsafe=%ds",
+             list(DEVICES), [_name(a) for a in ADDRESSES], FAILSAFE_SECONDS)
 
     # CLI args override yaml
     if args.host:
@@ -190,6 +343,13 @@ def main():
 
     log.info("[MOCK] connecting to %s:%d ...", host, port)
     _client.connect(host, port, keepalive=30)
+    if RAIN_ADDRESS and args.rain == "cycle":
+        threading.Thread(target=_rain_cycle, args=(args.rain_period,), daemon=True).start()
+    if args.moisture > 0 and compiled is not None:
+        topic = (conf.get("moisture") or {}).get("topic", "soil/{zone}/moisture")
+        zones = {z.id: (z.device, z.channel) for z in compiled.zones if z.device in DEVICES}
+        threading.Thread(target=_moisture_loop, args=(topic, zones, args.moisture), daemon=True).start()
+        log.info("[MOCK] soil moisture: %s, %.1f/s per zone", topic, args.moisture)
 
     try:
         _client.loop_forever()
@@ -1,13 +1,19 @@
-import json, threading, time, re
-import paho.mqtt.client as mqtt
-import logging  
+import json, os, threading, time, re
+import logging
+from functools import partial
+
+from topic_router import TopicTrie
 
 
 class OBKMqtt:
     """
-    Sprinkler channel-topicos séma:
+    Sprinkler channel-topicos séma, eszközönként (config.DeviceSpec):
       publish:  sprinkler/{channel}/set   payload: "1" vagy "0"
       state:    sprinkler/{channel}/get   payload: "1" vagy "0" (feliratkozás: sprinkler/+/get)
+
+    Több relé-panel is lehet, mindegyik saját prefixszel / topic sémával.
+    Bejövő üzenetek egy topic-trie-n keresztül jutnak a (device, channel)
+    kezelőhöz, így a routing költsége nem függ az eszközök számától.
     """
 
     def __init__(
@@ -17,8 +23,6 @@ class OBKMqtt:
         username,
         password,
         qos,
-        set_tmpl,
-        state_sub,
         on_state_cb=None,
         dry_run=False,
         logger=None,
@@ -26,34 +30,91 @@ class OBKMqtt:
         self.host, self.port = host, port
         self.username, self.password = username, password
         self.qos = qos
-        self.set_tmpl = set_tmpl  # pl.: sprinkler/{channel}/set
-        self.get_tmpl = set_tmpl.replace("/set", "/get")  # pl.: sprinkler/{channel}/get
-        self.state_sub = state_sub  # pl.: sprinkler/+/get
-        self.on_state_cb = on_state_cb  # callback(channel:int, value:int)
+        self.on_state_cb = on_state_cb  # default callback(device:str, channel:int, value:int)
         self.dry_run = dry_run
 
         self.logger = logger or logging.getLogger(__name__)
 
-        self.client = mqtt.Client(
-            mqtt.CallbackAPIVersion.VERSION2,
-            client_id=f"sprinkler-backend-{int(time.time())}",
-        )
-        if username:
-            self.client.username_pw_set(username, password)
+        self.client = None
+        if not dry_run:
+            # paho is only imported when a broker connection is actually wanted
+            import paho.mqtt.client as mqtt
+            self.client = mqtt.Client(
+                mqtt.CallbackAPIVersion.VERSION2,
+                client_id=f"sprinkler-backend-{int(time.time())}-{os.getpid()}",
+            )
+            if username:
+                self.client.username_pw_set(username, password)
 
         self._thread = None
-        # Build topic regex from state_sub: "prefix/+/get" → "^prefix/(\d+)/get$"
-        _prefix = state_sub.rsplit("/+/", 1)[0]
-        self._topic_re = re.compile(rf"^{re.escape(_prefix)}/(\d+)/get$")
+        self._connected = False
+        self.router = TopicTrie()
+        self._subscriptions: dict[str, int] = {}  # topic filter → qos
+        self.devices = {}  # key → config.DeviceSpec
+        self.default_device = None
+        self.set_topics: dict[tuple[str, int], str] = {}  # (key, channel) → precompiled set topic
+        self.recorder = None  # mqtt_recorder.MqttRecorder when `mqtt.record` is set
+
+    # ----- routing -----
+
+    def add_device(self, dev, channels=(), on_state_cb=None, key=None):
+        """
+        Route the device's state topics to on_state_cb(dev.name, channel, value).
+        Known channels get an exact trie entry; the "+" wildcard catches any
+        other channel. `key` (default dev.name) is the name used in
+        set_channel() — sites sharing one client register under distinct keys.
+        """
+        key = key or dev.name
+        if key in self.devices or dev.state_sub in self._subscriptions:
+            raise ValueError(f"device {key!r} ({dev.state_sub}) already registered on this broker")
+        cb = on_state_cb or self.on_state_cb
+        self.devices[key] = dev
+        if self.default_device is None:
+            self.default_device = key
+        for ch in channels:
+            self.set_topics[(key, ch)] = dev.set_topic(ch)
+            self.router.add(dev.state_topic(ch), partial(self._on_relay_state, cb, dev.name, ch))
+        self.router.add(dev.state_sub, partial(self._on_relay_state_any, cb, dev))
+        self._subscribe(dev.state_sub)
+
+    def subscribe(self, topic_filter: str, handler):
+        """Route `topic_filter` to handler(payload: bytes, *wildcard_levels)."""
+        self.router.add(topic_filter, handler)
+        self._subscribe(topic_filter)
+
+    def route(self, topic: str, handler):
+        """Like subscribe(), for a topic an existing subscription (e.g. a board's state wildcard) already covers."""
+        self.router.add(topic, handler)
+
+    def _subscribe(self, topic_filter: str):
+        self._subscriptions[topic_filter] = self.qos
+        if self.dry_run:
+            self.logger.info("[DRY RUN] would subscribe to %s", topic_filter)
+        elif self._connected:
+            self.client.subscribe(topic_filter, qos=self.qos)
+
+    @staticmethod
+    def _on_relay_state(cb, device: str, channel: int, payload: bytes):
+        payload = payload.decode("utf-8").strip()
+        val = 1 if payload in ("1", "ON", "on", "true", "True") else 0
+        if cb:
+            cb(device, channel, val)
+
+    def _on_relay_state_any(self, cb, dev, payload: bytes, channel_level: str):
+        ch = dev.channel_from_level(channel_level)
+        if ch is not None:
+            self._on_relay_state(cb, dev.name, ch, payload)
+
+    # ----- connection -----
 
     def start(self):
         if self.dry_run:
             self.logger.info("[DRY RUN] MQTT client not started — no broker connection will be made")
-            self.logger.info("[DRY RUN] would subscribe to %s", self.state_sub)
             return
         self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
         self.client.on_message = self._on_message
-        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread = threading.Thread(target=self._loop, name=f"mqtt:{self.host}", daemon=True)
         self._thread.start()
 
     def _loop(self):
@@ -67,31 +128,66 @@ class OBKMqtt:
                 time.sleep(10)
 
     def _on_connect(self, client, userdata, flags, reason_code, properties=None):
-        client.subscribe(self.state_sub, qos=self.qos)
+        self._connected = True
+        if self._subscriptions:
+            client.subscribe(list(self._subscriptions.items()))
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties=None):
+        self._connected = False
 
     def _on_message(self, client, userdata, msg):
-        # topic: sprinkler/<channel>/get
-        # payload: "0" vagy "1"
+        if self.recorder is not None:
+            self.recorder.record_in(msg.topic, msg.payload, msg.retain)
         try:
-            payload = msg.payload.decode("utf-8").strip()
-            val = 1 if payload in ("1", "ON", "on", "true", "True") else 0
-            m = self._topic_re.match(msg.topic)
-            if m:
-                ch = int(m.group(1))
-                if self.on_state_cb:
-                    self.on_state_cb(ch, val)
+            hit = self.router.match(msg.topic)
+            if hit:
+                handler, levels = hit
+                handler(msg.payload, *levels)
         except Exception as e:
             self.logger.warning(f"state parse error: {e}")
 
-    def set_channel(self, channel: int, value: int):
-        topic = self.set_tmpl.format(channel=channel)
-        payload = "1" if int(value) == 1 else "0"
+    # ----- publishing -----
+
+    def publish(self, topic: str, payload: str, retain: bool = False):
+        if self.recorder is not None:
+            self.recorder.record_out(topic, payload, retain)
         if self.dry_run:
             self.logger.info("[DRY RUN] would publish: %s = %s", topic, payload)
             return
-        self.client.publish(topic, payload, qos=self.qos, retain=False)
+        self.client.publish(topic, payload, qos=self.qos, retain=retain)
+
+    def set_channel(self, channel: int, value: int, device: str | None = None):
+        device = device or self.default_device
+        topic = self.set_topics.get((device, channel)) or self.devices[device].set_topic(channel)
+        payload = "1" if int(value) == 1 else "0"
+        self.publish(topic, payload)
+
+    def set_channels(self, commands):
+        """Publish several (channel, value, device) commands as one batch."""
+        messages = []
+        for channel, value, device in commands:
+            device = device or self.default_device
+            topic = self.set_topics.get((device, channel)) or self.devices[device].set_topic(channel)
+            messages.append((topic, "1" if int(value) == 1 else "0"))
+        self.publish_many(messages)
 
-    def get_channel(self, channel: int):
+    def publish_many(self, messages):
+        """Publish [(topic, payload)] back to back (one lookup of the client, one log line in dry run)."""
+        if not messages:
+            return
+        if self.recorder is not None:
+            for topic, payload in messages:
+                self.recorder.record_out(topic, payload)
         if self.dry_run:
-            self.logger.info("[DRY RUN] would request: %s", self.get_tmpl.format(channel=channel))
-            return
\ No newline at end of file
+            self.logger.info("[DRY RUN] would publish %d messages: %s", len(messages),
+                             ", ".join(f"{t}={p}" for t, p in messages))
+            return
+        publish, qos = self.client.publish, self.qos
+        for topic, payload in messages:
+            publish(topic, payload, qos=qos)
+
+    def get_channel(self, channel: int, device: str | None = None):
+        device = device or self.default_device
+        if self.dry_run:
+            self.logger.info("[DRY RUN] would request: %s", self.devices[device].state_topic(channel))
+            return
@@ -0,0 +1,151 @@
+"""
+mqtt_recorder.py — compact binary log of the MQTT traffic OBKMqtt sees.
+
+Enabled with `mqtt.record: <path>` in zones.yaml. Every inbound message
+(OBKMqtt._on_message) and every outbound publish is appended with a
+monotonic timestamp; replay.py feeds a recording back into the runtime.
+
+File layout (little endian):
+
+  magic  b"SPRREC1\\n"
+  header "<dd"     wall-clock start, monotonic start
+  records, each "<BIHH" + body:
+    kind     0 = inbound message, 1 = outbound message, 2 = topic definition,
+             3 = time gap (long idle stretch, no body);  +0x80 = retained
+    dt_us    microseconds since the previous record
+    topic    topic id (defined once per file by a kind-2 record, body = name)
+    length   body length in bytes (payloads are cut at 65535)
+
+A relay state message costs 9 bytes plus its payload. Writes go to a 64 KB
+buffer that is flushed every `flush_seconds`, so the MQTT thread never waits
+for the SD card. When the file passes `max_bytes`, and at startup, the
+current file is renamed to <path>.1 (replacing the previous one) and a new
+file is started — the recording from before a crash survives the restart.
+"""
+
+import os
+import struct
+import threading
+import time
+
+MAGIC = b"SPRREC1\n"
+HEADER = struct.Struct("<dd")
+RECORD = struct.Struct("<BIHH")
+
+IN, OUT, TOPIC, GAP = 0, 1, 2, 3
+RETAINED = 0x80
+_MAX_DT = 0xFFFFFFFF
+_MAX_LEN = 0xFFFF
+
+
+class MqttRecorder:
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024, flush_seconds: float = 5.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.flush_seconds = flush_seconds
+        self.records = 0
+        self._lock = threading.Lock()
+        self._file = None
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            os.replace(path, f"{path}.1")  # keep the recording from before a restart
+        self._open()
+
+    def _open(self) -> None:
+        self._file = open(self.path, "wb", buffering=64 * 1024)
+        self._topics: dict[str, int] = {}
+        self._last = time.monotonic()
+        self._last_flush = self._last
+        self._size = len(MAGIC) + HEADER.size
+        self._file.write(MAGIC)
+        self._file.write(HEADER.pack(time.time(), self._last))
+
+    def record_in(self, topic: str, payload: bytes, retain: bool = False) -> None:
+        self._record(IN | (RETAINED if retain else 0), topic, payload)
+
+    def record_out(self, topic: str, payload, retain: bool = False) -> None:
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        self._record(OUT | (RETAINED if retain else 0), topic, payload or b"")
+
+    def _record(self, kind: int, topic: str, payload: bytes) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if self._file is None:
+                return
+            f = self._file
+            tid = self._topics.get(topic)
+            if tid is None:
+                tid = self._topics[topic] = len(self._topics)
+                name = topic.encode("utf-8")
+                f.write(RECORD.pack(TOPIC, 0, tid, len(name)))
+                f.write(name)
+                self._size += RECORD.size + len(name)
+            dt = int((now - self._last) * 1_000_000)
+            while dt > _MAX_DT:
+                f.write(RECORD.pack(GAP, _MAX_DT, 0, 0))
+                self._size += RECORD.size
+                dt -= _MAX_DT
+            self._last = now
+            body = payload[:_MAX_LEN]
+            f.write(RECORD.pack(kind, dt, tid, len(body)))
+            f.write(body)
+            self._size += RECORD.size + len(body)
+            self.records += 1
+            if now - self._last_flush >= self.flush_seconds:
+                f.flush()
+                self._last_flush = now
+            if self._size >= self.max_bytes:
+                self._rotate()
+
+    def _rotate(self) -> None:
+        self._file.close()
+        os.replace(self.path, f"{self.path}.1")
+        self._open()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self) -> dict:
+        return {"path": self.path, "records": self.records, "bytes": self._size,
+                "topics": len(self._topics)}
+
+
+def read_recording(path: str):
+    """
+    Yield (t, direction, topic, payload, retained) for every message in a
+    recording; t is seconds since the recording started, direction "in"/"out".
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path}: not a sprinkler MQTT recording")
+    pos = len(MAGIC) + HEADER.size
+    topics: dict[int, str] = {}
+    t_us = 0
+    unpack, size = RECORD.unpack_from, RECORD.size
+    end = len(data)
+    while pos + size <= end:
+        kind, dt, tid, length = unpack(data, pos)
+        pos += size
+        if pos + length > end:
+            break  # last record cut short by a crash
+        body = data[pos:pos + length]
+        pos += length
+        t_us += dt
+        base = kind & ~RETAINED
+        if base == TOPIC:
+            topics[tid] = body.decode("utf-8")
+        elif base in (IN, OUT):
+            yield t_us / 1_000_000, "in" if base == IN else "out", topics[tid], body, bool(kind & RETAINED)
+
+
+def recording_start(path: str) -> float:
+    """Wall-clock time the recording was started."""
+    with open(path, "rb") as f:
+        head = f.read(len(MAGIC) + HEADER.size)
+    if not head.startswith(MAGIC):
+        raise ValueError(f"{path}: not a sprinkler MQTT recording")
+    return HEADER.unpack_from(head, len(MAGIC))[0]
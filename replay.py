@@ -0,0 +1,200 @@
+"""
+replay.py — feed an MQTT recording (mqtt_recorder.py) back into the runtime.
+
+The sites from zones.yaml are built through app_runtime in dry run (no
+broker, publishes are only logged and counted, no recording and no water
+log — the ledger keeps the replayed runs in memory only), then every
+inbound message of the recording is handed to OBKMqtt._on_message — the
+same path paho uses — at the recorded pace divided by --speed (0 = as fast
+as possible). Unlike the daemon, the sites queue every relay report instead
+of coalescing them per channel, so intermediate ON/OFF flaps reach Site even
+at full speed; --coalesce restores the daemon's queue.
+Sites on another broker have their own client; each message goes to every
+client whose router has a handler for its topic.
+After the last message the event bus is drained and the final zone states
+are printed and checked against --expect.
+
+Run timing (failsafe, remaining seconds) follows the wall clock, so at high
+speeds only event-driven state — relay feedback, program aborts, rain and
+moisture readings — is reproduced faithfully.
+
+Usage:
+  python3 replay.py garden.rec [--speed 100] [--coalesce] [--expect 1=0 --expect 3=1]
+  python3 replay.py garden.rec --dump          # print the recording as text
+  (ZONES_CONF selects the config, as for app.py. Exit status 1 when an
+   --expect does not hold — usable as a regression check.)
+"""
+
+import argparse
+import dataclasses
+import logging
+import os
+import sys
+import time
+import types
+
+import mqtt_recorder
+
+
+class _Counter:
+    """Stands in for a recorder on the replay client: counts what the runtime publishes."""
+
+    def __init__(self):
+        self.published = 0
+
+    def record_in(self, topic, payload, retain=False):
+        pass
+
+    def record_out(self, topic, payload, retain=False):
+        self.published += 1
+
+
+def dump(path: str) -> None:
+    for t, direction, topic, payload, retained in mqtt_recorder.read_recording(path):
+        flag = " (retained)" if retained else ""
+        print(f"{t:12.6f} {direction:3s} {topic} {payload!r}{flag}")
+
+
+def replay(path: str, speed: float, conf_path: str, logger: logging.Logger,
+           coalesce: bool = False) -> dict:
+    """
+    Replay `path` into freshly built dry-run sites; returns counters and final
+    zone states. Every relay report reaches the runtime unless `coalesce`
+    (the live daemon's latest-per-channel queue) is set.
+    """
+    import app_runtime
+    import config
+
+    def load(path):
+        conf, compiled = config.load_conf(path)
+        # Never record the replay over the live recording, nor book its runs in the water log
+        conf = {**conf, "mqtt": {k: v for k, v in conf["mqtt"].items() if k != "record"},
+                "water": {**(conf.get("water") or {}), "log": None}}
+        return conf, dataclasses.replace(compiled, dry_run=True)
+
+    messages = [(t, topic, payload, retained)
+                for t, direction, topic, payload, retained in mqtt_recorder.read_recording(path)
+                if direction == "in"]
+    recorded_out = sum(1 for _, d, *_ in mqtt_recorder.read_recording(path) if d == "out")
+    # Room for every message: nothing is coalesced or dropped on the way to Site
+    relay_queue = ("coalesce", 256) if coalesce else ("drop_new", max(1, len(messages)))
+
+    conf, compiled = load(conf_path)
+    app_runtime.init_runtime(conf, compiled, name=conf.get("site_name"), conf_path=conf_path,
+                             relay_queue=relay_queue)
+    for s in conf.get("sites", []):
+        sconf, scompiled = load(s["conf"])
+        app_runtime.init_runtime(sconf, scompiled, site_id=s["id"], name=s.get("name"), conf_path=s["conf"],
+                                 relay_queue=relay_queue)
+    clients = list(dict.fromkeys(site.mqttc for site in app_runtime.SITES.values()))
+    counter = _Counter()
+    for mqttc in clients:
+        mqttc.recorder = counter
+
+    logger.info("replaying %d inbound messages (%.0f s recorded) at %s", len(messages),
+                messages[-1][0] if messages else 0, f"{speed:g}x" if speed else "full speed")
+
+    single = clients[0]._on_message if len(clients) == 1 else None
+    unrouted = 0  # counted only with several clients (one client routes everything itself)
+    t0 = time.monotonic()
+    for t, topic, payload, retained in messages:
+        if speed:
+            delay = t0 + t / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        msg = types.SimpleNamespace(topic=topic, payload=payload, retain=retained)
+        if single is not None:
+            single(None, None, msg)
+            continue
+        targets = [c for c in clients if c.router.match(topic)]
+        for mqttc in targets:
+            mqttc._on_message(None, None, msg)
+        if not targets:
+            unrouted += 1
+    ingest = time.monotonic() - t0
+    bus = app_runtime.bus
+    bus.drain()
+    applied = time.monotonic() - t0
+    stats = bus.stats()
+    runtime = [sub for name, sub in stats["subscribers"].items() if name.startswith("runtime:")]
+    delivered = sum(sub["delivered"] for sub in runtime)
+
+    return {
+        "messages": len(messages),
+        "ingest_seconds": round(ingest, 3),
+        "applied_seconds": round(applied, 3),
+        "relay_events": {key: sum(sub[key] for sub in runtime) for key in ("delivered", "coalesced", "dropped")},
+        "events_per_second": round(delivered / applied) if applied else None,
+        "clients": len(clients),
+        "unrouted": unrouted if single is None else None,
+        "recorded_published": recorded_out,
+        "replay_published": counter.published,
+        "zones": {
+            site_id: {sp.id: sp.state for sp in site.sprinkler_by_id.values()}
+            for site_id, site in app_runtime.SITES.items()
+        },
+        "bus": stats,
+    }
+
+
+def _parse_expect(items: list[str]) -> dict[tuple[str, int], int]:
+    """["1=0", "back:3=1"] → {("default", 1): 0, ("back", 3): 1}"""
+    out = {}
+    for item in items:
+        where, _, value = item.partition("=")
+        site_id, _, zone = where.rpartition(":")
+        out[(site_id or "default", int(zone))] = int(value)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay an MQTT recording into the runtime")
+    parser.add_argument("recording")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="1 = recorded pace, 1000 = 1000x faster, 0 = as fast as possible")
+    parser.add_argument("--expect", action="append", default=[], metavar="[SITE:]ZONE=STATE",
+                        help="final zone state to assert (repeatable)")
+    parser.add_argument("--coalesce", action="store_true",
+                        help="coalesce relay reports per channel, as the daemon does")
+    parser.add_argument("--dump", action="store_true", help="print the recording and exit")
+    args = parser.parse_args()
+
+    if args.dump:
+        dump(args.recording)
+        return
+    if args.speed < 0 or args.speed > 1000:
+        parser.error("--speed must be between 0 and 1000")
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+    logger = logging.getLogger("replay")
+    logger.setLevel(logging.INFO)
+    result = replay(args.recording, args.speed, os.environ.get("ZONES_CONF", "zones.yaml"), logger,
+                    coalesce=args.coalesce)
+
+    ev = result["relay_events"]
+    print(f"{result['messages']} messages: ingested in {result['ingest_seconds']} s, "
+          f"applied in {result['applied_seconds']} s")
+    print(f"relay events: {ev['delivered']} delivered ({result['events_per_second']}/s), "
+          f"{ev['coalesced']} coalesced, {ev['dropped']} dropped")
+    print(f"published: {result['replay_published']} (recording: {result['recorded_published']})")
+    if result["unrouted"]:
+        print(f"{result['unrouted']} messages matched no site's topics ({result['clients']} broker clients)")
+    for site_id, zones in result["zones"].items():
+        print(f"{site_id}: " + " ".join(f"{zid}={state}" for zid, state in zones.items()))
+    for name, sub in result["bus"]["subscribers"].items():
+        if sub["dropped"] or sub["errors"]:
+            print(f"bus {name}: dropped {sub['dropped']}, errors {sub['errors']}")
+
+    failed = [
+        f"{site_id}:{zid} expected {want}, got {result['zones'].get(site_id, {}).get(zid)}"
+        for (site_id, zid), want in _parse_expect(args.expect).items()
+        if result["zones"].get(site_id, {}).get(zid) != want
+    ]
+    for line in failed:
+        print("FAIL", line)
+    sys.stdout.flush()
+    os._exit(1 if failed else 0)  # skip the runtime's daemon threads
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/python3 -S
+"""
+sprinklerctl — command line client for the control socket (control.py).
+
+Usage:
+  sprinklerctl [-s SOCKET] [--site ID] <command> [args...]
+  sprinklerctl [-s SOCKET] [--site ID] -      one command per stdin line
+
+Commands (see control.py): ping, sites, zones, zone <id>, program,
+on <id> [seconds], off <id>, alloff, run <program id>, abort.
+  sprinklerctl on 3 300
+  sprinklerctl --site nyaralo zones
+  printf 'off 1\\non 2 600\\n' | sprinklerctl -
+
+The socket is -s, else $SPRINKLER_SOCKET, else /run/sprinkler/control.sock.
+Prints each reply's payload; an `err` reply goes to stderr. Exit status:
+0 all ok, 1 an err reply, 2 usage / no daemon. Imports only os, sys and the
+C `_socket` module (`socket` pulls in enum and selectors, ~10 ms on its
+own) and runs with python3 -S, so it starts in a few milliseconds.
+"""
+
+import _socket
+import os
+import sys
+
+DEFAULT_SOCKET = "/run/sprinkler/control.sock"  # = control.DEFAULT_SOCKET
+
+
+def _fail(msg: str) -> int:
+    sys.stderr.write(f"sprinklerctl: {msg}\n")
+    return 2
+
+
+def main(argv: list[str]) -> int:
+    path = os.environ.get("SPRINKLER_SOCKET") or DEFAULT_SOCKET
+    site = None
+    args = argv[1:]
+    while args and args[0].startswith("-") and args[0] != "-":
+        opt = args.pop(0)
+        if opt in ("-h", "--help"):
+            sys.stdout.write(__doc__.lstrip())
+            return 0
+        if opt not in ("-s", "--socket", "--site") or not args:
+            return _fail(f"bad option {opt} (see --help)")
+        if opt == "--site":
+            site = args.pop(0)
+        else:
+            path = args.pop(0)
+    if not args:
+        return _fail("no command (see --help)")
+    if args == ["-"]:
+        lines = [ln.strip() for ln in sys.stdin if ln.strip()]
+    else:
+        lines = [" ".join(args)]
+    if site:
+        lines = [f"@{site} {ln}" for ln in lines]
+    if not lines:
+        return 0
+
+    conn = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+    conn.settimeout(10)
+    try:
+        conn.connect(path)
+        conn.sendall("".join(ln + "\n" for ln in lines).encode("utf-8"))
+        conn.shutdown(_socket.SHUT_WR)
+        buf = b""
+        while buf.count(b"\n") < len(lines):
+            chunk = conn.recv(65536)
+            if not chunk:
+                return _fail("connection closed by the daemon")
+            buf += chunk
+        status = 0
+        for reply in buf.decode("utf-8").split("\n")[:len(lines)]:
+            kind, _, payload = reply.partition(" ")
+            if kind == "ok":
+                if payload:
+                    sys.stdout.write(payload + "\n")
+            else:
+                sys.stderr.write(payload + "\n")
+                status = 1
+        return status
+    except OSError as e:
+        return _fail(f"{path}: {e.strerror or e}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,157 @@
+"""
+static_assets.py — fingerprinted, precompressed static files.
+
+At startup every file under static/ is read once, named after its content
+hash (main.css → main.3f2a9c1b0d.css) and, for text types, compressed with
+gzip and — when the optional `brotli` package is installed — brotli. The
+compressed bytes are cached on disk in static/.build/ by content hash, so a
+restart only pays for files that actually changed; `python3 static_assets.py`
+fills that cache ahead of time (e.g. from deploy.sh).
+
+/assets/<fingerprinted name> serves the smallest variant the browser accepts
+straight from memory with `Cache-Control: immutable` — a changed file gets a
+new URL, so phones never revalidate the old one. Templates link files through
+asset_url("main.css"); unknown names fall back to Flask's plain /static/.
+"""
+
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+from dataclasses import dataclass, field
+
+COMPRESSIBLE = {".css", ".js", ".svg", ".json", ".txt", ".html", ".map"}
+BUILD_DIR = ".build"
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Preferred first; identity is always available
+ENCODINGS = ("br", "gzip")
+_SUFFIX = {"br": ".br", "gzip": ".gz"}
+
+
+@dataclass(slots=True)
+class Asset:
+    name: str            # path under static/, e.g. "vendor/htmx.min.js"
+    url_name: str        # fingerprinted, e.g. "vendor/htmx.min.1a2b3c4d5e.js"
+    digest: str
+    mimetype: str
+    variants: dict[str, bytes] = field(default_factory=dict)  # encoding → body; "identity" always set
+
+
+def fingerprinted(name: str, digest: str) -> str:
+    head, tail = os.path.split(name)
+    stem, ext = os.path.splitext(tail)
+    return os.path.join(head, f"{stem}.{digest}{ext}").replace(os.sep, "/")
+
+
+def _compressors() -> dict:
+    out = {"gzip": lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli  # optional: pip install brotli
+        out["br"] = lambda data: brotli.compress(data, quality=11)
+    except ImportError:
+        pass
+    return out
+
+
+class StaticAssets:
+    def __init__(self, static_dir: str, logger: logging.Logger | None = None):
+        self.static_dir = static_dir
+        self.build_dir = os.path.join(static_dir, BUILD_DIR)
+        self.logger = logger or logging.getLogger(__name__)
+        self.by_name: dict[str, Asset] = {}
+        self.by_url: dict[str, Asset] = {}
+
+    def build(self) -> "StaticAssets":
+        compressors = _compressors()
+        by_name = {}
+        for root, dirs, files in os.walk(self.static_dir):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            for fname in sorted(files):
+                if fname.startswith("."):
+                    continue
+                path = os.path.join(root, fname)
+                name = os.path.relpath(path, self.static_dir).replace(os.sep, "/")
+                by_name[name] = self._load(name, path, compressors)
+        self.by_name = by_name
+        self.by_url = {a.url_name: a for a in by_name.values()}
+        self.logger.info("static assets: %d files, encodings %s",
+                         len(by_name), ",".join(sorted(compressors)))
+        return self
+
+    def _load(self, name: str, path: str, compressors: dict) -> Asset:
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:10]
+        asset = Asset(
+            name=name,
+            url_name=fingerprinted(name, digest),
+            digest=digest,
+            mimetype=mimetypes.guess_type(name)[0] or "application/octet-stream",
+            variants={"identity": data},
+        )
+        if os.path.splitext(name)[1].lower() not in COMPRESSIBLE:
+            return asset
+        for enc, compress in compressors.items():
+            body = self._cached_variant(digest, enc, data, compress)
+            # Tiny files can come out larger; not worth a Content-Encoding then
+            if len(body) < len(data) * 0.95:
+                asset.variants[enc] = body
+        return asset
+
+    def _cached_variant(self, digest: str, enc: str, data: bytes, compress) -> bytes:
+        cache_path = os.path.join(self.build_dir, digest + _SUFFIX[enc])
+        try:
+            with open(cache_path, "rb") as f:
+                return f.read()
+        except OSError:
+            pass
+        body = compress(data)
+        tmp = f"{cache_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.build_dir, exist_ok=True)
+            with open(tmp, "wb") as f:
+                f.write(body)
+            os.replace(tmp, cache_path)
+        except OSError as e:
+            # Read-only install: compress again on the next start, nothing else lost
+            self.logger.debug("static asset cache not written (%s): %s", cache_path, e)
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+        return body
+
+    def url_name(self, name: str) -> str | None:
+        asset = self.by_name.get(name)
+        return asset.url_name if asset else None
+
+    def lookup(self, url_name: str) -> Asset | None:
+        return self.by_url.get(url_name)
+
+    @staticmethod
+    def negotiate(asset: Asset, accept_encodings) -> str:
+        """Best encoding for a werkzeug Accept object (request.accept_encodings)."""
+        for enc in ENCODINGS:
+            if enc in asset.variants and accept_encodings[enc] > 0:
+                return enc
+        return "identity"
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Precompress static/ into static/.build/")
+    parser.add_argument("static_dir", nargs="?",
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "static"))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    assets = StaticAssets(args.static_dir).build()
+    for a in assets.by_name.values():
+        sizes = " ".join(f"{enc}={len(body)}" for enc, body in a.variants.items())
+        print(f"{a.url_name}: {sizes}")
+
+
+if __name__ == "__main__":
+    main()
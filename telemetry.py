@@ -0,0 +1,203 @@
+"""
+telemetry.py — soil-moisture probe ingestion.
+
+Probes publish a number (percent) every few seconds on a per-zone topic,
+e.g. soil/{zone}/moisture. The MQTT callback only puts (zone level, payload,
+timestamp) on a bounded queue and returns, so relay-state messages handled
+by the same paho thread are never held up; a full queue drops and counts.
+One worker thread per site drains the queue in batches, parses the
+samples and appends them to per-zone RollingWindows, which keep min, mean
+and max over the last `window_seconds` incrementally (running sum +
+monotonic deques — O(1) amortised per sample).
+
+Programs with `moisture_skip: true` ask adjust_step() before each step: at
+or above `skip_above` the step is skipped, between `shorten_above` and
+`skip_above` it is shortened linearly.
+"""
+
+import logging
+import math
+import queue
+import threading
+import time
+from collections import deque
+
+DEFAULTS = {
+    "topic": "soil/{zone}/moisture",  # {zone} = zone id, a whole topic level
+    "window_seconds": 600,            # rolling min/mean/max window
+    "buffer_size": 1000,              # samples kept per zone
+    "queue_size": 20000,              # samples waiting for the worker
+    "max_age_seconds": 900,           # older readings are ignored by adjust_step
+    "skip_above": None,               # % — skip the step at or above this mean
+    "shorten_above": None,            # % — shorten the step linearly above this mean
+}
+
+_BATCH = 500
+
+
+class RollingWindow:
+    """Time- and size-bounded sample window with incremental min/mean/max."""
+
+    def __init__(self, window_seconds: float, maxlen: int):
+        self.window_seconds = window_seconds
+        self.maxlen = maxlen
+        self._samples: deque = deque()  # (seq, ts, value)
+        self._min: deque = deque()      # (seq, value), values increasing
+        self._max: deque = deque()      # (seq, value), values decreasing
+        self._sum = 0.0
+        self._seq = 0
+
+    def add(self, ts: float, value: float) -> None:
+        seq = self._seq
+        self._seq += 1
+        self._samples.append((seq, ts, value))
+        self._sum += value
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((seq, value))
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((seq, value))
+        self._evict(ts)
+
+    def _evict(self, now: float) -> None:
+        cutoff = now - self.window_seconds
+        samples = self._samples
+        while samples and (samples[0][1] < cutoff or len(samples) > self.maxlen):
+            seq, _, value = samples.popleft()
+            self._sum -= value
+            if self._min[0][0] == seq:
+                self._min.popleft()
+            if self._max[0][0] == seq:
+                self._max.popleft()
+        if not samples:
+            self._sum = 0.0  # drop accumulated float error
+
+    def stats(self, now: float | None = None) -> dict | None:
+        self._evict(time.time() if now is None else now)
+        if not self._samples:
+            return None
+        n = len(self._samples)
+        _, last_ts, last = self._samples[-1]
+        return {
+            "count": n,
+            "min": self._min[0][1],
+            "mean": round(self._sum / n, 2),
+            "max": self._max[0][1],
+            "last": last,
+            "last_ts": last_ts,
+        }
+
+
+class MoisturePipeline:
+    def __init__(self, conf: dict, zone_ids, logger=None):
+        self.conf = {**DEFAULTS, **(conf or {})}
+        self.logger = logger or logging.getLogger(__name__)
+        self.zone_ids = set(zone_ids)
+        self.windows: dict[int, RollingWindow] = {
+            zid: RollingWindow(float(self.conf["window_seconds"]), int(self.conf["buffer_size"]))
+            for zid in self.zone_ids
+        }
+        self._queue: queue.Queue = queue.Queue(maxsize=int(self.conf["queue_size"]))
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self.received = 0
+        self.dropped = 0
+        self.parse_errors = 0
+        self.unknown_zone = 0
+        self.batches = 0
+
+    @property
+    def topic_filter(self) -> str:
+        return self.conf["topic"].replace("{zone}", "+")
+
+    def attach(self, mqttc) -> None:
+        """Subscribe the probe topics and start the worker."""
+        mqttc.subscribe(self.topic_filter, self.enqueue)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._worker, daemon=True, name="moisture")
+            self._thread.start()
+
+    # ----- ingestion (MQTT thread) -----
+
+    def enqueue(self, payload: bytes, zone_level: str) -> None:
+        try:
+            self._queue.put_nowait((zone_level, payload, time.time()))
+            self.received += 1
+        except queue.Full:
+            self.dropped += 1
+
+    # ----- worker -----
+
+    def _worker(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < _BATCH:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            self.ingest(batch)
+
+    def ingest(self, batch) -> None:
+        """Parse and store (zone_level, payload, ts) samples."""
+        parsed = []
+        for zone_level, payload, ts in batch:
+            try:
+                zid = int(zone_level)
+                value = float(payload)
+            except ValueError:
+                self.parse_errors += 1
+                continue
+            if not math.isfinite(value):  # "nan" / "inf" parse, but would poison the window sums
+                self.parse_errors += 1
+                continue
+            if zid not in self.zone_ids:
+                self.unknown_zone += 1
+                continue
+            parsed.append((zid, ts, value))
+        with self._lock:
+            windows = self.windows
+            for zid, ts, value in parsed:
+                windows[zid].add(ts, value)
+            self.batches += 1
+
+    # ----- queries -----
+
+    def zone_stats(self, zone_id: int, now: float | None = None) -> dict | None:
+        w = self.windows.get(zone_id)
+        if w is None:
+            return None
+        with self._lock:
+            return w.stats(now)
+
+    def adjust_step(self, zone_id: int, seconds: int, now: float | None = None) -> int:
+        """Step duration after the moisture rule (0 = skip). Unknown/stale zones are unchanged."""
+        skip_above, shorten_above = self.conf["skip_above"], self.conf["shorten_above"]
+        if skip_above is None and shorten_above is None:
+            return seconds
+        now = time.time() if now is None else now
+        st = self.zone_stats(zone_id, now)
+        if st is None or now - st["last_ts"] > float(self.conf["max_age_seconds"]):
+            return seconds
+        mean = st["mean"]
+        if skip_above is not None and mean >= skip_above:
+            self.logger.info("Zone %d soil moisture %.1f%% ≥ %s%% — skipping step", zone_id, mean, skip_above)
+            return 0
+        if shorten_above is not None and mean > shorten_above:
+            top = skip_above if skip_above is not None else 100.0
+            factor = max(0.0, (top - mean) / (top - shorten_above))
+            adjusted = int(seconds * factor)
+            self.logger.info("Zone %d soil moisture %.1f%% — step %ds → %ds", zone_id, mean, seconds, adjusted)
+            return adjusted
+        return seconds
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "dropped": self.dropped,
+            "parse_errors": self.parse_errors,
+            "unknown_zone": self.unknown_zone,
+            "batches": self.batches,
+            "queued": self._queue.qsize(),
+        }
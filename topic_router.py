@@ -0,0 +1,76 @@
+"""
+topic_router.py — MQTT topic → handler routing trie.
+
+Topics are split on "/" and walked level by level, so a lookup costs one
+dict probe per topic level no matter how many devices or channels are
+registered. Patterns may use the MQTT wildcards "+" (one level, captured)
+and "#" (rest of the topic, captured as a single string). Exact levels win
+over "+", which wins over "#".
+"""
+
+
+class _Node:
+    __slots__ = ("children", "handler")
+
+    def __init__(self):
+        self.children: dict[str, "_Node"] = {}
+        self.handler = None
+
+
+class TopicTrie:
+    def __init__(self):
+        self._root = _Node()
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, pattern: str, handler) -> None:
+        """Route `pattern` to `handler`, replacing any previous handler."""
+        node = self._root
+        levels = pattern.split("/")
+        for i, level in enumerate(levels):
+            if level == "#" and i != len(levels) - 1:
+                raise ValueError(f"'#' must be the last level: {pattern!r}")
+            node = node.children.setdefault(level, _Node())
+        if node.handler is None:
+            self._count += 1
+        node.handler = handler
+
+    def remove(self, pattern: str) -> None:
+        node = self._root
+        for level in pattern.split("/"):
+            node = node.children.get(level)
+            if node is None:
+                return
+        if node.handler is not None:
+            node.handler = None
+            self._count -= 1
+
+    def match(self, topic: str):
+        """Return (handler, captured_levels) for `topic`, or None."""
+        return self._match(self._root, topic.split("/"), 0, ())
+
+    def _match(self, node: _Node, levels: list[str], i: int, captured: tuple):
+        if i == len(levels):
+            if node.handler is not None:
+                return node.handler, captured
+            hash_node = node.children.get("#")  # "a/#" also matches "a"
+            if hash_node is not None and hash_node.handler is not None:
+                return hash_node.handler, captured + ("",)
+            return None
+        level = levels[i]
+        child = node.children.get(level)
+        if child is not None:
+            hit = self._match(child, levels, i + 1, captured)
+            if hit:
+                return hit
+        child = node.children.get("+")
+        if child is not None:
+            hit = self._match(child, levels, i + 1, captured + (level,))
+            if hit:
+                return hit
+        child = node.children.get("#")
+        if child is not None and child.handler is not None:
+            return child.handler, captured + ("/".join(levels[i:]),)
+        return None
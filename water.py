@@ -0,0 +1,221 @@
+"""
+water.py — per-run water volume accounting.
+
+Every zone run (Site.start_run → Site.stop_run) becomes one record:
+timestamp, local day, zone, program, seconds and litres. Litres come from a
+mainline pulse meter when one is configured and counted pulses during the
+run (only one relay is on at a time, so pulses belong to the running zone),
+otherwise from the zone's nominal `flow_lpm`. Pulses with no zone running
+are kept as `unattributed_litres` — a leak hint.
+
+Records are stored column-wise in array.array buffers (compact, append-only)
+and appended to a CSV so history survives restarts. Reports copy the
+columns into NumPy arrays and aggregate per zone / day / program with
+np.unique + np.bincount, so a whole season is summed without a Python loop
+per record. numpy is imported only when a report is requested
+(GET /api/water); the dashboard's per-zone totals come from running
+day → zone → litres sums kept on every append.
+"""
+
+import csv
+import logging
+import os
+import threading
+import time
+from array import array
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+
+MANUAL = "manual"
+_FIELDS = ("ts", "day", "zone_id", "seconds", "litres", "program")
+
+
+class WaterLedger:
+    def __init__(self, flow_lpm: dict[int, float], path: str | None = None,
+                 timezone: str = "UTC", pulses_per_litre: float | None = None, logger=None):
+        self.flow_lpm = dict(flow_lpm)  # zone_id → nominal litres/minute (0 = unknown)
+        self.path = path
+        self.tz = ZoneInfo(timezone)
+        self.pulses_per_litre = pulses_per_litre
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._ts = array("d")
+        self._day = array("i")       # date.toordinal() in the site's timezone
+        self._zone = array("i")
+        self._prog = array("i")      # index into program_names
+        self._seconds = array("d")
+        self._litres = array("d")
+        self.program_names: list[str] = [MANUAL]
+        self._litres_by_day: dict[int, dict[int, float]] = {}  # day → zone_id → litres
+        self._prog_codes: dict[str, int] = {MANUAL: 0}
+
+        self._open: dict[int, dict] = {}   # zone_id → {"started_at", "program", "metered"}
+        self._last_pulses: float | None = None
+        self.unattributed_litres = 0.0
+        self._lock = threading.Lock()
+
+    # ----- persistence -----
+
+    def load(self) -> int:
+        """Read the CSV history (if any). Returns the number of records loaded."""
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        n = 0
+        with open(self.path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                try:
+                    self._append(float(row["ts"]), int(row["day"]), int(row["zone_id"]),
+                                 row.get("program") or MANUAL, float(row["seconds"]), float(row["litres"]))
+                    n += 1
+                except (KeyError, TypeError, ValueError):
+                    continue
+        self.logger.info("water: %d runs loaded from %s", n, self.path)
+        return n
+
+    def _persist(self, rec: dict) -> None:
+        if not self.path:
+            return
+        try:
+            new = not os.path.exists(self.path)
+            with open(self.path, "a", newline="", encoding="utf-8") as f:
+                w = csv.DictWriter(f, fieldnames=_FIELDS)
+                if new:
+                    w.writeheader()
+                w.writerow(rec)
+        except OSError as e:
+            self.logger.warning("water: cannot append to %s (%s)", self.path, e)
+
+    def _append(self, ts, day, zone_id, program, seconds, litres) -> None:
+        code = self._prog_codes.get(program)
+        if code is None:
+            code = self._prog_codes[program] = len(self.program_names)
+            self.program_names.append(program)
+        self._ts.append(ts)
+        self._day.append(day)
+        self._zone.append(zone_id)
+        self._prog.append(code)
+        self._seconds.append(seconds)
+        self._litres.append(litres)
+        by_zone = self._litres_by_day.setdefault(day, {})
+        by_zone[zone_id] = by_zone.get(zone_id, 0.0) + litres
+
+    def __len__(self) -> int:
+        return len(self._ts)
+
+    # ----- runs -----
+
+    def run_started(self, zone_id: int, program: str | None = None, now: float | None = None) -> None:
+        with self._lock:
+            if zone_id not in self._open:
+                self._open[zone_id] = {
+                    "started_at": time.time() if now is None else now,
+                    "program": program or MANUAL,
+                    "metered": None,
+                }
+
+    def run_finished(self, zone_id: int, now: float | None = None) -> dict | None:
+        now = time.time() if now is None else now
+        with self._lock:
+            run = self._open.pop(zone_id, None)
+            if run is None:
+                return None
+            seconds = max(0.0, now - run["started_at"])
+            litres = run["metered"]
+            if litres is None:
+                litres = self.flow_lpm.get(zone_id, 0.0) * seconds / 60
+            day = datetime.fromtimestamp(run["started_at"], self.tz).date().toordinal()
+            self._append(run["started_at"], day, zone_id, run["program"], seconds, litres)
+        rec = {"ts": round(run["started_at"], 3), "day": day, "zone_id": zone_id,
+               "seconds": round(seconds, 1), "litres": round(litres, 2), "program": run["program"]}
+        self._persist(rec)
+        return rec
+
+    def live_litres(self, zone_id: int, now: float | None = None) -> float:
+        """Volume so far of the zone's open run (0 when idle)."""
+        with self._lock:
+            run = self._open.get(zone_id)
+            if run is None:
+                return 0.0
+            if run["metered"] is not None:
+                return run["metered"]
+            seconds = (time.time() if now is None else now) - run["started_at"]
+            return self.flow_lpm.get(zone_id, 0.0) * max(0.0, seconds) / 60
+
+    # ----- pulse meter -----
+
+    def on_meter(self, payload: bytes) -> None:
+        """Cumulative pulse count from the mainline meter (a counter reset restarts from 0)."""
+        try:
+            pulses = float(payload)
+        except ValueError:
+            return
+        with self._lock:
+            last, self._last_pulses = self._last_pulses, pulses
+            if last is None:
+                return
+            delta = pulses - last if pulses >= last else pulses
+            litres = delta / self.pulses_per_litre
+            if not self._open:
+                if litres > 0:
+                    self.unattributed_litres += litres
+                    self.logger.warning("water: %.1f l metered with no zone running", litres)
+                return
+            share = litres / len(self._open)
+            for run in self._open.values():
+                run["metered"] = (run["metered"] or 0.0) + share
+
+    # ----- reports -----
+
+    def _columns(self):
+        import numpy as np
+        with self._lock:
+            return (np.array(self._day, dtype=np.int32), np.array(self._zone, dtype=np.int32),
+                    np.array(self._prog, dtype=np.int32), np.array(self._seconds, dtype=np.float64),
+                    np.array(self._litres, dtype=np.float64), list(self.program_names))
+
+    @staticmethod
+    def _group(keys, seconds, litres):
+        import numpy as np
+        uniq, inv = np.unique(keys, return_inverse=True)
+        return (uniq,
+                np.bincount(inv, minlength=len(uniq)),
+                np.bincount(inv, weights=seconds, minlength=len(uniq)),
+                np.bincount(inv, weights=litres, minlength=len(uniq)))
+
+    def report(self, start: date | None = None, end: date | None = None) -> dict:
+        """Totals per zone, day and program for runs started between start and end (inclusive)."""
+        import numpy as np
+        day, zone, prog, seconds, litres, names = self._columns()
+        mask = np.ones(len(day), dtype=bool)
+        if start is not None:
+            mask &= day >= start.toordinal()
+        if end is not None:
+            mask &= day <= end.toordinal()
+        day, zone, prog, seconds, litres = day[mask], zone[mask], prog[mask], seconds[mask], litres[mask]
+        return {
+            "runs": int(mask.sum()),
+            "litres": round(float(litres.sum()), 1),
+            "minutes": round(float(seconds.sum()) / 60, 1),
+            "unattributed_litres": round(self.unattributed_litres, 1),
+            "by_zone": self._rows(zone, seconds, litres, "zone_id", int),
+            "by_day": self._rows(day, seconds, litres, "date", lambda d: date.fromordinal(d).isoformat()),
+            "by_program": self._rows(prog, seconds, litres, "program", lambda c: names[c]),
+        }
+
+    def _rows(self, keys, seconds, litres, field, label) -> list[dict]:
+        uniq, runs, secs, lit = self._group(keys, seconds, litres)
+        return [
+            {field: label(k), "runs": int(r), "minutes": round(float(s) / 60, 1), "litres": round(float(l), 1)}
+            for k, r, s, l in zip(uniq.tolist(), runs.tolist(), secs.tolist(), lit.tolist())
+        ]
+
+    def zone_totals(self, since: date | None = None) -> dict[int, float]:
+        """{zone_id: litres} for runs since `since` (dashboard; from the running sums, no numpy)."""
+        first = since.toordinal() if since is not None else None
+        totals: dict[int, float] = {}
+        with self._lock:
+            for day, by_zone in self._litres_by_day.items():
+                if first is None or day >= first:
+                    for zone_id, litres in by_zone.items():
+                        totals[zone_id] = totals.get(zone_id, 0.0) + litres
+        return {zone_id: round(litres, 1) for zone_id, litres in totals.items()}
@@ -0,0 +1,180 @@
+"""
+weather.py — evapotranspiration-based scaling of program step durations.
+
+Reads daily weather CSVs (history and/or forecast; later files win on the
+same date) with columns  date,tmin,tmax[,precip_mm]  and computes reference
+evapotranspiration with the Hargreaves formula (FAO-56 eq. 52, extraterrestrial
+radiation from latitude + day of year), vectorised over the whole date range
+at once. The daily water need is  ET0 − rain_efficiency × precipitation,
+averaged over the last `lookback_days`, and the scaling factor is
+need / reference_et0_mm, clipped to [min_factor, max_factor] and multiplied
+by each zone's crop_coefficient. The whole (days × zones) factor table is
+computed once and cached; it is rebuilt only when a CSV file changes, so
+jobs.start_scheduled_program only does a dict lookup.
+"""
+
+import csv
+import logging
+import os
+import threading
+from datetime import date
+
+import numpy as np
+
+DEFAULTS = {
+    "csv": "weather.csv",          # path or list of paths
+    "latitude": 47.5,              # degrees, for extraterrestrial radiation
+    "reference_et0_mm": 4.0,       # ET0 (mm/day) at which durations are unchanged
+    "lookback_days": 3,            # averaging window ending on the run day
+    "rain_efficiency": 0.8,        # share of precipitation counted as irrigation
+    "min_factor": 0.3,
+    "max_factor": 1.6,
+}
+
+_GSC = 0.0820  # solar constant, MJ m-2 min-1
+
+
+def extraterrestrial_radiation(doy, latitude_deg):
+    """Ra in mm/day of evaporation equivalent (FAO-56 eq. 21, × 0.408)."""
+    phi = np.deg2rad(latitude_deg)
+    doy = np.asarray(doy, dtype=float)
+    dr = 1 + 0.033 * np.cos(2 * np.pi / 365 * doy)
+    delta = 0.409 * np.sin(2 * np.pi / 365 * doy - 1.39)
+    ws = np.arccos(np.clip(-np.tan(phi) * np.tan(delta), -1.0, 1.0))
+    ra = (24 * 60 / np.pi) * _GSC * dr * (
+        ws * np.sin(phi) * np.sin(delta) + np.cos(phi) * np.cos(delta) * np.sin(ws)
+    )
+    return 0.408 * ra
+
+
+def hargreaves_et0(tmin, tmax, doy, latitude_deg):
+    """Reference evapotranspiration (mm/day) for arrays of daily tmin/tmax (°C)."""
+    tmin = np.asarray(tmin, dtype=float)
+    tmax = np.asarray(tmax, dtype=float)
+    tmean = (tmin + tmax) / 2
+    ra = extraterrestrial_radiation(doy, latitude_deg)
+    return 0.0023 * ra * (tmean + 17.8) * np.sqrt(np.maximum(tmax - tmin, 0.0))
+
+
+def rolling_mean(values, window: int, dates=None):
+    """
+    Trailing mean over the `window` calendar days ending on each of the
+    sorted `dates`: days missing from the CSVs are left out, not replaced by
+    older rows. Without `dates` the values are consecutive days.
+    """
+    values = np.asarray(values, dtype=float)
+    csum = np.concatenate(([0.0], np.cumsum(values)))
+    idx = np.arange(1, len(values) + 1)
+    if dates is None:
+        lo = np.maximum(idx - window, 0)
+    else:
+        lo = np.searchsorted(dates, dates - np.timedelta64(window - 1, "D"), side="left")
+    return (csum[idx] - csum[lo]) / (idx - lo)
+
+
+def read_weather(paths) -> tuple:
+    """(dates as datetime64[D], tmin, tmax, precip) from the CSVs, sorted, one row per date."""
+    rows: dict[str, tuple[float, float, float]] = {}
+    for path in paths:
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                try:
+                    rows[row["date"].strip()] = (
+                        float(row["tmin"]),
+                        float(row["tmax"]),
+                        float(row.get("precip_mm") or 0.0),
+                    )
+                except (KeyError, TypeError, ValueError):
+                    continue  # header variants / blank or partial lines
+    if not rows:
+        return np.array([], dtype="datetime64[D]"), *(np.array([]) for _ in range(3))
+    days = sorted(rows)
+    data = np.array([rows[d] for d in days], dtype=float)
+    return np.array(days, dtype="datetime64[D]"), data[:, 0], data[:, 1], data[:, 2]
+
+
+def compute_factors(dates, tmin, tmax, precip, crop_coefficients, conf: dict):
+    """(et0 per day, factor matrix days × zones) for the given series."""
+    conf = {**DEFAULTS, **(conf or {})}
+    doy = (dates - dates.astype("datetime64[Y]")).astype(int) + 1
+    et0 = hargreaves_et0(tmin, tmax, doy, float(conf["latitude"]))
+    need = np.maximum(et0 - float(conf["rain_efficiency"]) * precip, 0.0)
+    need = rolling_mean(need, int(conf["lookback_days"]), dates)
+    base = np.clip(need / float(conf["reference_et0_mm"]),
+                   float(conf["min_factor"]), float(conf["max_factor"]))
+    return et0, base[:, None] * np.asarray(crop_coefficients, dtype=float)[None, :]
+
+
+class WeatherScaler:
+    """Cached per-day, per-zone duration factors for one site."""
+
+    def __init__(self, conf: dict, crop_coefficients: dict[int, float], logger=None):
+        self.conf = {**DEFAULTS, **(conf or {})}
+        paths = self.conf["csv"]
+        self.paths = [paths] if isinstance(paths, str) else list(paths)
+        self.zone_ids = list(crop_coefficients)
+        self._kc = [crop_coefficients[z] for z in self.zone_ids]
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._signature = None
+        self._table: dict[str, tuple[float, dict[int, float]]] = {}  # ISO date → (et0, {zone: factor})
+
+    def _current_signature(self):
+        sig = []
+        for p in self.paths:
+            try:
+                st = os.stat(p)
+                sig.append((p, st.st_mtime_ns, st.st_size))
+            except OSError:
+                sig.append((p, None, None))
+        return tuple(sig)
+
+    def refresh(self, force: bool = False) -> bool:
+        """Rebuild the factor table if a CSV changed. Returns True when rebuilt."""
+        sig = self._current_signature()
+        with self._lock:
+            if not force and sig == self._signature:
+                return False
+            readable = [p for p, mtime, _ in sig if mtime is not None]
+            try:
+                dates, tmin, tmax, precip = read_weather(readable)
+            except OSError as e:
+                self.logger.warning("weather: cannot read %s (%s)", readable, e)
+                dates = np.array([], dtype="datetime64[D]")
+            table = {}
+            if len(dates):
+                et0, factors = compute_factors(dates, tmin, tmax, precip, self._kc, self.conf)
+                rounded = np.round(factors, 3).tolist()
+                for d, e, row in zip(dates.astype(str).tolist(), et0.tolist(), rounded):
+                    table[d] = (round(e, 2), dict(zip(self.zone_ids, row)))
+            self._table = table
+            self._signature = sig
+        self.logger.info("weather: %d days of factors from %s", len(table), readable)
+        return True
+
+    def factors(self, day: date) -> dict[int, float] | None:
+        """{zone_id: factor} for `day`, or None when the weather files don't cover it."""
+        self.refresh()
+        entry = self._table.get(day.isoformat())
+        return entry[1] if entry else None
+
+    def day(self, day: date) -> dict | None:
+        self.refresh()
+        entry = self._table.get(day.isoformat())
+        if entry is None:
+            return None
+        return {"date": day.isoformat(), "et0_mm": entry[0], "factors": entry[1]}
+
+    def scale_steps(self, steps, day: date, max_seconds: int | None = None):
+        """[(zone_id, seconds)] scaled for `day`; unchanged when there is no weather data."""
+        factors = self.factors(day)
+        if factors is None:
+            self.logger.info("weather: no data for %s — durations unchanged", day)
+            return steps
+        out = []
+        for zone_id, seconds in steps:
+            scaled = int(round(seconds * factors.get(zone_id, 1.0)))
+            if max_seconds:
+                scaled = min(scaled, max_seconds)
+            out.append((zone_id, scaled))
+        return out